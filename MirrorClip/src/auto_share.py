@@ -0,0 +1,150 @@
+# auto_share.py
+# Compartición automática de clips según reglas de mirror_clip.conf, sin pasar por el menú.
+#
+#   [group:oficina]
+#   peers = 192.168.1.10, 192.168.1.11
+#
+#   [autoshare:texto]
+#   peers = @oficina, 192.168.1.20
+#   types = text, html
+#   max_size = 65536
+#   exclude = (?i)password|contraseña
+#       ^\S{24,}$
+#   debounce = 0.5
+#
+# Para cada peer se aplica la primera regla (en el orden del archivo) que admite el clip. Las
+# exclusiones valen para todas las reglas: un clip que coincide con la de cualquier regla no se
+# comparte automáticamente. Los clips que ninguna regla admite siguen mostrando el menú de compartir.
+import re
+import threading
+import logging
+import clip_format
+from net_settings import cargar_reglas_autoshare
+
+logger = logging.getLogger(__name__)
+
+TRUSTED = "trusted"
+_TYPES = {
+    "text": lambda mime: mime == clip_format.TEXT,
+    "html": lambda mime: mime == clip_format.HTML,
+    "image": clip_format.is_image,
+}
+
+
+class AutoShareRule:
+    """Una sección [autoshare:<nombre>] ya validada."""
+
+    def __init__(self, config, groups):
+        self.name = config["name"]
+        self.peers = []
+        for peer in config["peers"]:
+            if peer.startswith("@"):
+                members = groups.get(peer[1:])
+                if members is None:
+                    logger.warning(f"Regla '{self.name}': grupo desconocido '{peer}'.")
+                    continue
+                self.peers.extend(members)
+            else:
+                self.peers.append(peer)
+        self.types = []
+        for name in config["types"]:
+            if name in _TYPES:
+                self.types.append(_TYPES[name])
+            else:
+                logger.warning(f"Regla '{self.name}': tipo desconocido '{name}'. Se ignora.")
+        self.min_size = config["min_size"]
+        self.max_size = config["max_size"]
+        self.exclude = [re.compile(pattern, re.MULTILINE) for pattern in config["exclude"]]
+        self.debounce = max(0.0, config["debounce"])
+
+    def matches(self, mime, body):
+        size = len(body)
+        if size < self.min_size or (self.max_size and size > self.max_size):
+            return False
+        return not self.types or any(accepts(mime) for accepts in self.types)
+
+    def excludes(self, text):
+        return any(pattern.search(text) for pattern in self.exclude)
+
+    def targets(self, trusted):
+        """Peers de la regla a los que se puede enviar (solo confiables)."""
+        if TRUSTED in self.peers:
+            return list(trusted)
+        return [ip for ip in self.peers if ip in trusted]
+
+
+class AutoSharer:
+    """Aplica las reglas a cada clip copiado y lo encola para los peers que correspondan.
+
+    Con 'debounce' el envío se retrasa: si se copia otra cosa antes, el clip pendiente se
+    descarta y solo se comparte el último (latest-wins). También se descarta si antes llega un
+    clip de otro peer (cancel()), que ya es más reciente.
+    """
+
+    def __init__(self, conn_manager, rules=None, groups=None):
+        self.conn_manager = conn_manager
+        if rules is None:
+            rules, groups = cargar_reglas_autoshare()
+        self.rules = []
+        for config in rules:
+            try:
+                self.rules.append(AutoShareRule(config, groups or {}))
+            except re.error as e:
+                logger.warning(f"Regla de compartición automática '{config['name']}' ignorada: expresión inválida ({e}).")
+        self._timers = []
+        self._lock = threading.Lock()
+        if self.rules:
+            logger.info(f"Compartición automática activa con {len(self.rules)} regla(s): {', '.join(r.name for r in self.rules)}.")
+
+    def offer(self, content):
+        """Comparte 'content' (sobre de clip_format) según las reglas. False si ninguna lo admite."""
+        with self._lock:
+            for timer in self._timers: # Un clip nuevo reemplaza a los que esperaban su debounce
+                timer.cancel()
+            self._timers = []
+        if not self.rules:
+            return False
+        try:
+            mime, body = clip_format.unpack(content)
+        except clip_format.ClipFormatError:
+            return False
+        if not clip_format.is_image(mime) and any(rule.exclude for rule in self.rules):
+            text = bytes(body).decode('utf-8', errors='replace')
+            for rule in self.rules:
+                if rule.excludes(text):
+                    logger.info(f"Regla '{rule.name}': el clip coincide con una exclusión; no se comparte automáticamente.")
+                    return False
+
+        trusted = set(self.conn_manager.get_trusted_peers())
+        assigned = set()
+        batches = [] # [(regla, [ips])]
+        for rule in self.rules:
+            if not rule.matches(mime, body):
+                continue
+            ips = [ip for ip in dict.fromkeys(rule.targets(trusted)) if ip not in assigned]
+            if ips:
+                assigned.update(ips)
+                batches.append((rule, ips))
+        if not batches:
+            return False
+
+        for rule, ips in batches:
+            if rule.debounce:
+                timer = threading.Timer(rule.debounce, self._dispatch, (rule, ips, content))
+                timer.daemon = True
+                with self._lock:
+                    self._timers.append(timer)
+                timer.start()
+            else:
+                self._dispatch(rule, ips, content)
+        return True
+
+    def _dispatch(self, rule, ips, content):
+        logger.info(f"Compartición automática (regla '{rule.name}') a {', '.join(ips)}: {clip_format.preview(content, 30)}...")
+        self.conn_manager.queue_to_peers(ips, content)
+
+    def cancel(self):
+        with self._lock:
+            for timer in self._timers:
+                timer.cancel()
+            self._timers = []
@@ -6,13 +6,20 @@ import select
 import random
 from config_paths import TRUSTED_USERS_FILE, BANNED_USERS_FILE # KNOWN_PEER_DETAILS_FILE se usa a través de peer_utils
 from config import PORT # USERNAME no se usa aquí directamente, se recibe de los peers
-from discovery import obtener_broadcast # Asegúrate que esta función esté disponible
-from peer_utils import update_peer_details, load_known_peer_details # Nuevas importaciones
+from discovery import abrir_sockets_por_interfaz, enviar_por_interfaces, registrar_hello
+from network_topology import get_topology
+from peer_registry import get_registry
 import logging
 
 logger = logging.getLogger(__name__)
 BROADCAST_MESSAGE = b"MirrorClip-Discovery"
 
+DISCOVERY_TIMEOUT = 6 # Segundos máximos de una búsqueda
+RETRY_OFFSETS = (0.0, 0.3, 0.8) # Instantes (s desde el inicio) de los envíos del mensaje; se añade algo de azar
+IDLE_MIN = 0.25 # Silencio mínimo (s) tras la última respuesta para dar la búsqueda por terminada
+IDLE_MAX = 1.5 # Silencio máximo: la ventana crece con la separación observada entre respuestas
+IDLE_FACTOR = 3.0 # La ventana de silencio es este múltiplo del mayor hueco entre respuestas
+
 def cargar_lista(archivo):
     try:
         with open(archivo, 'r', encoding='utf-8') as f: # Especificar encoding
@@ -30,9 +37,23 @@ def guardar_lista(archivo, lista_data): # Cambiado nombre de 'lista' a 'lista_da
         logger.error(f"No se pudo guardar la lista en {archivo}: {e}")
 
 
-def descubrir_peers():
+def descubrir_peers(on_peer=None, early_exit=True):
+    """Busca peers enviando el mensaje de descubrimiento por todas las interfaces IPv4 a la vez.
+
+    Las respuestas se unen y se deduplican por identidad del peer (usuario, equipo e IP principal
+    anunciada): un equipo alcanzado por dos interfaces cuenta una sola vez, pero dos equipos
+    clonados con el mismo usuario y nombre no se confunden. Se anota por qué interfaz se alcanzó cada
+    peer. Devuelve la lista de IPs encontradas.
+
+    Con 'early_exit' la búsqueda termina en cuanto han respondido todos los peers esperados
+    (confiables y vistos recientemente), o cuando tras el último envío no llega nada durante una
+    ventana de silencio que se adapta al ritmo de las respuestas. Sin él se espera siempre
+    DISCOVERY_TIMEOUT segundos. on_peer(ip) se llama con cada peer nuevo según va respondiendo.
+    """
     logger.info(">>> [PEER DISCOVERY] Iniciando búsqueda de peers...")
     peers_discovered_ips = set()
+    identities = {} # {(usuario, equipo, ip anunciada): ip}, para no contar dos veces un peer con varias interfaces
+    sockets = {} # {socket: Interface}
     # Cargar detalles existentes para acceso rápido y evitar I/O repetida en get_peer_display_name si se usara aquí
     # known_details = load_known_peer_details() # No es necesario aquí si solo actualizamos
 
@@ -49,56 +70,63 @@ def descubrir_peers():
             banned_users_list = []
 
 
-        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        s.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        
-        s.bind(("0.0.0.0", 0)) # Puerto efímero para enviar y recibir respuestas de descubrimiento
-        my_port = s.getsockname()[1]
-        logger.info(f">>> [PEER DISCOVERY] Escuchando respuestas de descubrimiento en puerto efímero: {my_port}")
-        
-        s.setblocking(False)
-
-        broadcast_addr = obtener_broadcast()
-        logger.info(f">>> [PEER DISCOVERY] Dirección de broadcast calculada: {broadcast_addr}")
-        logger.info(f">>> [PEER DISCOVERY] Enviando mensaje de descubrimiento a {broadcast_addr}:{PORT}")
-
-        for i in range(3):  # Reducido a 3 intentos para acelerar un poco
-            try:
-                s.sendto(BROADCAST_MESSAGE, (broadcast_addr, PORT))
-                logger.debug(f">>> [PEER DISCOVERY] Intento {i+1}/3: Mensaje enviado.")
-                time.sleep(0.3 + random.random() * 0.5) 
-            except Exception as e_send:
-                logger.error(f">>> [PEER DISCOVERY] Error en envío de broadcast: {str(e_send)}")
-
-        start_time = time.time()
-        discovery_timeout = 6  # 6 segundos para esperar respuestas
-        
-        logger.info(">>> [PEER DISCOVERY] Esperando respuestas...")
+        sockets = abrir_sockets_por_interfaz()
+        destinos = ", ".join(f"{iface.broadcast} ({iface.name})" for iface in sockets.values())
+        logger.info(f">>> [PEER DISCOVERY] Enviando mensaje de descubrimiento a {destinos} en puerto {PORT}")
+
+        # Peers de los que se espera respuesta: confiables y vistos hace poco (sin bloqueados ni locales)
+        expected = set(trusted_users_data.get("users", [])) | set(get_registry().ips())
+        expected -= set(banned_users_list) | get_topology().local_ips()
+        answered = set() # IPs que han respondido, aunque se ignoren por duplicadas
+        pending_sends = [offset + random.random() * 0.2 if offset else 0.0 for offset in RETRY_OFFSETS]
+        sends_done = 0
+        idle_window = IDLE_MIN
+        last_reply = None
+
+        start_time = time.monotonic()
+        last_activity = start_time # Último envío o respuesta
+        logger.info(f">>> [PEER DISCOVERY] Esperando respuestas ({len(expected)} peer(s) esperado(s))...")
         
-        while time.time() - start_time < discovery_timeout:
-            ready_to_read, _, _ = select.select([s], [], [], 0.5) # Timeout de select para no bloquear mucho
-            if ready_to_read:
+        while True:
+            now = time.monotonic()
+            elapsed = now - start_time
+            if elapsed >= DISCOVERY_TIMEOUT:
+                break
+            while pending_sends and pending_sends[0] <= elapsed:
+                pending_sends.pop(0)
+                enviar_por_interfaces(sockets, BROADCAST_MESSAGE)
+                sends_done += 1
+                last_activity = now
+                logger.debug(f">>> [PEER DISCOVERY] Intento {sends_done}/{len(RETRY_OFFSETS)}: Mensaje enviado por {len(sockets)} interfaz(es).")
+            if early_exit:
+                if expected and expected <= answered:
+                    logger.info(f">>> [PEER DISCOVERY] Han respondido todos los peers esperados en {elapsed:.2f}s.")
+                    break
+                if not pending_sends and now - last_activity >= idle_window:
+                    logger.info(f">>> [PEER DISCOVERY] Sin respuestas nuevas en {idle_window:.2f}s; búsqueda terminada en {elapsed:.2f}s.")
+                    break
+
+            wait = DISCOVERY_TIMEOUT - elapsed
+            if pending_sends:
+                wait = min(wait, pending_sends[0] - elapsed)
+            elif early_exit:
+                wait = min(wait, last_activity + idle_window - now)
+            ready_to_read, _, _ = select.select(list(sockets), [], [], max(0.0, min(wait, 0.5)))
+            for s in ready_to_read:
+                iface = sockets[s]
                 try:
                     data, addr = s.recvfrom(1024)
                     ip_address = addr[0]
+                    reply_time = time.monotonic()
                     # port_num = addr[1] # No se usa el puerto de respuesta aquí
 
                     # Ignorar nuestros propios mensajes si el sistema los devuelve
-                    try:
-                        # Obtener IPs locales para comparar
-                        # Esto puede ser costoso de llamar repetidamente en un bucle
-                        # Se podría obtener una vez fuera del bucle si es necesario
-                        hostname_local = socket.gethostname()
-                        local_ips = socket.gethostbyname_ex(hostname_local)[2]
-                        if ip_address in local_ips or ip_address == "127.0.0.1":
-                            logger.debug(f">>> [PEER DISCOVERY] Respuesta ignorada de IP local: {ip_address}")
-                            continue
-                    except socket.gaierror: # Error al obtener IP local, continuar de todas formas
-                        pass
-
-
-                    logger.debug(f">>> [PEER DISCOVERY] Respuesta recibida de {ip_address}: {data[:60]}...") # Loguear solo parte del mensaje
+                    if ip_address in get_topology().local_ips():
+                        logger.debug(f">>> [PEER DISCOVERY] Respuesta ignorada de IP local: {ip_address}")
+                        continue
+
+
+                    logger.debug(f">>> [PEER DISCOVERY] Respuesta recibida de {ip_address} por {iface.name}: {data[:60]}...") # Loguear solo parte del mensaje
                     
                     if data.startswith(b"HELLO:"):
                         try:
@@ -109,16 +137,33 @@ def descubrir_peers():
                                 # La IP anunciada en el mensaje HELLO es la que el peer *cree* que tiene.
                                 # Usamos la IP de origen del paquete (ip_address) como la IP autoritativa del peer.
                                 peer_ip_authoritative = ip_address 
-                                # announced_peer_ip = parts[3] # Podríamos loguearlo o compararlo
-
-                                logger.info(f">>> [PEER DISCOVERY] Peer válido detectado: {peer_ip_authoritative} (Usuario: {announced_username}, Host: {announced_hostname})")
+                                # La IP anunciada es la principal del peer, igual por todas sus interfaces
+                                announced_peer_ip = parts[3]
+                                answered.add(peer_ip_authoritative)
+
+                                identity = (announced_username, announced_hostname, announced_peer_ip)
+                                known_ip = identities.setdefault(identity, peer_ip_authoritative)
+                                if known_ip != peer_ip_authoritative:
+                                    logger.debug(f">>> [PEER DISCOVERY] {peer_ip_authoritative} ({iface.name}) es el mismo peer que {known_ip}; se ignora.")
+                                    continue
+                                if peer_ip_authoritative in peers_discovered_ips:
+                                    continue # Respuesta repetida (se envían varios intentos)
+
+                                # Ventana de silencio adaptativa: si las respuestas llegan espaciadas, se espera más
+                                if last_reply is not None:
+                                    idle_window = min(IDLE_MAX, max(idle_window, IDLE_FACTOR * (reply_time - last_reply)))
+                                last_reply = last_activity = reply_time
+
+                                logger.info(f">>> [PEER DISCOVERY] Peer válido detectado: {peer_ip_authoritative} por {iface.name} (Usuario: {announced_username}, Host: {announced_hostname})")
                                 
-                                # Actualizar detalles del peer (nombre, host)
-                                update_peer_details(peer_ip_authoritative, announced_username, announced_hostname)
+                                # Anotar el peer en el registro (y sus detalles: nombre, host e interfaz por la que se alcanzó)
+                                registrar_hello(peer_ip_authoritative, announced_username, announced_hostname, interface=iface.name)
 
                                 # Lógica de confianza y baneo (sin cambios funcionales, solo usa la lista correcta de baneados)
                                 if peer_ip_authoritative not in banned_users_list:
                                     peers_discovered_ips.add(peer_ip_authoritative)
+                                    if on_peer:
+                                        on_peer(peer_ip_authoritative) # Resultados parciales para la interfaz
                                     # Añadir a confiables automáticamente si no está ya y no está baneado.
                                     # Esto puede ser agresivo; podrías querer que el usuario confirme.
                                     # Por ahora, se mantiene la lógica original de auto-confianza.
@@ -137,7 +182,7 @@ def descubrir_peers():
                      # En Windows, un ICMP port unreachable puede generar WSAECONNRESET (10054)
                      # Esto puede ocurrir si enviamos broadcast y un host responde que el puerto no está abierto
                      if e_sock.winerror == 10054 if hasattr(e_sock, 'winerror') else False:
-                         logger.debug(f">>> [PEER DISCOVERY] Ignorando error de conexión reseteada (WSAECONNRESET) de {addr[0]}.")
+                         logger.debug(f">>> [PEER DISCOVERY] Ignorando error de conexión reseteada (WSAECONNRESET) en {iface.name}.")
                      else:
                          logger.error(f">>> [PEER DISCOVERY] Error de socket recibiendo respuesta: {str(e_sock)}")
                 except Exception as e_recv:
@@ -153,9 +198,9 @@ def descubrir_peers():
     except Exception as e_general:
         logger.error(f">>> [PEER DISCOVERY] Error inesperado en descubrir_peers: {str(e_general)}", exc_info=True)
     finally:
-        if 's' in locals() and s:
+        for s in sockets:
             s.close()
 
     final_peer_list = list(peers_discovered_ips)
     logger.info(f">>> [PEER DISCOVERY] Peers finales encontrados en esta búsqueda: {final_peer_list}")
-    return final_peer_list if final_peer_list else []
\ No newline at end of file
+    return final_peer_list if final_peer_list else []
@@ -0,0 +1,74 @@
+# clip_applier.py
+import time
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class ClipApplier:
+    """Único hilo que escribe en el portapapeles local los clips recibidos de los peers.
+
+    Los hilos de red solo dejan el clip en una ranura (latest-wins) y vuelven a atender su
+    conexión. Tras cada escritura se espera 'burst_window' segundos antes de la siguiente, de
+    modo que una ráfaga de clips de varios peers se reduce a escribir el más reciente: las
+    escrituras por segundo quedan acotadas sea cual sea el número de peers. Si los clips traen
+    sello de Lamport, en la ranura se queda el de sello mayor aunque llegue antes.
+    """
+
+    def __init__(self, apply_func, burst_window=0.1, idle_timeout=30.0):
+        self.apply_func = apply_func # apply_func(ip, data, huella, sello)
+        self.burst_window = burst_window
+        self.idle_timeout = idle_timeout
+        self.coalesced = 0 # Clips descartados por haber llegado uno más nuevo antes de escribirlos
+        self._pending = None
+        self._next_write = 0.0 # Instante (monotonic) a partir del cual se puede volver a escribir
+        self._closed = False
+        self._thread = None
+        self._cond = threading.Condition()
+
+    def put(self, ip, data, digest, stamp=None):
+        """Encola un clip recibido sin bloquear. Reemplaza al pendiente salvo que este sea más nuevo."""
+        with self._cond:
+            if self._closed:
+                return
+            if self._pending is not None:
+                self.coalesced += 1
+                pending_stamp = self._pending[3]
+                if stamp is not None and pending_stamp is not None and stamp < pending_stamp:
+                    logger.debug(f"Clip de {ip} descartado: el pendiente de {self._pending[0]} es más nuevo.")
+                    return
+                logger.debug(f"Clip pendiente de {self._pending[0]} reemplazado por uno más reciente de {ip}.")
+            self._pending = (ip, data, digest, stamp)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True, name="ClipApplier")
+                self._thread.start()
+            self._cond.notify()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._pending = None
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if self._pending is None and not self._closed:
+                    self._cond.wait(self.idle_timeout)
+                # Dentro de la ventana de ráfaga se sigue esperando: lo que llegue reemplaza al pendiente
+                delay = self._next_write - time.monotonic()
+                while delay > 0 and self._pending is not None and not self._closed:
+                    self._cond.wait(delay)
+                    delay = self._next_write - time.monotonic()
+                if self._pending is None or self._closed:
+                    self._thread = None
+                    return
+                ip, data, digest, stamp = self._pending
+                self._pending = None
+
+            try:
+                self.apply_func(ip, data, digest, stamp)
+            except Exception as e:
+                logger.error(f"Error inesperado aplicando el clip recibido de {ip}: {e}", exc_info=True)
+            self._next_write = time.monotonic() + self.burst_window
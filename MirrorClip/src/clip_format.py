@@ -0,0 +1,120 @@
+# clip_format.py
+# Clips tipados: cada clip viaja (y se guarda en la caché de contenidos) como un sobre con su tipo
+# MIME seguido del contenido. Así la huella, las ofertas, las deltas y los anuncios funcionan igual
+# para texto, HTML e imágenes.
+import io
+import logging
+from PIL import Image, features
+
+logger = logging.getLogger(__name__)
+
+TEXT = "text/plain;charset=utf-8"
+HTML = "text/html"
+PNG = "image/png"
+WEBP = "image/webp"
+
+IMAGE_FORMATS = {"png": PNG, "webp": WEBP} # Valores admitidos en la opción image_format
+_PIL_FORMATS = {PNG: "PNG", WEBP: "WEBP"}
+
+
+class ClipFormatError(ValueError):
+    """Sobre de clip mal formado o con un tipo no soportado."""
+
+
+def pack(mime, body):
+    """Sobre de un clip: longitud del tipo (1 byte), tipo MIME en ASCII y contenido."""
+    mime_bytes = mime.encode('ascii')
+    if len(mime_bytes) > 255:
+        raise ClipFormatError(f"Tipo MIME demasiado largo: {mime}")
+    return bytes((len(mime_bytes),)) + mime_bytes + bytes(body)
+
+
+def pack_text(content):
+    return pack(TEXT, content.encode('utf-8'))
+
+
+def unpack(data):
+    """Devuelve (tipo MIME, contenido) de un sobre. El contenido es un memoryview sin copias."""
+    view = memoryview(data)
+    if not len(view):
+        raise ClipFormatError("Clip vacío")
+    end = 1 + view[0]
+    if len(view) < end:
+        raise ClipFormatError("Sobre de clip truncado")
+    try:
+        mime = bytes(view[1:end]).decode('ascii')
+    except UnicodeDecodeError as e:
+        raise ClipFormatError(f"Tipo MIME inválido: {e}") from e
+    return mime, view[end:]
+
+
+def is_image(mime):
+    return mime.startswith("image/")
+
+
+def describe(mime, body, preview_chars):
+    """Vista previa legible de un clip (para anuncios y registros)."""
+    if is_image(mime):
+        try:
+            with Image.open(io.BytesIO(body)) as image: # Solo lee la cabecera, no decodifica la imagen
+                return f"Imagen {image.width}x{image.height} ({mime})"
+        except Exception:
+            return f"Imagen ({mime}, {len(body)} bytes)"
+    text = bytes(body[:preview_chars * 4]).decode('utf-8', errors='ignore')[:preview_chars]
+    return text
+
+
+def preview(data, preview_chars=50):
+    """Vista previa de un sobre completo, tolerante a sobres inválidos (para registros)."""
+    try:
+        return describe(*unpack(data), preview_chars)
+    except ClipFormatError:
+        return f"<{len(data)} bytes>"
+
+
+def encode_image(image):
+    """Codifica una imagen de Pillow (p. ej. un bitmap del portapapeles) como PNG.
+
+    Los bitmaps en crudo nunca viajan por la red: siempre se envían comprimidos.
+    """
+    if image.mode not in ("1", "L", "LA", "P", "RGB", "RGBA", "I", "I;16"):
+        image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+    out = io.BytesIO()
+    image.save(out, format="PNG", compress_level=6)
+    return PNG, out.getvalue()
+
+
+def adapt_image(mime, body, max_dimension=0, image_format="keep", quality=85):
+    """Aplica la política de imágenes de un peer: reducir tamaño y/o recomprimir.
+
+    Si la imagen ya cumple la política se devuelven los mismos bytes, sin volver a codificarla.
+    """
+    target = IMAGE_FORMATS.get(image_format, mime)
+    if target == WEBP and not features.check("webp"):
+        logger.warning("Pillow no tiene soporte WebP; se mantiene el formato original.")
+        target = mime
+    if target not in _PIL_FORMATS:
+        target = PNG
+    with Image.open(io.BytesIO(body)) as image:
+        shrink = bool(max_dimension) and max(image.size) > max_dimension
+        if not shrink and target == mime:
+            return mime, body
+        image.load()
+        if shrink:
+            image.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+        if target == WEBP and image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "A" in image.getbands() or "transparency" in image.info else "RGB")
+        out = io.BytesIO()
+        if target == WEBP:
+            image.save(out, format="WEBP", quality=quality, method=4)
+        else:
+            image.save(out, format="PNG", compress_level=6)
+    return target, out.getvalue()
+
+
+def to_png(mime, body):
+    """Convierte una imagen a PNG (el formato que aceptan todos los portapapeles)."""
+    if mime == PNG:
+        return bytes(body)
+    with Image.open(io.BytesIO(body)) as image:
+        return encode_image(image)[1]
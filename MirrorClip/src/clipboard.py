@@ -0,0 +1,334 @@
+# clipboard.py
+# Acceso al portapapeles del sistema para clips tipados (texto, HTML e imágenes).
+# En X11 se usa una conexión persistente con el servidor X (x11_clipboard.py), sin procesos por
+# llamada. En el resto de casos el texto pasa por pyperclip y las imágenes y el HTML por las
+# herramientas de cada plataforma (xclip / wl-clipboard, la API de Windows, osascript) y Pillow.
+import io
+import os
+import shutil
+import platform
+import subprocess
+import tempfile
+import logging
+from html.parser import HTMLParser
+import pyperclip
+from PIL import Image, ImageGrab
+from content_cache import content_digest
+import clip_format
+import x11_clipboard
+
+logger = logging.getLogger(__name__)
+
+try:
+    from AppKit import NSPasteboard # pyobjc (opcional, solo macOS): contador de cambios del portapapeles
+except ImportError:
+    NSPasteboard = None
+
+SYSTEM = platform.system()
+_TOOL_TIMEOUT = 5 # Segundos máximos para xclip / wl-paste / osascript
+
+
+class ClipboardError(Exception):
+    """No se pudo leer o escribir el portapapeles del sistema."""
+
+
+class _ToolsBackend:
+    """pyperclip para el texto y xclip / wl-clipboard para el resto de tipos (un proceso por llamada)."""
+
+    name = "tools"
+
+    def change_token(self):
+        """Contador de cambios del sistema (Windows, o macOS con pyobjc), o None si no hay forma barata.
+
+        xclip y wl-paste no ofrecen ninguno: en Linux hay que leer el contenido para saberlo.
+        """
+        if SYSTEM == "Windows":
+            import ctypes
+            return ctypes.windll.user32.GetClipboardSequenceNumber() or None # 0: sin acceso
+        if SYSTEM == "Darwin" and NSPasteboard is not None:
+            return NSPasteboard.generalPasteboard().changeCount()
+        return None
+
+    def paste_text(self):
+        return pyperclip.paste()
+
+    def copy_text(self, text):
+        pyperclip.copy(text)
+
+    def targets(self):
+        return _linux_targets() if SYSTEM == "Linux" else []
+
+    def read(self, mime):
+        return _linux_read(mime)
+
+    def write(self, mime, data, text=None):
+        _linux_write(mime, data) # xclip / wl-copy ofrecen un solo tipo: 'text' no se puede añadir
+
+
+_backend = None
+
+
+def configurar_backend(nombre="auto"):
+    """Elige cómo se accede al portapapeles: "auto", "x11" (conexión X persistente) o "tools"."""
+    global _backend
+    # En Wayland, X11 solo vería el portapapeles de las aplicaciones XWayland
+    nativo = SYSTEM == "Linux" and (nombre == "x11" or not os.environ.get("WAYLAND_DISPLAY"))
+    if nombre in ("auto", "x11") and nativo:
+        try:
+            _backend = x11_clipboard.X11Clipboard()
+            logger.info("Portapapeles accedido mediante una conexión X11 persistente.")
+            return _backend
+        except x11_clipboard.X11Unavailable as e:
+            log = logger.warning if nombre == "x11" else logger.info
+            log(f"Portapapeles X11 nativo no disponible ({e}); se usará pyperclip.")
+    elif nombre not in ("auto", "x11", "tools"):
+        logger.warning(f"Backend de portapapeles desconocido '{nombre}'; se usará pyperclip.")
+    _backend = _ToolsBackend()
+    return _backend
+
+
+def _get_backend():
+    return _backend if _backend is not None else configurar_backend()
+
+
+def testigo_cambios():
+    """Valor que solo cambia cuando cambia el portapapeles, o None si el backend no lo ofrece.
+
+    Si coincide con el de la lectura anterior, no hace falta volver a leer el contenido.
+    """
+    return _get_backend().change_token()
+
+
+def leer_portapapeles(incluir_html=False):
+    """Devuelve el sobre (clip_format) del contenido actual del portapapeles, o None si está vacío.
+
+    El texto tiene prioridad; si no hay texto se busca una imagen. Con 'incluir_html' (solo
+    Linux) se prefiere la versión HTML cuando la aplicación de origen la ofrece.
+    """
+    backend = _get_backend()
+    text = backend.paste_text()
+    if text:
+        if incluir_html and SYSTEM == "Linux" and clip_format.HTML in backend.targets():
+            html = backend.read(clip_format.HTML)
+            if html:
+                return clip_format.pack(clip_format.HTML, html)
+        return clip_format.pack_text(text)
+    image = _leer_imagen(backend)
+    if image is None:
+        return None
+    return clip_format.pack(*image)
+
+
+def forma_en_portapapeles(mime, body):
+    """(tipo, contenido) con los que un clip quedará en el portapapeles local al escribirlo.
+
+    Las imágenes se escriben como PNG y, fuera de Linux, el HTML como su texto visible; así se
+    puede reconocer el clip cuando el monitor lo vuelva a leer.
+    """
+    if clip_format.is_image(mime):
+        return clip_format.PNG, clip_format.to_png(mime, body)
+    if mime == clip_format.HTML and SYSTEM != "Linux":
+        return clip_format.TEXT, _texto_de_html(bytes(body).decode('utf-8', errors='replace')).encode('utf-8')
+    return mime, body
+
+
+def texto_alternativo(mime, body):
+    """Sobre de texto plano que se ofrece junto a un clip HTML (lo que leerá quien pida texto), o None."""
+    if mime != clip_format.HTML:
+        return None
+    return clip_format.pack_text(_texto_de_html(bytes(body).decode('utf-8', errors='replace')))
+
+
+def escribir_portapapeles(mime, body):
+    """Lleva al portapapeles del sistema un clip de tipo 'mime'. Lanza ClipboardError si falla."""
+    if mime == clip_format.TEXT:
+        _get_backend().copy_text(bytes(body).decode('utf-8'))
+    elif mime == clip_format.HTML:
+        _escribir_html(bytes(body))
+    elif clip_format.is_image(mime):
+        _escribir_imagen(clip_format.to_png(mime, body))
+    else:
+        raise ClipboardError(f"Tipo de clip no soportado: {mime}")
+
+
+# --- Lectura de imágenes ---
+
+_ultima_imagen = {} # {huella de la imagen leída: (tipo, bytes) ya codificados}; solo la última
+
+
+def _codificar_una_vez(clave, codificar):
+    """Codifica la imagen, o reutiliza el resultado si es la misma que en la lectura anterior.
+
+    Sin testigo de cambios el monitor relee el portapapeles en cada sondeo; así una captura que
+    sigue copiada no se vuelve a comprimir cada vez.
+    """
+    resultado = _ultima_imagen.get(clave)
+    if resultado is None:
+        resultado = codificar()
+        _ultima_imagen.clear()
+        _ultima_imagen[clave] = resultado
+    return resultado
+
+
+def _leer_imagen(backend):
+    """(tipo, bytes) de la imagen del portapapeles, o None. PNG/WebP se toman tal cual, sin recodificar."""
+    if SYSTEM == "Linux":
+        targets = backend.targets()
+        for mime in (clip_format.PNG, clip_format.WEBP):
+            if mime in targets:
+                data = backend.read(mime)
+                if data:
+                    return mime, data
+        other = next((t for t in targets if t.startswith("image/")), None)
+        if other is None:
+            return None
+        data = backend.read(other)
+        if not data:
+            return None
+        try:
+            return _codificar_una_vez(content_digest(data), lambda: _codificar_datos(data))
+        except Exception as e:
+            logger.warning(f"No se pudo interpretar la imagen del portapapeles ({other}): {e}")
+            return None
+
+    try:
+        image = ImageGrab.grabclipboard()
+    except Exception as e:
+        logger.debug(f"No se pudo leer una imagen del portapapeles: {e}")
+        return None
+    if not isinstance(image, Image.Image): # None o una lista de rutas de archivos copiados
+        return None
+    # Bitmap del sistema: nunca se envía sin comprimir
+    clave = (image.mode, image.size, content_digest(image.tobytes()))
+    return _codificar_una_vez(clave, lambda: clip_format.encode_image(image))
+
+
+def _codificar_datos(data):
+    with Image.open(io.BytesIO(data)) as image:
+        return clip_format.encode_image(image)
+
+
+# --- Escritura ---
+
+def _escribir_imagen(png):
+    if SYSTEM == "Linux":
+        _get_backend().write(clip_format.PNG, png)
+    elif SYSTEM == "Windows":
+        _windows_write_dib(png)
+    elif SYSTEM == "Darwin":
+        with tempfile.NamedTemporaryFile(suffix=".png", delete=False) as f:
+            f.write(png)
+        try:
+            script = f'set the clipboard to (read (POSIX file "{f.name}") as «class PNGf»)'
+            _run(["osascript", "-e", script])
+        finally:
+            os.remove(f.name)
+    else:
+        raise ClipboardError(f"Imágenes en el portapapeles no soportadas en {SYSTEM}")
+
+
+def _escribir_html(html):
+    if SYSTEM == "Linux":
+        # También como texto plano, para pegar en terminales y editores que no aceptan HTML
+        _get_backend().write(clip_format.HTML, html, _texto_de_html(html.decode('utf-8', errors='replace')))
+        return
+    # En el resto de plataformas se copia el texto visible del HTML
+    pyperclip.copy(_texto_de_html(html.decode('utf-8', errors='replace')))
+
+
+class _ExtractorTexto(HTMLParser):
+    def __init__(self):
+        super().__init__()
+        self.partes = []
+
+    def handle_data(self, data):
+        self.partes.append(data)
+
+
+def _texto_de_html(html):
+    extractor = _ExtractorTexto()
+    extractor.feed(html)
+    return "".join(extractor.partes)
+
+
+def _windows_write_dib(png):
+    import ctypes
+    from ctypes import wintypes
+    with Image.open(io.BytesIO(png)) as image:
+        out = io.BytesIO()
+        image.convert("RGB").save(out, format="BMP")
+    dib = out.getvalue()[14:] # CF_DIB es el BMP sin la cabecera de archivo (BITMAPFILEHEADER)
+
+    CF_DIB = 8
+    GMEM_MOVEABLE = 0x0002
+    user32 = ctypes.windll.user32
+    kernel32 = ctypes.windll.kernel32
+    kernel32.GlobalAlloc.restype = wintypes.HGLOBAL
+    kernel32.GlobalAlloc.argtypes = (wintypes.UINT, ctypes.c_size_t)
+    kernel32.GlobalLock.restype = ctypes.c_void_p
+    kernel32.GlobalLock.argtypes = (wintypes.HGLOBAL,)
+    kernel32.GlobalUnlock.argtypes = (wintypes.HGLOBAL,)
+    user32.SetClipboardData.argtypes = (wintypes.UINT, wintypes.HANDLE)
+    user32.SetClipboardData.restype = wintypes.HANDLE
+
+    if not user32.OpenClipboard(None):
+        raise ClipboardError("No se pudo abrir el portapapeles de Windows")
+    try:
+        user32.EmptyClipboard()
+        handle = kernel32.GlobalAlloc(GMEM_MOVEABLE, len(dib))
+        if not handle:
+            raise ClipboardError("GlobalAlloc falló al copiar la imagen")
+        ctypes.memmove(kernel32.GlobalLock(handle), dib, len(dib))
+        kernel32.GlobalUnlock(handle)
+        if not user32.SetClipboardData(CF_DIB, handle):
+            raise ClipboardError("SetClipboardData falló al copiar la imagen")
+    finally:
+        user32.CloseClipboard()
+
+
+# --- Herramientas de Linux (Wayland o X11) ---
+
+def _wayland():
+    return bool(os.environ.get("WAYLAND_DISPLAY")) and shutil.which("wl-paste") is not None
+
+
+def _linux_targets():
+    if _wayland():
+        out = _run(["wl-paste", "--list-types"], check=False)
+    elif shutil.which("xclip"):
+        out = _run(["xclip", "-selection", "clipboard", "-t", "TARGETS", "-o"], check=False)
+    else:
+        return []
+    return out.decode('utf-8', errors='ignore').split() if out else []
+
+
+def _linux_read(mime):
+    if _wayland():
+        return _run(["wl-paste", "--no-newline", "--type", mime], check=False)
+    return _run(["xclip", "-selection", "clipboard", "-t", mime, "-o"], check=False)
+
+
+def _linux_write(mime, data):
+    if _wayland() and shutil.which("wl-copy"):
+        _run(["wl-copy", "--type", mime], data)
+    elif shutil.which("xclip"):
+        _run(["xclip", "-selection", "clipboard", "-t", mime, "-i"], data)
+    else:
+        raise ClipboardError("Se necesita xclip (X11) o wl-clipboard (Wayland) para copiar imágenes o HTML")
+
+
+def _run(cmd, data=None, check=True):
+    # Al escribir no se captura la salida: xclip y wl-copy se quedan en segundo plano sirviendo
+    # la selección y mantendrían abierta la tubería de stdout
+    stdout = subprocess.PIPE if data is None else subprocess.DEVNULL
+    try:
+        result = subprocess.run(cmd, input=data, stdout=stdout, stderr=subprocess.DEVNULL, timeout=_TOOL_TIMEOUT)
+    except (OSError, subprocess.TimeoutExpired) as e:
+        if check:
+            raise ClipboardError(f"Error ejecutando {cmd[0]}: {e}") from e
+        return None
+    if result.returncode != 0:
+        if check:
+            raise ClipboardError(f"{cmd[0]} terminó con código {result.returncode}")
+        return None
+    return result.stdout
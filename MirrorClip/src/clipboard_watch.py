@@ -0,0 +1,162 @@
+# clipboard_watch.py
+# Detección de cambios del portapapeles. Un "watcher" indica cuándo merece la pena volver a
+# leer el portapapeles:
+#   - XFixesWatcher (Linux/X11): el servidor X avisa cuando cambia el propietario de la
+#     selección CLIPBOARD, así que el monitor duerme hasta que hay un cambio real.
+#   - PollingWatcher: comprobación periódica adaptativa, válida en cualquier plataforma. Sondea
+#     deprisa justo después de un cambio y se va espaciando mientras el portapapeles no cambia.
+import os
+import abc
+import select
+import time
+import platform
+import logging
+
+logger = logging.getLogger(__name__)
+
+try:
+    from Xlib import display as xdisplay # python-xlib (pystray ya lo usa en X11)
+    from Xlib.ext import xfixes
+except ImportError:
+    xdisplay = None
+    xfixes = None
+
+
+class WatcherUnavailable(Exception):
+    """El backend pedido no puede funcionar en este entorno."""
+
+
+class ClipboardWatcher(abc.ABC):
+    """Interfaz común de los watchers."""
+
+    name = "base"
+
+    @abc.abstractmethod
+    def wait_for_change(self, timeout):
+        """Espera como mucho 'timeout' segundos. True si el portapapeles puede haber cambiado."""
+
+    def report(self, changed):
+        """Resultado de la última lectura: True si el contenido había cambiado de verdad."""
+
+    def change_token(self):
+        """Testigo del último cambio que ha despertado al watcher, o None si no lo conoce.
+
+        Si el watcher lo ofrece tiene prioridad sobre el del backend del portapapeles, que puede
+        no haber procesado todavía el mismo aviso.
+        """
+        return None
+
+    def close(self):
+        pass
+
+
+class PollingWatcher(ClipboardWatcher):
+    """Sin notificaciones: propone releer el portapapeles periódicamente.
+
+    Tras un cambio se sondea cada 'min_interval' segundos (suele haber más copias seguidas) y cada
+    lectura sin cambios multiplica el intervalo por 'backoff', hasta 'max_interval' en reposo.
+    """
+
+    name = "poll"
+
+    def __init__(self, min_interval=0.1, max_interval=5.0, backoff=1.5):
+        self.min_interval = min_interval
+        self.max_interval = max(min_interval, max_interval)
+        self.backoff = backoff
+        self.interval = min_interval
+        self._next = time.monotonic() # La primera llamada lee el estado inicial
+
+    def wait_for_change(self, timeout):
+        remaining = self._next - time.monotonic()
+        if remaining > timeout:
+            time.sleep(timeout)
+            return False
+        if remaining > 0:
+            time.sleep(remaining)
+        self._next = time.monotonic() + self.interval # report() lo ajusta según el resultado
+        return True
+
+    def report(self, changed):
+        if changed:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.interval * self.backoff, self.max_interval)
+        self._next = time.monotonic() + self.interval
+
+
+class XFixesWatcher(ClipboardWatcher):
+    """Notificaciones XFixes de cambio de propietario de la selección CLIPBOARD.
+
+    Cada copia en cualquier aplicación cambia el propietario de la selección; el servidor X
+    envía entonces un evento y el hilo del monitor se despierta en milisegundos. Sin copias,
+    el hilo queda bloqueado en select() sin consumir CPU.
+    """
+
+    name = "xfixes"
+
+    def __init__(self, display_name=None):
+        if xdisplay is None:
+            raise WatcherUnavailable("python-xlib no está instalado")
+        if not (display_name or os.environ.get("DISPLAY")):
+            raise WatcherUnavailable("No hay servidor X (DISPLAY no definido)")
+        try:
+            self.display = xdisplay.Display(display_name)
+        except Exception as e:
+            raise WatcherUnavailable(f"No se pudo abrir el display X: {e}") from e
+        if not self.display.has_extension("XFIXES"):
+            self.display.close()
+            raise WatcherUnavailable("El servidor X no tiene la extensión XFIXES")
+        self.display.xfixes_query_version()
+        self.selection = self.display.get_atom("CLIPBOARD")
+        mask = (xfixes.XFixesSetSelectionOwnerNotifyMask
+                | xfixes.XFixesSelectionWindowDestroyNotifyMask
+                | xfixes.XFixesSelectionClientCloseNotifyMask)
+        self.display.xfixes_select_selection_input(self.display.screen().root, self.selection, mask)
+        self.display.flush()
+        self.owner = None # Ventana propietaria de la selección según el último evento
+        self.timestamp = None # Instante X en que se tomó la selección según el último evento
+        self._pending = True # La primera llamada lee el estado inicial
+
+    def wait_for_change(self, timeout):
+        if self._pending or self._drain():
+            self._pending = False
+            return True
+        readable, _, _ = select.select([self.display.fileno()], [], [], timeout)
+        return bool(readable) and self._drain()
+
+    def _drain(self):
+        """Procesa los eventos recibidos. True si alguno indica un cambio de la selección."""
+        changed = False
+        while self.display.pending_events():
+            event = self.display.next_event()
+            if isinstance(event, xfixes.SelectionNotify) and event.selection == self.selection:
+                self.owner = event.owner
+                self.timestamp = event.selection_timestamp
+                changed = True
+        return changed
+
+    def change_token(self):
+        if self.timestamp is None:
+            return None
+        return getattr(self.owner, "id", self.owner), self.timestamp
+
+    def close(self):
+        try:
+            self.display.close()
+        except Exception:
+            pass
+
+
+def crear_watcher(backend="auto", poll_min=0.1, poll_max=5.0):
+    """Crea el watcher configurado. 'auto' usa XFixes si está disponible y si no, sondeo adaptativo."""
+    if backend in ("auto", "xfixes") and platform.system() == "Linux":
+        try:
+            watcher = XFixesWatcher()
+            logger.info("Detección de cambios del portapapeles mediante XFixes.")
+            return watcher
+        except WatcherUnavailable as e:
+            log = logger.warning if backend == "xfixes" else logger.info
+            log(f"XFixes no disponible ({e}); se usará sondeo periódico del portapapeles.")
+    elif backend not in ("auto", "xfixes", "poll"):
+        logger.warning(f"Backend de portapapeles desconocido '{backend}'; se usará sondeo periódico.")
+    return PollingWatcher(poll_min, poll_max)
@@ -0,0 +1,93 @@
+# compression.py
+# Compresión de payloads negociada entre peers. zlib siempre está disponible;
+# zstd (paquete 'zstandard') y lz4 (paquete 'lz4') se usan solo si están instalados.
+import io
+import zlib
+import logging
+from protocol import ProtocolError
+
+logger = logging.getLogger(__name__)
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+# Identificadores de códec. Viajan en los bits FLAG_CODEC_MASK de los flags de la cabecera.
+CODEC_NONE = 0
+CODEC_ZLIB = 1
+CODEC_ZSTD = 2
+CODEC_LZ4 = 3
+
+CODEC_NAMES = {CODEC_ZLIB: "zlib", CODEC_ZSTD: "zstd", CODEC_LZ4: "lz4"}
+CODEC_IDS = {name: codec for codec, name in CODEC_NAMES.items()}
+
+
+class CompressionError(ProtocolError):
+    """Payload comprimido corrupto, con un códec no soportado o que excede el tamaño máximo."""
+
+
+def available_codecs():
+    """Nombres de los códecs disponibles en este equipo, por orden de preferencia."""
+    codecs = []
+    if zstandard is not None:
+        codecs.append("zstd")
+    if lz4_frame is not None:
+        codecs.append("lz4")
+    codecs.append("zlib")
+    return codecs
+
+
+def choose_codec(offered):
+    """Elige el códec preferido por nosotros entre los que ofrece el peer. CODEC_NONE si no hay ninguno común."""
+    for name in available_codecs():
+        if name in offered:
+            return CODEC_IDS[name]
+    return CODEC_NONE
+
+
+def compress(codec, data):
+    if codec == CODEC_ZLIB:
+        return zlib.compress(data, 6)
+    if codec == CODEC_ZSTD and zstandard is not None:
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    if codec == CODEC_LZ4 and lz4_frame is not None:
+        return lz4_frame.compress(data)
+    raise CompressionError(f"Códec de compresión no soportado: {codec}")
+
+
+def decompress(codec, data, max_size):
+    """Descomprime 'data' sin producir nunca más de 'max_size' bytes.
+
+    La salida se limita durante la propia descompresión (no después), de modo que un
+    payload malicioso muy comprimible no puede agotar la memoria.
+    """
+    try:
+        if codec == CODEC_ZLIB:
+            decompressor = zlib.decompressobj()
+            out = decompressor.decompress(data, max_size + 1)
+            if len(out) > max_size or decompressor.unconsumed_tail:
+                raise CompressionError(f"El contenido descomprimido supera el máximo de {max_size} bytes")
+            if not decompressor.eof:
+                raise CompressionError("Flujo zlib incompleto")
+            return out
+        if codec == CODEC_ZSTD and zstandard is not None:
+            with zstandard.ZstdDecompressor().stream_reader(io.BytesIO(data)) as reader:
+                out = reader.read(max_size + 1)
+        elif codec == CODEC_LZ4 and lz4_frame is not None:
+            out = lz4_frame.LZ4FrameDecompressor().decompress(data, max_length=max_size + 1)
+        else:
+            raise CompressionError(f"Códec de compresión no soportado: {codec}")
+    except CompressionError:
+        raise
+    except Exception as e:
+        raise CompressionError(f"Error descomprimiendo con {CODEC_NAMES.get(codec, codec)}: {e}") from e
+
+    if len(out) > max_size:
+        raise CompressionError(f"El contenido descomprimido supera el máximo de {max_size} bytes")
+    return out
@@ -111,6 +111,9 @@ def crear_config_si_no_existe():
             "port": "1234",
             "broadcast_interval": "30"
         }
+        config["network"] = {
+            "engine": "threads" # "selectors" atiende todas las conexiones desde un único hilo
+        }
         with open(CONFIG_FILE, "w") as f:
             config.write(f)
 
@@ -46,12 +46,14 @@ USER_DATA_ROOT_DIR = Path(user_data_path_base) / APP_NAME
 CONFIG_DIR = USER_DATA_ROOT_DIR / "config"
 KEYS_DIR = USER_DATA_ROOT_DIR / "keys" # Si se usan para claves generadas/modificables
 LOG_DIR = USER_DATA_ROOT_DIR / "logs"
+OUTBOX_DIR = USER_DATA_ROOT_DIR / "outbox" # Clips pendientes para peers no disponibles (bandeja de salida)
 
 # Archivos específicos de configuración y datos
 CONFIG_FILE = CONFIG_DIR / "mirror_clip.conf"
 TRUSTED_USERS_FILE = CONFIG_DIR / "trusted_users.json"
 BANNED_USERS_FILE = CONFIG_DIR / "banned_users.json"
 KNOWN_PEER_DETAILS_FILE = CONFIG_DIR / "known_peer_details.json"
+PEER_KEYS_FILE = KEYS_DIR / "known_peer_keys.json" # Huella de la clave pública de cada peer (TOFU)
 LOG_FILE_PATH = LOG_DIR / "mirrorclip.log" # Ruta explícita para el archivo de log
 
 # Nota: Las funciones que crean estos directorios (ej. en config.py y mirror_clip.py para logs)
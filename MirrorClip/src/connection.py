@@ -1,61 +1,618 @@
 # connection.py
 import socket
+import select
 import threading
 import json
 import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
 from port_editor import cargar_puerto
 from config import USERNAME # PORT se carga dinámicamente, USERNAME puede venir de config
-import pyperclip
-from config_paths import TRUSTED_USERS_FILE
+from config_paths import TRUSTED_USERS_FILE, OUTBOX_DIR
+from protocol import (
+    FrameReader, ProtocolError, HANDSHAKE_MAX_PAYLOAD, build_frame, send_frame, FLAG_CODEC_MASK, FLAG_ENCRYPTED, OFFER_FORMAT, DELTA_HEADER,
+    STAMP_FORMAT, MSG_CLIP, MSG_HELLO, MSG_OFFER, MSG_HAVE, MSG_NEED, MSG_DELTA, MSG_PING, MSG_PONG, MSG_AUTH,
+    MSG_ANNOUNCE, MSG_FETCH, MSG_MISSING, MSG_STAMP
+)
+import compression
+import delta
+from content_cache import ContentCache, RemoteClipRing, content_digest
+from net_settings import cargar_ajustes_red, cargar_ajustes_peers
+import clip_format
+import clipboard
+from event_engine import SelectorEngine
+from send_queue import PeerSendQueue
+from clip_applier import ClipApplier
+from connection_pool import ConnectionPool, enable_keepalive
+from secure_session import SessionSecurity
+from lamport import LamportClock
+from outbox import Outbox
 import logging
 
 # Obtener el logger. Se asume que logging.basicConfig() ya fue llamado en el script principal (mirror_clip.py)
 logger = logging.getLogger(__name__) # Usar __name__ para que el logger tenga el nombre del módulo
 
+CONNECT_TIMEOUT = 5 # Segundos para conectar (y por operación de envío) cuando no hay otro plazo
+
+# Resultados posibles de un envío a un peer
+SEND_OK = "ok"
+SEND_TIMEOUT = "timeout"
+SEND_REFUSED = "refused"
+SEND_ERROR = "error"
+
+HANDSHAKE_TIMEOUT = 3 # Segundos para recibir la respuesta HELLO del peer
+PING_TIMEOUT = 3 # Segundos para recibir el PONG de una conexión del pool
+FRAME_OVERHEAD = 64 * 1024 # Margen sobre max_clip_size para cabeceras de delta, compresión y cifrado
+
+FEATURE_DEDUP = "dedup" # El peer entiende OFFER/HAVE/NEED
+FEATURE_DELTA = "delta" # El peer entiende DELTA (y responde HAVE/NEED)
+FEATURE_LAZY = "lazy" # El peer entiende ANNOUNCE y sirve FETCH
+FEATURE_STAMP = "lamport" # El peer entiende STAMP y ordena los clips por su sello
+LOCAL_FEATURES = [FEATURE_DEDUP, FEATURE_DELTA, FEATURE_LAZY, FEATURE_STAMP]
+
+SHARE_PUSH = "push"
+SHARE_LAZY = "lazy"
+MAX_ANNOUNCEMENTS = 32 # Anuncios recibidos que se recuerdan (los más recientes)
+
+
+class OutgoingClip:
+    """Clip pendiente de enviar, codificado una sola vez.
+
+    Guarda las versiones comprimidas por códec para que todos los peers que negociaron el
+    mismo códec (y los reintentos) reutilicen el mismo resultado.
+    """
+
+    def __init__(self, data, progress=None, stamp=None):
+        self.data = data # Sobre de clip_format (tipo MIME + contenido)
+        self.mime = clip_format.unpack(data)[0]
+        self.progress = progress # progress(enviados, total) durante el envío del contenido
+        self.stamp = stamp # Sello de Lamport (tiempo, nodo) con que se comparte el clip
+        self._digest = None
+        self._deltas = {} # {huella de la base: operaciones de la delta, o None si no compensa}
+        self._compressed = {} # {códec: bytes comprimidos, o None si no compensa}
+        self._variants = {} # {política de imágenes: OutgoingClip adaptado}
+        self._lock = threading.Lock()
+
+    @property
+    def digest(self):
+        if self._digest is None:
+            self._digest = content_digest(self.data)
+        return self._digest
+
+    def payload_for(self, codec, threshold):
+        """Devuelve (flags, payload) para un peer que negoció 'codec'."""
+        if codec == compression.CODEC_NONE or len(self.data) < threshold or clip_format.is_image(self.mime):
+            return 0, self.data # PNG y WebP ya van comprimidos
+        with self._lock:
+            if codec not in self._compressed:
+                compressed = compression.compress(codec, self.data)
+                self._compressed[codec] = compressed if len(compressed) < len(self.data) else None
+            compressed = self._compressed[codec]
+        if compressed is None:
+            return 0, self.data
+        return codec & FLAG_CODEC_MASK, compressed
+
+    def descriptor(self, preview_chars):
+        """Anuncio del clip para el modo lazy (JSON en bytes)."""
+        preview = clip_format.describe(*clip_format.unpack(self.data), preview_chars)
+        return json.dumps({
+            "digest": self.digest.hex(), "size": len(self.data), "mime": self.mime, "preview": preview,
+        }).encode('utf-8')
+
+    def adapted(self, policy):
+        """El clip con la política de imágenes de un peer aplicada (él mismo si no hay que cambiar nada)."""
+        if not clip_format.is_image(self.mime):
+            return self
+        key = (policy["image_max_dimension"], policy["image_format"], policy["image_quality"])
+        with self._lock:
+            if key not in self._variants:
+                mime, body = clip_format.unpack(self.data)
+                new_mime, new_body = clip_format.adapt_image(mime, body, *key)
+                if new_body is body:
+                    self._variants[key] = self
+                else:
+                    self._variants[key] = OutgoingClip(clip_format.pack(new_mime, new_body), self.progress, self.stamp)
+            return self._variants[key]
+
+    def delta_from(self, base_digest, base):
+        """Operaciones de la delta respecto a 'base', o None si no ahorran al menos la mitad."""
+        with self._lock:
+            if base_digest not in self._deltas:
+                ops = delta.compute_delta(base, self.data)
+                self._deltas[base_digest] = ops if len(ops) < len(self.data) // 2 else None
+            return self._deltas[base_digest]
+
+
 class ConnectionManager:
     def __init__(self):
         self.PORT = cargar_puerto()
         self.last_clipboard_content = "" # Aunque no se usa aquí, se mantiene por si se expande
-        self.connections = {}  # {ip: socket}
         self.listener = None
         self.running = True
-        self.lock = threading.Lock() # Para proteger el acceso a self.connections si es necesario
-        logger.info(f"Inicializando ConnectionManager en puerto {self.PORT}")
+        self.lock = threading.Lock() # Protege peer_locks y send_queues
+        self.settings = cargar_ajustes_red()
+        self.peer_settings = cargar_ajustes_peers() # {ip: ajustes propios de ese peer}
+        # Conexiones salientes {ip: (socket, sesión negociada)} con comprobación de salud
+        self.pool = ConnectionPool(
+            self._get_peer_lock, self._ping_connection, self._open_connection, self._prewarm_candidates,
+            max_size=max(1, self.settings["pool_max_size"]),
+            idle_timeout=self.settings["pool_idle_timeout"],
+            ping_interval=self.settings["pool_ping_interval"],
+        )
+        self.peer_activity = {} # {ip: instante (monotonic) del último intercambio con el peer}
+        self.security = SessionSecurity(self.settings["session_ticket_lifetime"])
+        self.share_mode = self.settings["share_mode"]
+        if self.share_mode not in (SHARE_PUSH, SHARE_LAZY):
+            logger.warning(f"Modo de compartir desconocido '{self.share_mode}' en la configuración. Usando '{SHARE_PUSH}'.")
+            self.share_mode = SHARE_PUSH
+        self.announcements = OrderedDict() # {huella: anuncio recibido en modo lazy}, del más antiguo al más reciente
+        self.announced = {} # {ip: OrderedDict de huellas que le hemos anunciado}; solo esas se sirven con FETCH
+        self.on_announce = None # on_announce(ip, anuncio): aviso a la interfaz de un clip anunciado
+        self.on_remote_clip = None # on_remote_clip(ip): aviso de que un clip recibido ya está en el portapapeles
+        self.engine_mode = self.settings["engine"]
+        if self.engine_mode not in ("threads", "selectors"):
+            logger.warning(f"Motor de red desconocido '{self.engine_mode}' en la configuración. Usando 'threads'.")
+            self.engine_mode = "threads"
+        self.engine = None # SelectorEngine cuando engine_mode == "selectors"
+        self.peer_locks = {} # {ip: Lock} serializa los envíos por socket
+        self.send_queues = {} # {ip: PeerSendQueue} colas de salida no bloqueantes
+        # Contenidos recientes (enviados, recibidos o copiados aquí) para responder HAVE a una oferta
+        self.content_cache = ContentCache(max_bytes=self.settings["content_cache_bytes"])
+        # Un único hilo escribe en el portapapeles los clips recibidos, como mucho uno por ventana de ráfaga
+        self.applier = ClipApplier(self._write_clip, self.settings["clipboard_apply_window"])
+        self.clipboard_digest = None # Huella de lo último que hay en el portapapeles (escrito aquí o copiado)
+        self.clock = LamportClock()
+        self.clipboard_stamp = None # Sello de lo último que hay en el portapapeles; solo se aplican clips más nuevos
+        self.clipboard_lock = threading.Lock() # Protege clipboard_digest y clipboard_stamp
+        self.remote_clips = RemoteClipRing() # Clips recibidos y aplicados hace poco, para no reenviarlos como propios
+        # Clips para peers confiables caídos, entregados cuando vuelven (opcional)
+        self.outbox = None
+        if self.settings["outbox"]:
+            self.outbox = Outbox(
+                OUTBOX_DIR, self.settings["outbox_max_bytes"], self.settings["outbox_max_age"], self.settings["outbox_keep"]
+            )
+        self.outbox_draining = set() # Peers cuya bandeja se está vaciando ahora
+        self.outbox_attempts = {} # {ip: instante (monotonic) del último intento de vaciar su bandeja}
+        self.last_delivered = {} # {ip: huella del último clip entregado}, base para las deltas
+        self.executor = ThreadPoolExecutor(max_workers=max(1, self.settings["fanout_workers"]), thread_name_prefix="FanOut")
+        logger.info(f"Inicializando ConnectionManager en puerto {self.PORT} (motor: {self.engine_mode})")
+
+    def new_session(self, ip):
+        """Estado de una conexión con un peer: lo que se ha negociado con él en el HELLO.
+
+        Hasta completar el handshake su lector solo admite mensajes pequeños (HANDSHAKE_MAX_PAYLOAD),
+        para que un peer sin autenticar no pueda hacernos reservar memoria.
+        """
+        return {"ip": ip, "codec": compression.CODEC_NONE, "features": set(),
+                "reader": FrameReader(max_payload=HANDSHAKE_MAX_PAYLOAD)}
+
+    def _session_ready(self, session):
+        """Handshake completado: el lector de la sesión ya admite clips de hasta max_clip_size."""
+        session["reader"].max_payload = self.settings["max_clip_size"] + FRAME_OVERHEAD
+
+    def _hello_payload(self, secure=None):
+        codecs = compression.available_codecs() if self.settings["compression"] else []
+        hello = {"codecs": codecs, "features": LOCAL_FEATURES}
+        if secure is not None:
+            hello["secure"] = secure
+        return json.dumps(hello).encode('utf-8')
+
+    def _frame(self, session, msg_type, payload=b"", flags=0):
+        """Mensaje completo para un peer, cifrado si la sesión ya tiene canal seguro."""
+        channel = session.get("channel")
+        if channel is None:
+            return build_frame(msg_type, payload, flags)
+        flags |= FLAG_ENCRYPTED
+        return build_frame(msg_type, channel.seal(msg_type, flags, payload), flags)
+
+    def _open_payload(self, session, msg_type, flags, payload):
+        """Descifra el payload recibido. Devuelve (flags sin FLAG_ENCRYPTED, payload en claro)."""
+        channel = session.get("channel")
+        if flags & FLAG_ENCRYPTED:
+            if channel is None:
+                raise ProtocolError(f"Mensaje cifrado de {session['ip']} sin sesión segura negociada")
+            return flags & ~FLAG_ENCRYPTED, channel.open(msg_type, flags, payload)
+        if channel is not None or (self.settings["encryption"] and msg_type not in (MSG_HELLO, MSG_AUTH)):
+            raise ProtocolError(f"Mensaje sin cifrar de {session['ip']} (tipo {msg_type}) rechazado")
+        return flags, payload
+
+    def _decode_payload(self, flags, payload):
+        """Deshace la compresión indicada en los flags, limitando el tamaño expandido."""
+        codec = flags & FLAG_CODEC_MASK
+        if codec == compression.CODEC_NONE:
+            return payload
+        return compression.decompress(codec, bytes(payload), self.settings["max_clip_size"])
+
+    def _handle_hello(self, session, payload):
+        try:
+            hello = json.loads(payload.decode('utf-8'))
+        except ValueError as e:
+            raise ProtocolError(f"HELLO inválido: {e}") from e
+        offered = hello.get("codecs", []) if self.settings["compression"] else []
+        session["codec"] = compression.choose_codec(offered)
+        session["features"] = set(hello.get("features", []))
+        codec_name = compression.CODEC_NAMES.get(session["codec"])
+        reply = {"codec": codec_name, "features": LOCAL_FEATURES}
+        channel = None
+        if self.settings["encryption"]:
+            if not isinstance(hello.get("secure"), dict):
+                raise ProtocolError(f"{session['ip']} no admite conexiones cifradas")
+            reply["secure"], channel, session["pending_auth"] = self.security.server_respond(session["ip"], hello["secure"])
+        logger.info(f"Sesión negociada con {session['ip']}: compresión={codec_name or 'ninguna'}")
+        self.peer_available(session["ip"])
+        frame = build_frame(MSG_HELLO, json.dumps(reply).encode('utf-8'))
+        session["channel"] = channel # Los mensajes posteriores a esta respuesta ya van cifrados
+        if channel is not None or not self.settings["encryption"]:
+            self._session_ready(session) # Sin cifrado, o reanudada con ticket: no hay AUTH
+        return [frame]
+
+    def _handle_auth(self, session, payload):
+        pending = session.pop("pending_auth", None)
+        if pending is None:
+            raise ProtocolError(f"AUTH inesperado de {session['ip']}")
+        session["channel"] = self.security.server_finish(session["ip"], pending, payload)
+        self._session_ready(session)
+        logger.info(f"Conexión con {session['ip']} autenticada y cifrada.")
+        return []
+
+    def process_message(self, session, msg_type, flags, payload):
+        """Procesa un mensaje completo recibido de un peer. Devuelve la lista de respuestas a enviarle.
+
+        Es común a los dos motores de red (hilo por conexión y selectors).
+        """
+        ip = session["ip"]
+        flags, payload = self._open_payload(session, msg_type, flags, payload)
+        self.peer_activity[ip] = time.monotonic()
+        if msg_type == MSG_PING:
+            return [self._frame(session, MSG_PONG)]
+        if msg_type == MSG_HELLO:
+            return self._handle_hello(session, payload)
+        if msg_type == MSG_AUTH:
+            return self._handle_auth(session, payload)
+        if msg_type == MSG_OFFER:
+            return self._handle_offer(session, payload)
+        if msg_type == MSG_DELTA:
+            return self._handle_delta(session, self._decode_payload(flags, payload))
+        if msg_type == MSG_ANNOUNCE:
+            return self._handle_announce(session, payload)
+        if msg_type == MSG_FETCH:
+            return self._handle_fetch(session, payload)
+        if msg_type == MSG_STAMP:
+            return self._handle_stamp(session, payload)
+        if msg_type != MSG_CLIP:
+            logger.warning(f"Tipo de mensaje desconocido ({msg_type}) recibido de {ip}, ignorando.")
+            return []
+
+        data = self._decode_payload(flags, payload)
+        logger.info(f"Recibidos {len(payload)} bytes de {ip}" + (f" ({len(data)} descomprimidos)" if data is not payload else ""))
+        self._apply_clip(ip, data, session.pop("stamp", None))
+        return []
+
+    def _handle_stamp(self, session, payload):
+        """Guarda el sello del clip que el peer va a enviar.
+
+        Lo consume el mensaje que entrega ese clip (CLIP, ANNOUNCE, u OFFER/DELTA respondidos con HAVE);
+        tras un NEED se conserva para el CLIP que sigue.
+        """
+        try:
+            stamp = STAMP_FORMAT.unpack(payload)
+        except Exception as e:
+            raise ProtocolError(f"STAMP inválido: {e}") from e
+        self.clock.observe(stamp)
+        session["stamp"] = stamp
+        return []
+
+    def _handle_offer(self, session, payload):
+        """Responde HAVE si ya tenemos el contenido ofrecido (y lo aplica desde la caché), NEED si no."""
+        try:
+            digest, size = OFFER_FORMAT.unpack(payload)
+        except Exception as e:
+            raise ProtocolError(f"OFFER inválido: {e}") from e
+        data = self.content_cache.get(digest)
+        if data is None:
+            with self.clipboard_lock:
+                current = digest == self.clipboard_digest
+            if not current:
+                logger.debug(f"Oferta de {session['ip']} ({size} bytes) no está en caché, pidiendo contenido.")
+                return [self._frame(session, MSG_NEED, digest)]
+            # Es nuestra copia local (no se guarda en la caché): ya está en el portapapeles
+            logger.info(f"Oferta de {session['ip']} ({size} bytes) igual al contenido del portapapeles, sin transferir contenido.")
+            session.pop("stamp", None)
+            return [self._frame(session, MSG_HAVE, digest)]
+        logger.info(f"Oferta de {session['ip']} ({size} bytes) ya disponible localmente, sin transferir contenido.")
+        self._apply_clip(session["ip"], data, session.pop("stamp", None))
+        return [self._frame(session, MSG_HAVE, digest)]
+
+    def _handle_delta(self, session, payload):
+        """Reconstruye un clip a partir de una delta. Responde HAVE si cuadra la huella final, NEED si no."""
+        try:
+            base_digest, target_digest, block_size = DELTA_HEADER.unpack_from(payload)
+        except Exception as e:
+            raise ProtocolError(f"DELTA inválido: {e}") from e
+        base = self.content_cache.get(base_digest)
+        if base is None:
+            logger.info(f"Delta de {session['ip']} sobre una base que no tenemos; pidiendo el contenido completo.")
+            return [self._frame(session, MSG_NEED, target_digest)]
+        try:
+            data = delta.apply_delta(base, memoryview(payload)[DELTA_HEADER.size:], block_size, self.settings["max_clip_size"])
+        except delta.DeltaError as e:
+            logger.warning(f"Delta inválida de {session['ip']}: {e}. Pidiendo el contenido completo.")
+            return [self._frame(session, MSG_NEED, target_digest)]
+        if content_digest(data) != target_digest:
+            logger.warning(f"La delta de {session['ip']} no reproduce la huella esperada. Pidiendo el contenido completo.")
+            return [self._frame(session, MSG_NEED, target_digest)]
+        logger.info(f"Clip de {len(data)} bytes reconstruido desde una delta de {len(payload)} bytes de {session['ip']}")
+        self._apply_clip(session["ip"], data, session.pop("stamp", None))
+        return [self._frame(session, MSG_HAVE, target_digest)]
+
+    def _handle_announce(self, session, payload):
+        """Registra un clip anunciado en modo lazy; el contenido se pide con fetch_announced()."""
+        ip = session["ip"]
+        try:
+            announcement = json.loads(payload.decode('utf-8'))
+            digest = bytes.fromhex(announcement["digest"])
+            size = int(announcement["size"])
+        except (ValueError, KeyError, TypeError) as e:
+            raise ProtocolError(f"ANNOUNCE inválido: {e}") from e
+        stamp = session.pop("stamp", None)
+        announcement = {
+            "ip": ip, "digest": digest, "size": size, "mime": announcement.get("mime", clip_format.TEXT),
+            "preview": str(announcement.get("preview", "")), "time": time.time(),
+        }
+        data = self.content_cache.get(digest)
+        if data is not None:
+            logger.info(f"Clip anunciado por {ip} ({size} bytes) ya disponible localmente; aplicándolo sin transferir.")
+            self._apply_clip(ip, data, stamp)
+            return []
+        with self.lock:
+            self.announcements.pop(digest, None)
+            self.announcements[digest] = announcement
+            while len(self.announcements) > MAX_ANNOUNCEMENTS:
+                self.announcements.popitem(last=False)
+        logger.info(f"{ip} anuncia un clip de {size} bytes: {announcement['preview'][:50]}...")
+        if self.on_announce:
+            try:
+                self.on_announce(ip, announcement)
+            except Exception as e:
+                logger.error(f"Error notificando el anuncio de {ip}: {e}", exc_info=True)
+        return []
+
+    def _handle_fetch(self, session, payload):
+        """Sirve el contenido de un clip que anunciamos a ese peer, o MISSING si no (o si ya no lo tenemos)."""
+        digest = bytes(payload)
+        with self.lock:
+            announced = digest in self.announced.get(session["ip"], ())
+        if not announced:
+            logger.warning(f"{session['ip']} pide un clip que no se le ha anunciado; no se sirve.")
+            return [self._frame(session, MSG_MISSING, digest)]
+        data = self.content_cache.get(digest)
+        if data is None:
+            logger.warning(f"{session['ip']} pide un clip que ya no está en caché.")
+            return [self._frame(session, MSG_MISSING, digest)]
+        flags, body = OutgoingClip(data).payload_for(session["codec"], self.settings["compression_threshold"])
+        logger.info(f"Sirviendo a {session['ip']} el clip anunciado de {len(data)} bytes.")
+        self.last_delivered[session["ip"]] = digest
+        return [self._frame(session, MSG_CLIP, body, flags)]
+
+    def fetch_announced(self, digest=None, timeout=None):
+        """Trae del peer que lo anunció un clip del modo lazy y lo lleva al portapapeles.
+
+        Sin 'digest' se trae el anuncio más reciente. Devuelve True si el clip se obtuvo.
+        """
+        with self.lock:
+            if digest is None and self.announcements:
+                digest = next(reversed(self.announcements))
+            announcement = self.announcements.get(digest)
+        if announcement is None:
+            logger.info("No hay clips anunciados pendientes de traer.")
+            return False
+        ip = announcement["ip"]
+        data = self.content_cache.get(digest)
+        if data is None:
+            deadline = time.monotonic() + (timeout if timeout is not None else self.settings["peer_deadline"])
+            data = self._fetch(ip, digest, deadline)
+            if data is None:
+                return False
+        with self.lock:
+            self.announcements.pop(digest, None)
+        self._apply_clip(ip, data)
+        return True
+
+    def _fetch(self, ip, digest, deadline):
+        """Pide a un peer el contenido con esa huella. Devuelve los bytes o None si no se pudo obtener."""
+        peer_lock = self._get_peer_lock(ip)
+        if not peer_lock.acquire(timeout=max(0, deadline - time.monotonic())):
+            logger.warning(f"Plazo agotado esperando a que termine otro envío hacia {ip}.")
+            return None
+        try:
+            for attempt in range(2):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                conn, session = self.pool.get(ip)
+                reused = conn is not None
+                try:
+                    if conn is None:
+                        conn = self._open_connection(ip, min(CONNECT_TIMEOUT, remaining))
+                        _, session = self.pool.get(ip)
+                    conn.settimeout(min(CONNECT_TIMEOUT, remaining))
+                    conn.sendall(self._frame(session, MSG_FETCH, digest))
+                    msg_type, flags, payload = self._read_reply(conn, session, (MSG_CLIP, MSG_MISSING))
+                    if msg_type == MSG_MISSING:
+                        logger.warning(f"{ip} ya no tiene el clip anunciado.")
+                        return None
+                    data = self._decode_payload(flags, payload)
+                    if content_digest(data) != digest:
+                        raise ProtocolError(f"El clip recibido de {ip} no coincide con la huella anunciada")
+                    self.peer_activity[ip] = time.monotonic()
+                    logger.info(f"Clip anunciado de {len(data)} bytes traído de {ip}.")
+                    return bytes(data)
+                except socket.timeout:
+                    logger.error(f"Timeout pidiendo el clip anunciado a {ip}")
+                except ProtocolError as e:
+                    logger.error(f"Error de protocolo con {ip}: {e}")
+                except OSError as e:
+                    if conn is not None:
+                        self._discard_connection(ip, conn)
+                    if reused:
+                        logger.error(f"Error de socket pidiendo el clip a {ip}: {e}. Intentando reconectar.")
+                        continue
+                    logger.error(f"Error de socket con {ip}: {e}")
+                    return None
+                if conn is not None:
+                    self._discard_connection(ip, conn)
+                return None
+            return None
+        finally:
+            peer_lock.release()
+
+    def _apply_clip(self, ip, data, stamp=None):
+        """Entrega al hilo escritor un clip recibido de un peer para llevarlo al portapapeles local.
+
+        Con 'stamp' solo se aplica si es más nuevo que lo que ya hay en el portapapeles; sin sello
+        (peers antiguos, o un clip anunciado que pide el usuario) se aplica siempre.
+        """
+        try:
+            mime, body = clip_format.unpack(data)
+            if mime == clip_format.TEXT:
+                bytes(body).decode('utf-8')
+        except (clip_format.ClipFormatError, UnicodeDecodeError) as e:
+            raise ProtocolError(f"Clip inválido de {ip}: {e}") from e
+        digest = self.content_cache.add(data)
+        self.applier.put(ip, data, digest, stamp)
+
+    def _write_clip(self, ip, data, digest, stamp):
+        """Escribe en el portapapeles un clip recibido (solo desde el hilo de ClipApplier)."""
+        with self.clipboard_lock:
+            if stamp is not None and self.clipboard_stamp is not None and stamp <= self.clipboard_stamp:
+                logger.info(f"Clip de {ip} más antiguo que el contenido actual del portapapeles; se descarta.")
+                return
+            stamp = stamp or self.clock.tick()
+            # Actualizar el portapapeles si el contenido es diferente (sin preguntar al sistema)
+            if digest == self.clipboard_digest:
+                self.clipboard_stamp = max(stamp, self.clipboard_stamp or stamp)
+                logger.debug(f"Clip de {ip} igual al contenido actual del portapapeles; no se escribe.")
+                return
+        mime, body = clip_format.unpack(data)
+        try:
+            written_mime, written_body = clipboard.forma_en_portapapeles(mime, body)
+            # Anotar el clip antes de escribirlo: el monitor lo leerá en cuanto llegue al portapapeles
+            # y no debe tomarlo por una copia local
+            self.remote_clips.record(digest, ip, stamp)
+            if written_mime != mime:
+                self.remote_clips.record(content_digest(clip_format.pack(written_mime, written_body)), ip, stamp)
+            alternativo = clipboard.texto_alternativo(written_mime, written_body)
+            if alternativo is not None: # Sin clipboard_html el monitor leerá el texto plano ofrecido
+                self.remote_clips.record(content_digest(alternativo), ip, stamp)
+            clipboard.escribir_portapapeles(written_mime, written_body)
+            with self.clipboard_lock:
+                self.clipboard_digest = digest
+                self.clipboard_stamp = stamp
+            logger.info(f"Portapapeles actualizado desde {ip}: {clip_format.describe(mime, body, 50)}")
+        except (clipboard.ClipboardError, OSError, ValueError) as e:
+            logger.warning(f"No se pudo copiar al portapapeles el clip {mime} recibido de {ip}: {e}")
+            return
+        if self.on_remote_clip:
+            try:
+                self.on_remote_clip(ip)
+            except Exception as e:
+                logger.error(f"Error notificando el clip recibido de {ip}: {e}", exc_info=True)
+
+    def _as_clip_data(self, content):
+        """Sobre de clip_format para 'content' (texto, o un sobre ya construido en bytes)."""
+        if isinstance(content, str):
+            return clip_format.pack_text(content)
+        return bytes(content)
+
+    def _peer_policy(self, ip):
+        """Ajustes efectivos para un peer: los generales más los de su sección [peer:<ip>]."""
+        overrides = self.peer_settings.get(ip)
+        return {**self.settings, **overrides} if overrides else self.settings
+
+    def remote_clip_origin(self, digest):
+        """(ip de origen, sello) si el clip con esa huella acaba de llegar de un peer, o None."""
+        return self.remote_clips.lookup(digest)
+
+    def remember_local_clip(self, content, digest=None):
+        """Registra un contenido copiado localmente, para no volver a recibirlo si un peer lo ofrece.
+
+        La copia local es el estado más reciente: los clips con un sello anterior ya no se aplican.
+        Solo se guarda su huella: el contenido entra en la caché si llega a compartirse (_new_clip),
+        así lo que no se comparte (p. ej. contraseñas excluidas) no se queda en memoria ni se puede pedir.
+        """
+        if digest is None:
+            digest = content_digest(self._as_clip_data(content))
+        with self.clipboard_lock:
+            self.clipboard_digest = digest
+            self.clipboard_stamp = self.clock.tick()
+
+    def _new_clip(self, content, progress=None):
+        clip = OutgoingClip(self._as_clip_data(content), progress)
+        with self.clipboard_lock:
+            # Lo que está en el portapapeles sale con el sello de cuando se copió (remember_local_clip):
+            # un envío retrasado no debe pasar por delante de clips recibidos después de la copia
+            if clip.digest == self.clipboard_digest:
+                clip.stamp = self.clipboard_stamp
+        if clip.stamp is None:
+            clip.stamp = self.clock.tick()
+        self.content_cache.add(clip.data, clip.digest)
+        return clip
+
+    def forget_connection(self, ip):
+        """Al cerrarse una conexión entrante, descarta la saliente cacheada para el peer solo si está muerta.
+
+        Si otro hilo la está usando (lock del peer tomado) no se toca: sus errores ya la descartan.
+        """
+        conn, _ = self.pool.get(ip)
+        if conn is None:
+            return
+        peer_lock = self._get_peer_lock(ip)
+        if not peer_lock.acquire(blocking=False):
+            return
+        try:
+            if self._connection_closed(conn):
+                logger.info(f"La conexión saliente con {ip} también está cerrada; se descarta.")
+                self.pool.discard(ip, conn)
+        finally:
+            peer_lock.release()
+
+    @staticmethod
+    def _connection_closed(conn):
+        """True si el peer cerró el socket o está en error (sin bloquear ni consumir datos)."""
+        try:
+            readable, _, _ = select.select([conn], [], [], 0)
+            return bool(readable) and not conn.recv(1, socket.MSG_PEEK)
+        except (OSError, ValueError):
+            return True
 
     def handle_connection(self, conn, addr):
         """Maneja una conexión entrante."""
         ip = addr[0]
         logger.info(f"Conexión entrante aceptada de {ip}")
         
+        session = self.new_session(ip)
+        reader = session["reader"]
         try:
             while self.running:
-                data = conn.recv(65536)  # Buffer grande para contenido grande
-                if not data:
+                message = reader.read_message(conn)
+                if message is None:
                     logger.info(f"Conexión cerrada por {ip}")
                     break
-                    
-                # Ignorar mensajes de keep-alive si se implementan
-                # if data == b"PING":
-                #     conn.sendall(b"PONG") # Ejemplo de respuesta a keep-alive
-                #     continue
-                    
-                content = data.decode()
-                logger.info(f"Recibidos {len(data)} bytes de {ip}")
-                
-                # Actualizar el portapapeles si el contenido es diferente
-                # Esta lógica podría ser más compleja (ej. evitar auto-actualización)
-                if pyperclip.paste() != content:
-                    pyperclip.copy(content)
-                    logger.info(f"Portapapeles actualizado desde {ip}: {content[:50]}...")
-                    
+
+                msg_type, flags, payload = message
+                for reply in self.process_message(session, msg_type, flags, payload):
+                    conn.sendall(reply)
+
+        except ProtocolError as e:
+            logger.warning(f"Mensaje inválido recibido de {ip}: {e}. Cerrando conexión.")
+        except UnicodeDecodeError as e:
+            logger.warning(f"Contenido no UTF-8 recibido de {ip}: {e}. Cerrando conexión.")
         except ConnectionResetError:
             logger.warning(f"Conexión reseteada por {ip}")
         except Exception as e:
             logger.error(f"Error en la conexión con {ip}: {e}", exc_info=True)
         finally:
-            if ip in self.connections:
-                with self.lock:
-                    del self.connections[ip]
+            self.forget_connection(ip)
             conn.close()
             logger.info(f"Conexión con {ip} cerrada y eliminada.")
 
@@ -68,6 +625,12 @@ class ConnectionManager:
             self.listener.listen(5) # Aceptar hasta 5 conexiones en cola
             logger.info(f"Escuchando conexiones TCP en 0.0.0.0:{self.PORT}")
 
+            if self.engine_mode == "selectors":
+                # Un único hilo atiende el listener y todas las conexiones entrantes
+                self.engine = SelectorEngine(self)
+                self.engine.serve(self.listener)
+                return
+
             while self.running:
                 try:
                     conn, addr = self.listener.accept()
@@ -89,81 +652,419 @@ class ConnectionManager:
                 self.listener.close()
             logger.info("Listener TCP detenido.")
 
+    def _open_connection(self, ip, timeout=CONNECT_TIMEOUT):
+        """Abre una conexión TCP con el peer y la guarda en el pool. Propaga el error de socket si falla."""
+        logger.info(f"Intentando conectar a {ip}:{self.PORT}")
+        conn = socket.create_connection((ip, self.PORT), timeout=timeout)
+        if self.settings["tcp_keepalive"]:
+            enable_keepalive(conn)
+        try:
+            session = self._handshake(conn, ip)
+        except Exception:
+            conn.close()
+            raise
+        conn.settimeout(CONNECT_TIMEOUT)
+        logger.info(f"Conexión establecida con {ip}")
+        self.pool.put(ip, conn, session)
+        return conn
+
+    def _handshake(self, conn, ip):
+        """Intercambia HELLO con el peer recién conectado y devuelve la sesión negociada."""
+        session = self.new_session(ip) # Su lector recibe las respuestas por esta conexión (incluidos clips pedidos con FETCH)
+        conn.settimeout(HANDSHAKE_TIMEOUT)
+        allow_resume = True
+        while True:
+            secure = state = None
+            if self.settings["encryption"]:
+                secure, state = self.security.client_hello(ip, allow_resume)
+            conn.sendall(build_frame(MSG_HELLO, self._hello_payload(secure)))
+            message = session["reader"].read_message(conn)
+            if message is None or message[0] != MSG_HELLO:
+                raise ProtocolError(f"Respuesta inesperada de {ip} durante la negociación")
+            try:
+                reply = json.loads(message[2].decode('utf-8'))
+            except ValueError as e:
+                raise ProtocolError(f"HELLO de respuesta inválido de {ip}: {e}") from e
+            if state is None:
+                break
+            if not isinstance(reply.get("secure"), dict):
+                raise ProtocolError(f"{ip} no admite conexiones cifradas")
+            channel, auth = self.security.client_finish(ip, state, reply["secure"])
+            if channel is not None:
+                if auth is not None:
+                    conn.sendall(build_frame(MSG_AUTH, auth))
+                session["channel"] = channel
+                break
+            allow_resume = False # Ticket rechazado: handshake completo por la misma conexión
+        codec_name = reply.get("codec")
+        if codec_name:
+            if codec_name not in compression.available_codecs():
+                raise ProtocolError(f"{ip} eligió un códec no ofrecido: {codec_name}")
+            session["codec"] = compression.CODEC_IDS[codec_name]
+        session["features"] = set(reply.get("features", []))
+        self._session_ready(session)
+        logger.info(f"Negociado con {ip}: compresión={codec_name or 'ninguna'}, cifrado={'sí' if session.get('channel') else 'no'}")
+        return session
+
+    def _discard_connection(self, ip, conn):
+        """Elimina y cierra una conexión saliente que ha fallado."""
+        self.pool.discard(ip, conn)
+
+    def _ping_connection(self, ip, conn, session):
+        """PING por una conexión del pool (con el lock del peer tomado). True si respondió a tiempo."""
+        try:
+            conn.settimeout(PING_TIMEOUT)
+            conn.sendall(self._frame(session, MSG_PING))
+            self._read_reply(conn, session, (MSG_PONG,))
+            conn.settimeout(CONNECT_TIMEOUT)
+            return True
+        except (OSError, ProtocolError) as e:
+            logger.debug(f"PING a {ip} fallido: {e}")
+            return False
+
+    def _prewarm_candidates(self):
+        """Peers confiables con actividad reciente: conviene tener su conexión abierta de antemano."""
+        if not self.running:
+            return []
+        now = time.monotonic()
+        window = self.settings["pool_prewarm_window"]
+        recent = {ip for ip, seen in list(self.peer_activity.items()) if now - seen <= window}
+        if not recent:
+            return []
+        return [ip for ip in dict.fromkeys(self.get_trusted_peers(quiet=True)) if ip in recent]
+
+    def _get_peer_lock(self, ip):
+        """Lock por peer para que dos envíos no intercalen mensajes en el mismo socket."""
+        with self.lock:
+            return self.peer_locks.setdefault(ip, threading.Lock())
+
     def connect_to_peer(self, ip):
         """Establece una conexión TCP saliente con un peer."""
-        if ip in self.connections:
+        conn, _ = self.pool.get(ip)
+        if conn is not None:
             logger.info(f"Ya existe una conexión con {ip}, reutilizando.")
-            return self.connections[ip]
+            return conn
         
         try:
-            logger.info(f"Intentando conectar a {ip}:{self.PORT}")
-            conn = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            conn.settimeout(5) # Timeout de 5 segundos para la conexión
-            conn.connect((ip, self.PORT))
-            logger.info(f"Conexión establecida con {ip}")
-            with self.lock:
-                self.connections[ip] = conn
-            
             # Podrías querer iniciar un hilo para manejar esta conexión saliente también,
             # si esperas recibir datos de vuelta de forma asíncrona por esta misma conexión.
             # Por ahora, se asume que es principalmente para enviar.
-            return conn
+            with self._get_peer_lock(ip): # put() del pool requiere el lock del peer
+                return self._open_connection(ip)
         except socket.timeout:
             logger.error(f"Timeout conectando a {ip}:{self.PORT}")
         except Exception as e:
             logger.error(f"Error conectando a {ip}:{self.PORT}: {e}", exc_info=False) # exc_info=False para no ser tan verboso en fallos de conexión comunes
         return None
 
-    def send_to_peer(self, ip, content):
-        """Envía contenido a un peer específico."""
-        conn = self.connections.get(ip)
-        if not conn:
-            conn = self.connect_to_peer(ip)
+    def send_to_peer(self, ip, content, timeout=None, progress=None):
+        """Envía contenido a un peer específico.
+
+        'timeout' es el plazo total para este peer (espera, conexión y envío); None usa los
+        timeouts por defecto. 'progress(enviados, total)' informa del avance de clips grandes.
+        Devuelve SEND_OK, SEND_TIMEOUT, SEND_REFUSED o SEND_ERROR.
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        return self._deliver(ip, self._new_clip(content, progress), deadline)
+
+    def _deliver(self, ip, clip, deadline=None, store=True):
+        """Envía un OutgoingClip a un peer respetando el plazo absoluto 'deadline'.
+
+        Si falla y la bandeja de salida está activa, el clip se guarda para cuando el peer vuelva
+        (salvo con store=False, al vaciar la propia bandeja).
+        """
+        peer_lock = self._get_peer_lock(ip)
+        lock_timeout = -1 if deadline is None else max(0, deadline - time.monotonic())
+        if not peer_lock.acquire(timeout=lock_timeout):
+            # El peer está ocupado con otro envío (p. ej. vaciando su bandeja): no está caído, así
+            # que el clip no se guarda para después.
+            logger.warning(f"Plazo agotado esperando a que termine otro envío hacia {ip}.")
+            return SEND_TIMEOUT
+        try:
+            status = self._send_clip(ip, clip, deadline)
+        finally:
+            peer_lock.release()
+        if status != SEND_OK and store and self.outbox is not None and ip in self.get_trusted_peers():
+            self.outbox.put(ip, clip.data, clip.stamp)
+            logger.info(f"Clip guardado en la bandeja de salida de {ip}; se entregará cuando vuelva a estar disponible.")
+        return status
+
+    def peer_available(self, ip):
+        """Aviso (descubrimiento o HELLO entrante) de que un peer está activo: vacía su bandeja de salida.
+
+        No hay reintentos periódicos: solo se intenta al tener noticias del peer, y como mucho una
+        vez cada 'outbox_retry_interval' segundos.
+        """
+        if self.outbox is None or not self.running:
+            return
+        now = time.monotonic()
+        with self.lock:
+            if ip in self.outbox_draining or now - self.outbox_attempts.get(ip, -1e9) < self.settings["outbox_retry_interval"]:
+                return
+            if not self.outbox.has(ip):
+                return
+            self.outbox_draining.add(ip)
+            self.outbox_attempts[ip] = now
+        try:
+            self.executor.submit(self._drain_outbox, ip)
+        except RuntimeError: # Executor ya cerrado
+            with self.lock:
+                self.outbox_draining.discard(ip)
 
-        if conn:
+    def _drain_outbox(self, ip):
+        try:
+            pending = self.outbox.take(ip)
+            if not pending:
+                self.outbox.ack(ip, []) # Solo quedaban clips caducados
+                return
+            logger.info(f"{ip} vuelve a estar disponible; entregando {len(pending)} clip(s) de su bandeja de salida.")
+            delivered = []
             try:
-                conn.sendall(content.encode())
-                logger.info(f"Contenido enviado a {ip}")
-            except socket.error as e: # Captura errores específicos de socket
-                logger.error(f"Error de socket enviando a {ip}: {e}. Intentando reconectar.")
-                with self.lock:
-                    if ip in self.connections: # Eliminar conexión rota
-                        del self.connections[ip]
-                # Reintento de conexión y envío una vez
-                conn_new = self.connect_to_peer(ip)
-                if conn_new:
-                    try:
-                        conn_new.sendall(content.encode())
-                        logger.info(f"Contenido reenviado a {ip} después de reconexión.")
-                    except Exception as e_retry:
-                        logger.error(f"Error enviando a {ip} después de reconexión: {e_retry}")
+                for record in pending: # Del más antiguo al más reciente: el receptor se queda con el último
+                    clip = OutgoingClip(record.data, None, record.stamp)
+                    self.content_cache.add(clip.data, clip.digest)
+                    status = self._deliver(ip, clip, time.monotonic() + self.settings["peer_deadline"], store=False)
+                    if status != SEND_OK:
+                        logger.info(f"{ip} sigue sin estar disponible ({status}); se conserva el resto de su bandeja de salida.")
+                        return
+                    delivered.append(record)
+            finally:
+                # Solo se quitan los entregados: los clips guardados durante el vaciado siguen ahí
+                self.outbox.ack(ip, delivered)
+        except Exception as e:
+            logger.error(f"Error vaciando la bandeja de salida de {ip}: {e}", exc_info=True)
+        finally:
+            with self.lock:
+                self.outbox_draining.discard(ip)
+
+    def _send_clip(self, ip, clip, deadline):
+        try:
+            adapted = clip.adapted(self._peer_policy(ip))
+        except Exception as e: # Imagen que Pillow no puede abrir o recodificar
+            logger.error(f"No se pudo preparar la imagen para {ip}: {e}")
+            return SEND_ERROR
+        if adapted is not clip:
+            logger.info(f"Imagen adaptada para {ip}: {len(clip.data)} -> {len(adapted.data)} bytes")
+            clip = adapted
+            self.content_cache.add(clip.data, clip.digest) # Para ofertas, deltas y FETCH de esta versión
+        # Como mucho dos intentos: si la conexión cacheada estaba rota se reconecta una vez
+        for attempt in range(2):
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                logger.warning(f"Plazo agotado antes de poder enviar a {ip}.")
+                return SEND_TIMEOUT
+            op_timeout = CONNECT_TIMEOUT if remaining is None else min(CONNECT_TIMEOUT, remaining)
+
+            conn, session = self.pool.get(ip)
+            reused = conn is not None
+            try:
+                if conn is None:
+                    conn = self._open_connection(ip, op_timeout)
+                    _, session = self.pool.get(ip)
+                session = session or self.new_session(ip)
+                conn.settimeout(op_timeout)
+                if clip.stamp is not None and FEATURE_STAMP in session["features"]:
+                    conn.sendall(self._frame(session, MSG_STAMP, STAMP_FORMAT.pack(*clip.stamp)))
+                if self._announce(conn, session, clip):
+                    logger.info(f"Clip anunciado a {ip}; se transferirá cuando lo pida.")
+                    self.peer_activity[ip] = time.monotonic()
+                    return SEND_OK
+                if self._peer_has_clip(conn, session, clip):
+                    logger.info(f"{ip} ya tenía el contenido ofrecido; no se reenvía.")
+                elif self._send_delta(conn, session, clip, deadline):
+                    logger.info(f"Contenido enviado a {ip} como delta.")
                 else:
-                    logger.error(f"No se pudo reconectar con {ip} para enviar.")
+                    flags, payload = clip.payload_for(session["codec"], self.settings["compression_threshold"])
+                    self._stream(conn, session, MSG_CLIP, payload, flags, deadline, clip.progress)
+                    logger.info(f"Contenido enviado a {ip}" if attempt == 0 else f"Contenido reenviado a {ip} después de reconexión.")
+                self.last_delivered[ip] = clip.digest
+                self.peer_activity[ip] = time.monotonic()
+                return SEND_OK
+            except socket.timeout:
+                logger.error(f"Timeout enviando a {ip}:{self.PORT}")
+                if conn is not None:
+                    self._discard_connection(ip, conn)
+                return SEND_TIMEOUT
+            except ProtocolError as e:
+                logger.error(f"Error de protocolo con {ip}: {e}")
+                if conn is not None:
+                    self._discard_connection(ip, conn)
+                return SEND_ERROR
+            except ConnectionRefusedError:
+                logger.warning(f"No se pudo conectar a {ip} para enviar contenido: conexión rechazada.")
+                return SEND_REFUSED
+            except OSError as e: # Captura errores específicos de socket
+                if conn is not None:
+                    self._discard_connection(ip, conn)
+                if reused:
+                    logger.error(f"Error de socket enviando a {ip}: {e}. Intentando reconectar.")
+                    continue
+                logger.error(f"Error de socket con {ip}: {e}")
+                return SEND_ERROR
             except Exception as e:
                 logger.error(f"Error general enviando a {ip}: {e}", exc_info=True)
-        else:
-            logger.warning(f"No se pudo conectar a {ip} para enviar contenido.")
+                return SEND_ERROR
+        return SEND_ERROR
+
+    def _read_reply(self, conn, session, expected_types):
+        """Lee la respuesta del peer a una petición hecha por la conexión saliente."""
+        message = session["reader"].read_message(conn)
+        if message is None:
+            raise ConnectionResetError(f"{session['ip']} cerró la conexión antes de responder")
+        msg_type, flags, payload = message
+        if msg_type not in expected_types:
+            raise ProtocolError(f"Respuesta inesperada de {session['ip']}: tipo {msg_type}")
+        flags, payload = self._open_payload(session, msg_type, flags, payload)
+        return msg_type, flags, payload
+
+    def _announce(self, conn, session, clip):
+        """En modo lazy envía solo el descriptor del clip. True si se anunció en lugar de enviarse."""
+        if self.share_mode != SHARE_LAZY or FEATURE_LAZY not in session["features"]:
+            return False
+        if len(clip.data) < self.settings["lazy_threshold"] or clip.digest not in self.content_cache:
+            return False # Pequeño, o demasiado grande para la caché (no podríamos servirlo después)
+        conn.sendall(self._frame(session, MSG_ANNOUNCE, clip.descriptor(self.settings["lazy_preview_chars"])))
+        with self.lock:
+            announced = self.announced.setdefault(session["ip"], OrderedDict())
+            announced.pop(clip.digest, None)
+            announced[clip.digest] = True
+            while len(announced) > MAX_ANNOUNCEMENTS:
+                announced.popitem(last=False)
+        return True
+
+    def _peer_has_clip(self, conn, session, clip):
+        """Ofrece la huella del clip. True si el peer responde que ya lo tiene (HAVE)."""
+        if FEATURE_DEDUP not in session["features"] or len(clip.data) < self.settings["dedup_threshold"]:
+            return False
+        conn.sendall(self._frame(session, MSG_OFFER, OFFER_FORMAT.pack(clip.digest, len(clip.data))))
+        msg_type, _, payload = self._read_reply(conn, session, (MSG_HAVE, MSG_NEED))
+        if bytes(payload) != clip.digest:
+            raise ProtocolError(f"Respuesta a la oferta con huella distinta de {session['ip']}")
+        return msg_type == MSG_HAVE
+
+    def _stream(self, conn, session, msg_type, payload, flags, deadline, progress=None):
+        """Envía un mensaje grande por trozos, respetando el plazo del envío.
+
+        Sin cifrado el payload se envía sin copias. En una sesión cifrada el mensaje se sella
+        entero antes de trocearlo (un nonce por mensaje), así que se crea una copia cifrada
+        completa: el envío por trozos solo aporta backpressure y progreso.
+        """
+        channel = session.get("channel")
+        if channel is not None:
+            flags |= FLAG_ENCRYPTED
+            payload = channel.seal(msg_type, flags, payload)
+        timeout = None if deadline is None else deadline - time.monotonic()
+        send_frame(conn, msg_type, payload, flags, self.settings["send_chunk_size"], timeout, progress)
+
+    def _send_delta(self, conn, session, clip, deadline=None):
+        """Intenta enviar el clip como delta sobre el último entregado al peer. True si el peer lo reconstruyó."""
+        ip = session["ip"]
+        if not self.settings["delta"] or FEATURE_DELTA not in session["features"]:
+            return False
+        if len(clip.data) < self.settings["delta_threshold"]:
+            return False
+        base_digest = self.last_delivered.get(ip)
+        base = self.content_cache.get(base_digest) if base_digest else None
+        if base is None or base_digest == clip.digest:
+            return False
+        ops = clip.delta_from(base_digest, base)
+        if ops is None:
+            return False
+
+        payload = DELTA_HEADER.pack(base_digest, clip.digest, delta.DEFAULT_BLOCK_SIZE) + ops
+        flags = 0
+        if session["codec"] != compression.CODEC_NONE and len(payload) >= self.settings["compression_threshold"]:
+            compressed = compression.compress(session["codec"], payload)
+            if len(compressed) < len(payload):
+                payload, flags = compressed, session["codec"] & FLAG_CODEC_MASK
+        self._stream(conn, session, MSG_DELTA, payload, flags, deadline, clip.progress)
+        msg_type, _, reply = self._read_reply(conn, session, (MSG_HAVE, MSG_NEED))
+        if bytes(reply) != clip.digest:
+            raise ProtocolError(f"Respuesta a la delta con huella distinta de {ip}")
+        if msg_type == MSG_NEED:
+            logger.info(f"{ip} no pudo aplicar la delta; se envía el contenido completo.")
+            return False
+        return True
+
+    def _timed_deliver(self, ip, clip, deadline):
+        start = time.monotonic()
+        status = self._deliver(ip, clip, deadline)
+        return {"status": status, "latency": time.monotonic() - start}
 
     def send_to_trusted_peers(self, content):
-        """Envía contenido a todos los peers en la lista de confiables."""
-        trusted_peers = self.get_trusted_peers()
+        """Envía contenido a todos los peers en la lista de confiables, en paralelo.
+
+        Devuelve un informe {ip: {"status": ..., "latency": segundos}}. Cada peer tiene su
+        propio plazo (peer_deadline), así que un peer caído no retrasa la entrega a los demás.
+        """
+        trusted_peers = list(dict.fromkeys(self.get_trusted_peers())) # Sin duplicados, conservando el orden
         if not trusted_peers:
             logger.info("No hay peers confiables a los que enviar.")
-            return
+            return {}
 
         logger.info(f"Enviando contenido a peers confiables: {trusted_peers}")
-        for peer_ip in trusted_peers:
-            # Aquí podrías añadir una lógica para no enviarte a ti mismo si tu IP local está en la lista,
-            # aunque generalmente el descubrimiento y la lista de peers no deberían incluir la IP local.
-            self.send_to_peer(peer_ip, content)
+        clip = self._new_clip(content) # Una sola codificación (y compresión por códec) para todos los peers
+        start = time.monotonic()
+        deadline = start + self.settings["peer_deadline"]
+        # Aquí podrías añadir una lógica para no enviarte a ti mismo si tu IP local está en la lista,
+        # aunque generalmente el descubrimiento y la lista de peers no deberían incluir la IP local.
+        futures = {self.executor.submit(self._timed_deliver, peer_ip, clip, deadline): peer_ip for peer_ip in trusted_peers}
+        done, not_done = wait(futures, timeout=self.settings["peer_deadline"] + 1)
+
+        report = {}
+        for future in done:
+            try:
+                report[futures[future]] = future.result()
+            except Exception as e:
+                logger.error(f"Error inesperado enviando a {futures[future]}: {e}", exc_info=True)
+                report[futures[future]] = {"status": SEND_ERROR, "latency": time.monotonic() - start}
+        for future in not_done:
+            report[futures[future]] = {"status": SEND_TIMEOUT, "latency": time.monotonic() - start}
+
+        resumen = ", ".join(f"{ip}={r['status']} ({r['latency']*1000:.0f} ms)" for ip, r in report.items())
+        logger.info(f"Envío a confiables completado en {time.monotonic() - start:.2f}s: {resumen}")
+        return report
+
+    def _queued_deliver(self, ip, clip):
+        return self._deliver(ip, clip, time.monotonic() + self.settings["peer_deadline"])
+
+    def queue_to_peer(self, ip, content, clip=None):
+        """Encola el contenido para un peer y vuelve de inmediato (pensado para el hilo de Tk)."""
+        if clip is None:
+            clip = self._new_clip(content)
+        with self.lock:
+            if not self.running:
+                return
+            send_queue = self.send_queues.get(ip)
+            if send_queue is None:
+                send_queue = PeerSendQueue(ip, self._queued_deliver, self.settings["send_queue_idle"])
+                self.send_queues[ip] = send_queue
+        send_queue.put(clip)
+
+    def queue_to_trusted_peers(self, content):
+        """Encola el contenido para todos los peers confiables sin esperar a la red."""
+        trusted_peers = list(dict.fromkeys(self.get_trusted_peers()))
+        if not trusted_peers:
+            logger.info("No hay peers confiables a los que enviar.")
+            return
+        self.queue_to_peers(trusted_peers, content)
+
+    def queue_to_peers(self, peer_ips, content):
+        """Encola el mismo clip para varios peers (se prepara una sola vez)."""
+        clip = self._new_clip(content)
+        for peer_ip in peer_ips:
+            self.queue_to_peer(peer_ip, content, clip)
+
+    def get_trusted_peers(self, quiet=False):
+        """Carga la lista de IPs de peers confiables desde el archivo JSON.
 
-    def get_trusted_peers(self):
-        """Carga la lista de IPs de peers confiables desde el archivo JSON."""
+        Con 'quiet' (consultas periódicas, como las del pool) la lista cargada solo se anota en debug.
+        """
         try:
             with open(TRUSTED_USERS_FILE, 'r') as f:
                 data = json.load(f)
                 peers = data.get("users", [])
-                logger.info(f"Peers confiables cargados: {peers}")
+                (logger.debug if quiet else logger.info)(f"Peers confiables cargados: {peers}")
                 return peers
         except FileNotFoundError:
             logger.warning(f"Archivo de peers confiables no encontrado en {TRUSTED_USERS_FILE}. Creando uno vacío.")
@@ -190,17 +1091,17 @@ class ConnectionManager:
                 logger.info("Socket listener cerrado.")
             except Exception as e:
                 logger.error(f"Error cerrando el socket listener: {e}", exc_info=True)
-        
-        # Cerrar todas las conexiones activas
+
+        if self.engine:
+            self.engine.stop() # El bucle de eventos cierra sus conexiones entrantes al salir
+
+        self.executor.shutdown(wait=False, cancel_futures=True)
         with self.lock:
-            ips_to_close = list(self.connections.keys()) # Copiar claves para evitar problemas al modificar el dict durante la iteración
-            for ip in ips_to_close:
-                conn = self.connections.pop(ip, None) # Eliminar y obtener la conexión
-                if conn:
-                    try:
-                        conn.shutdown(socket.SHUT_RDWR) # Indicar que no se enviarán/recibirán más datos
-                        conn.close()
-                        logger.info(f"Conexión con {ip} cerrada.")
-                    except Exception as e:
-                        logger.error(f"Error cerrando conexión con {ip}: {e}", exc_info=True)
+            for send_queue in self.send_queues.values():
+                send_queue.close()
+            self.send_queues.clear()
+        self.applier.close()
+        
+        # Cerrar todas las conexiones activas (y el mantenimiento del pool)
+        self.pool.close_all()
         logger.info("Todas las conexiones activas han sido cerradas.")
@@ -0,0 +1,207 @@
+# connection_pool.py
+# Pool de conexiones salientes con comprobación de salud: keepalive TCP, PING de aplicación,
+# expulsión por inactividad, tamaño máximo con expulsión LRU y pre-calentado de conexiones
+# a peers con actividad reciente.
+import socket
+import threading
+import time
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+def enable_keepalive(sock, idle=60, interval=15, count=4):
+    """Activa el keepalive TCP para que el sistema detecte por sí solo los peers desaparecidos."""
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        if hasattr(socket, "TCP_KEEPIDLE"): # Linux
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, idle)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, interval)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, count)
+        elif hasattr(socket, "SIO_KEEPALIVE_VALS"): # Windows
+            sock.ioctl(socket.SIO_KEEPALIVE_VALS, (1, idle * 1000, interval * 1000))
+        elif hasattr(socket, "TCP_KEEPALIVE"): # macOS
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPALIVE, idle)
+    except OSError as e:
+        logger.debug(f"No se pudo configurar el keepalive TCP: {e}")
+
+
+class PooledConnection:
+    def __init__(self, sock, session):
+        self.sock = sock
+        self.session = session
+        self.created = time.monotonic()
+        self.last_used = self.created
+
+
+class ConnectionPool:
+    """Conexiones salientes por IP, ordenadas de menos a más recientemente usadas.
+
+    Las operaciones que necesitan el socket en exclusiva (ping, pre-calentado, expulsión LRU) se
+    hacen con el lock del peer, obtenido con 'lock_for(ip)', el mismo que usan los envíos. Quien
+    llama a put() debe tener tomado el lock de ese peer.
+    """
+
+    def __init__(self, lock_for, ping, connect, prewarm_candidates,
+                 max_size=32, idle_timeout=300.0, ping_interval=30.0):
+        self.lock_for = lock_for # lock_for(ip) -> Lock del peer
+        self.ping = ping # ping(ip, conn, session) -> True si el peer respondió
+        self.connect = connect # connect(ip) abre y registra una conexión (puede lanzar)
+        self.prewarm_candidates = prewarm_candidates # () -> IPs a las que conviene tener conexión lista
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.ping_interval = ping_interval
+        self._entries = OrderedDict() # {ip: PooledConnection}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._prewarm_failures = {} # {ip: instante del último intento fallido}
+
+    def get(self, ip):
+        """Devuelve (socket, sesión) de la conexión con el peer, o (None, None)."""
+        with self._lock:
+            entry = self._entries.get(ip)
+            if entry is None:
+                return None, None
+            entry.last_used = time.monotonic()
+            self._entries.move_to_end(ip)
+            return entry.sock, entry.session
+
+    def put(self, ip, sock, session):
+        """Registra una conexión nueva. Expulsa la menos usada si se supera el tamaño máximo."""
+        with self._lock:
+            old = self._entries.pop(ip, None)
+            self._entries[ip] = PooledConnection(sock, session)
+            self._prewarm_failures.pop(ip, None)
+            if self._thread is None and not self._stop.is_set():
+                self._thread = threading.Thread(target=self._maintenance_loop, daemon=True, name="ConnPoolMaintenance")
+                self._thread.start()
+        if old is not None and old.sock is not sock:
+            self._close(old.sock) # Con el lock del peer tomado por quien llama: nadie la está usando
+        self._evict_lru()
+
+    def _evict_lru(self):
+        """Expulsa las conexiones menos usadas mientras se supere el tamaño máximo.
+
+        Las que tienen un envío en curso (lock del peer tomado) no se tocan; si todas lo están,
+        el pool queda por encima del máximo hasta el siguiente mantenimiento.
+        """
+        while True:
+            with self._lock:
+                if len(self._entries) <= self.max_size:
+                    return
+                candidates = list(self._entries.items()) # De menos a más recientemente usada
+            for ip, entry in candidates:
+                peer_lock = self.lock_for(ip)
+                if not peer_lock.acquire(blocking=False):
+                    continue
+                try:
+                    with self._lock:
+                        if self._entries.get(ip) is not entry:
+                            continue
+                        del self._entries[ip]
+                    self._close(entry.sock)
+                finally:
+                    peer_lock.release()
+                logger.info(f"Conexión con {ip} expulsada del pool (LRU).")
+                break
+            else:
+                return
+
+    def discard(self, ip, sock=None):
+        """Quita (y cierra) la conexión del peer. Si se indica 'sock', solo si sigue siendo esa."""
+        with self._lock:
+            entry = self._entries.get(ip)
+            if entry is None or (sock is not None and entry.sock is not sock):
+                entry = None
+            else:
+                del self._entries[ip]
+        if entry is not None:
+            self._close(entry.sock)
+        elif sock is not None:
+            self._close(sock)
+
+    def __contains__(self, ip):
+        with self._lock:
+            return ip in self._entries
+
+    def close_all(self):
+        self._stop.set()
+        with self._lock:
+            entries = list(self._entries.items())
+            self._entries.clear()
+        for ip, entry in entries:
+            try:
+                entry.sock.shutdown(socket.SHUT_RDWR) # Indicar que no se enviarán/recibirán más datos
+            except OSError:
+                pass
+            self._close(entry.sock)
+            logger.info(f"Conexión con {ip} cerrada.")
+
+    def _close(self, sock):
+        try:
+            sock.close()
+        except OSError:
+            pass
+
+    def _maintenance_loop(self):
+        check_every = max(1.0, min(self.ping_interval, self.idle_timeout) / 2)
+        while not self._stop.wait(check_every):
+            try:
+                wanted = set(self.prewarm_candidates())
+                self._check_connections(wanted)
+                self._prewarm(wanted)
+                self._evict_lru()
+            except Exception as e:
+                logger.error(f"Error en el mantenimiento del pool de conexiones: {e}", exc_info=True)
+
+    def _check_connections(self, wanted):
+        """Cierra las conexiones inactivas y hace PING a las que llevan un rato sin usarse.
+
+        Las de 'wanted' (peers con actividad reciente) no caducan por inactividad: se mantienen
+        vivas con PING para que el próximo envío no tenga que conectar.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entries = list(self._entries.items())
+        for ip, entry in entries:
+            idle = now - entry.last_used
+            if idle > self.idle_timeout and ip not in wanted:
+                logger.info(f"Conexión con {ip} inactiva {idle:.0f}s; cerrándola.")
+                self.discard(ip, entry.sock)
+                continue
+            if idle < self.ping_interval:
+                continue
+            peer_lock = self.lock_for(ip)
+            if not peer_lock.acquire(blocking=False):
+                continue # Hay un envío en curso: la conexión se está usando
+            try:
+                alive = self.ping(ip, entry.sock, entry.session)
+            finally:
+                peer_lock.release()
+            if not alive:
+                logger.info(f"{ip} no respondió al PING; conexión descartada.")
+                self.discard(ip, entry.sock)
+
+    def _prewarm(self, wanted):
+        now = time.monotonic()
+        for ip in wanted:
+            if ip in self or self._stop.is_set():
+                continue
+            last_failure = self._prewarm_failures.get(ip)
+            if last_failure is not None and now - last_failure < self.idle_timeout:
+                continue # No insistir con peers que siguen caídos
+            peer_lock = self.lock_for(ip)
+            if not peer_lock.acquire(blocking=False):
+                continue # Hay un envío en curso: ya abrirá él la conexión
+            try:
+                if ip in self:
+                    continue
+                self.connect(ip)
+                logger.info(f"Conexión con {ip} pre-calentada.")
+            except Exception as e:
+                logger.debug(f"No se pudo pre-calentar la conexión con {ip}: {e}")
+                self._prewarm_failures[ip] = now
+            finally:
+                peer_lock.release()
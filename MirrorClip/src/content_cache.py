@@ -0,0 +1,91 @@
+# content_cache.py
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+DIGEST_SIZE = 16 # BLAKE2b de 128 bits: suficiente para identificar contenidos del portapapeles
+
+
+def content_digest(data):
+    """Huella del contenido (bytes) usada para deduplicar envíos entre peers."""
+    return hashlib.blake2b(data, digest_size=DIGEST_SIZE).digest()
+
+
+class ContentCache:
+    """Caché LRU de contenidos recientes indexada por su huella.
+
+    Limitada tanto en número de entradas como en bytes totales, para que unos pocos clips
+    enormes no se queden en memoria indefinidamente.
+    """
+
+    def __init__(self, max_entries=32, max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict() # {huella: bytes}
+        self._total = 0
+        self._lock = threading.Lock()
+
+    def add(self, data, digest=None):
+        """Guarda 'data' y devuelve su huella."""
+        if digest is None:
+            digest = content_digest(data)
+        data = bytes(data)
+        if len(data) > self.max_bytes:
+            return digest
+        with self._lock:
+            old = self._entries.pop(digest, None)
+            if old is not None:
+                self._total -= len(old)
+            self._entries[digest] = data
+            self._total += len(data)
+            while self._entries and (len(self._entries) > self.max_entries or self._total > self.max_bytes):
+                _, evicted = self._entries.popitem(last=False)
+                self._total -= len(evicted)
+        return digest
+
+    def get(self, digest):
+        """Devuelve el contenido con esa huella (y lo marca como reciente) o None."""
+        with self._lock:
+            data = self._entries.get(digest)
+            if data is not None:
+                self._entries.move_to_end(digest)
+            return data
+
+    def __contains__(self, digest):
+        with self._lock:
+            return digest in self._entries
+
+
+class RemoteClipRing:
+    """Huellas de los últimos clips recibidos de peers y llevados al portapapeles local.
+
+    Cada huella guarda el peer de origen y el sello de Lamport del clip. El monitor del
+    portapapeles la consulta para no tomar por una copia local (y volver a compartir) un clip
+    que acaba de llegar de la red.
+
+    Cada entrada sirve una sola vez (lookup la retira) y caduca a los 'ttl' segundos: si más
+    adelante el usuario copia de verdad el mismo contenido, se comparte como cualquier otro.
+    """
+
+    def __init__(self, max_entries=32, ttl=60.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict() # {huella: (ip de origen, sello, instante de llegada)}
+        self._lock = threading.Lock()
+
+    def record(self, digest, origin, stamp):
+        """Anota un clip aplicado desde 'origin' con su sello (tiempo de Lamport, nodo)."""
+        with self._lock:
+            self._entries.pop(digest, None)
+            self._entries[digest] = (origin, stamp, time.monotonic())
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def lookup(self, digest):
+        """(ip de origen, sello) si 'digest' es de un clip recibido hace poco, o None. Retira la entrada."""
+        with self._lock:
+            entry = self._entries.pop(digest, None)
+        if entry is None or time.monotonic() - entry[2] > self.ttl:
+            return None
+        return entry[:2]
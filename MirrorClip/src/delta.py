@@ -0,0 +1,127 @@
+# delta.py
+# Transferencia diferencial al estilo rsync: el emisor conoce el último contenido que entregó
+# a un peer (la "base") y envía solo los bloques que cambiaron respecto a ella.
+import hashlib
+import struct
+
+DEFAULT_BLOCK_SIZE = 2048
+
+_OP_COPY = b"C" # Copiar 'count' bloques de la base a partir del bloque 'start'
+_OP_DATA = b"D" # Bytes literales
+_COPY = struct.Struct("!II")
+_DATA = struct.Struct("!I")
+_MOD = 1 << 16
+
+
+class DeltaError(Exception):
+    """Delta corrupta o incompatible con la base disponible."""
+
+
+def _weak_checksum(block):
+    """Checksum débil rodante (a, b) de rsync para un bloque completo."""
+    a = sum(block) % _MOD
+    b = sum((len(block) - i) * byte for i, byte in enumerate(block)) % _MOD
+    return a, b
+
+
+def _strong_hash(block):
+    return hashlib.blake2b(block, digest_size=8).digest()
+
+
+def compute_delta(base, new, block_size=DEFAULT_BLOCK_SIZE):
+    """Devuelve las operaciones (bytes) que reconstruyen 'new' a partir de 'base'."""
+    base = bytes(base)
+    new = bytes(new)
+    index = {}
+    for block_no in range(len(base) // block_size):
+        block = base[block_no * block_size:(block_no + 1) * block_size]
+        a, b = _weak_checksum(block)
+        index.setdefault(a | (b << 16), []).append((block_no, _strong_hash(block)))
+
+    out = bytearray()
+    copy_start = copy_count = 0
+    literal_start = 0
+
+    def flush_copy():
+        nonlocal copy_count
+        if copy_count:
+            out.extend(_OP_COPY + _COPY.pack(copy_start, copy_count))
+            copy_count = 0
+
+    def flush_literal(end):
+        if end > literal_start:
+            flush_copy()
+            out.extend(_OP_DATA + _DATA.pack(end - literal_start) + new[literal_start:end])
+
+    pos = 0
+    n = len(new)
+    a = b = None
+    while pos + block_size <= n:
+        if a is None:
+            a, b = _weak_checksum(new[pos:pos + block_size])
+        candidates = index.get(a | (b << 16))
+        match = None
+        if candidates:
+            strong = _strong_hash(new[pos:pos + block_size])
+            for block_no, block_hash in candidates:
+                if block_hash == strong:
+                    match = block_no
+                    break
+
+        if match is not None:
+            flush_literal(pos)
+            if copy_count and copy_start + copy_count == match:
+                copy_count += 1
+            else:
+                flush_copy()
+                copy_start, copy_count = match, 1
+            pos += block_size
+            literal_start = pos
+            a = None # El siguiente bloque empieza de cero: se recalcula el checksum
+            continue
+
+        # Sin coincidencia: desplazar la ventana un byte actualizando el checksum en O(1)
+        if pos + block_size < n:
+            old_byte = new[pos]
+            new_byte = new[pos + block_size]
+            a = (a - old_byte + new_byte) % _MOD
+            b = (b - block_size * old_byte + a) % _MOD
+        pos += 1
+
+    flush_literal(n)
+    flush_copy()
+    return bytes(out)
+
+
+def apply_delta(base, ops, block_size=DEFAULT_BLOCK_SIZE, max_size=None):
+    """Reconstruye el contenido nuevo a partir de 'base' y las operaciones de compute_delta()."""
+    base = memoryview(bytes(base))
+    ops = memoryview(ops)
+    result = bytearray()
+    pos = 0
+    try:
+        while pos < len(ops):
+            op = bytes(ops[pos:pos + 1])
+            pos += 1
+            if op == _OP_COPY:
+                start, count = _COPY.unpack_from(ops, pos)
+                pos += _COPY.size
+                begin = start * block_size
+                end = begin + count * block_size
+                if end > len(base):
+                    raise DeltaError("La delta referencia bloques fuera de la base")
+                result += base[begin:end]
+            elif op == _OP_DATA:
+                (length,) = _DATA.unpack_from(ops, pos)
+                pos += _DATA.size
+                if pos + length > len(ops):
+                    raise DeltaError("Datos literales truncados en la delta")
+                result += ops[pos:pos + length]
+                pos += length
+            else:
+                raise DeltaError(f"Operación desconocida en la delta: {op!r}")
+            if max_size is not None and len(result) > max_size:
+                raise DeltaError(f"El contenido reconstruido supera el máximo de {max_size} bytes")
+    except struct.error as e:
+        raise DeltaError(f"Delta truncada: {e}") from e
+    return bytes(result)
@@ -3,54 +3,192 @@ import socket
 import threading
 import time
 import json
-import netifaces
+import select
+import random
+import heapq
 
 from config import PORT, USERNAME, BROADCAST_INTERVAL
+from network_topology import Interface, get_topology
+from peer_registry import get_registry
+from peer_utils import update_peer_details
+from net_settings import cargar_ajustes_red
 import logging
 
 logger = logging.getLogger(__name__)
 
 _discovery_active = True
 _listener_socket = None
+_peer_listeners = [] # Funciones f(ip) a las que se avisa cuando un peer da señales de vida
 
+# Control de tormentas de descubrimiento. Con N equipos, cada solicitud periódica genera N
+# respuestas; para que el tráfico total crezca de forma lineal y no con N²:
+#  - el intervalo entre solicitudes crece con el número de peers activos,
+#  - las respuestas se retrasan un tiempo aleatorio para no llegar todas a la vez,
+#  - no se responde a un socket (ip, puerto) que ya recibió nuestro HELLO dentro del intervalo
+#    actual. Los broadcasts periódicos salen siempre del mismo socket; una búsqueda activa usa
+#    uno nuevo, así que su primera solicitud siempre se responde (y sus reintentos, sin retraso),
+#  - al arrancar y al salir se anuncia un HELLO / BYE gratuito a toda la red.
+DISCOVERY_MESSAGE = b"MirrorClip-Discovery"
+SCAN_RETRY_WINDOW = 3.0 # Segundos en los que una solicitud repetida se considera una búsqueda activa
+REPLY_DELAY_PER_PEER = 0.005 # Segundos de retraso máximo de respuesta añadidos por cada peer conocido
+REPLY_DELAY_LIMIT = 0.2 # Tope del retraso: por debajo de la ventana de silencio de una búsqueda activa (broadcast.IDLE_MIN)
+MAX_TRACKED_SOURCES = 4096 # Sockets (ip, puerto) recordados como mucho antes de purgar los antiguos
+_ajustes = cargar_ajustes_red()
+_ttl_automatico = True # TTL del registro ligado al intervalo (peer_ttl = 0)
+_ultima_respuesta = {} # {(ip, puerto): instante (monotonic) de nuestra última respuesta HELLO}
+_ultima_solicitud = {} # {(ip, puerto): instante de su última solicitud}
+_storm_lock = threading.Lock()
 
-def obtener_broadcast_con_netifaces():
-    """Obtiene la dirección de broadcast usando netifaces, priorizando la interfaz de gateway por defecto."""
+
+def al_ver_peer(callback):
+    """Registra callback(ip), que se llama cada vez que el descubrimiento detecta un peer activo."""
+    _peer_listeners.append(callback)
+
+
+def notificar_peer_visto(ip):
+    for callback in list(_peer_listeners):
+        try:
+            callback(ip)
+        except Exception as e:
+            logger.error(f"[DISCOVERY] Error avisando de la actividad de {ip}: {e}", exc_info=True)
+
+
+def interpretar_hello(data):
+    """(usuario, equipo) de una respuesta 'HELLO:usuario:equipo:ip', o None si no lo es."""
+    if not data.startswith(b"HELLO:"):
+        return None
     try:
-        default_gateway_info = netifaces.gateways().get('default', {}).get(netifaces.AF_INET)
-        if default_gateway_info:
-            default_iface_name = default_gateway_info[1]
-            if default_iface_name in netifaces.interfaces():
-                addrs = netifaces.ifaddresses(default_iface_name)
-                if netifaces.AF_INET in addrs:
-                    for addr_info in addrs[netifaces.AF_INET]:
-                        if 'broadcast' in addr_info and 'addr' in addr_info:
-                            if not addr_info.get('addr', '').startswith('127.'):
-                                broadcast_ip = addr_info['broadcast']
-                                logger.info(f"[DISCOVERY] Usando dirección de broadcast de la interfaz de gateway por defecto '{default_iface_name}': {broadcast_ip}")
-                                return broadcast_ip
-        
-        logger.info("[DISCOVERY] No se encontró broadcast en gateway por defecto. Escaneando otras interfaces...")
-        for iface_name in netifaces.interfaces():
-            addrs = netifaces.ifaddresses(iface_name)
-            if netifaces.AF_INET in addrs:
-                for addr_info in addrs[netifaces.AF_INET]:
-                    if 'broadcast' in addr_info and 'addr' in addr_info:
-                        ip_addr = addr_info['addr']
-                        if not ip_addr.startswith('127.') and not ip_addr.startswith('169.254.'):
-                            broadcast_ip = addr_info['broadcast']
-                            logger.info(f"[DISCOVERY] Usando dirección de broadcast de la interfaz '{iface_name}': {broadcast_ip} (IP local: {ip_addr})")
-                            return broadcast_ip
-                            
-    except ImportError:
-        logger.error("[DISCOVERY] La biblioteca 'netifaces' no está instalada. Por favor, instálala con: pip install netifaces")
-    except Exception as e:
-        logger.error(f"[DISCOVERY] Error usando 'netifaces': {e}", exc_info=True)
-
-    logger.warning("[DISCOVERY] No se pudo determinar la dirección de broadcast específica. Usando 255.255.255.255.")
-    return "255.255.255.255"
-
-obtener_broadcast = obtener_broadcast_con_netifaces
+        parts = data.decode('utf-8').split(":", 3)
+    except UnicodeDecodeError:
+        return None
+    if len(parts) < 4:
+        return None
+    return parts[1], parts[2]
+
+
+def registrar_hello(ip, username, hostname, interface=None):
+    """Anota en el registro de peers una respuesta HELLO de 'ip'. True si el peer es nuevo o ha cambiado.
+
+    Los detalles en disco (known_peer_details.json) solo se reescriben cuando hay algo nuevo,
+    no en cada respuesta periódica.
+    """
+    nuevo = get_registry().seen(ip, username, hostname, interface)
+    if nuevo:
+        update_peer_details(ip, username, hostname, interface=interface)
+    notificar_peer_visto(ip)
+    return nuevo
+
+
+def mensaje_hello(tipo="HELLO"):
+    """'HELLO:usuario:equipo:ip' (o 'BYE:...' al salir)."""
+    return f"{tipo}:{USERNAME}:{socket.gethostname()}:{get_topology().primary_ip()}".encode('utf-8')
+
+
+def intervalo_broadcast():
+    """Segundos entre solicitudes periódicas: BROADCAST_INTERVAL, multiplicado según los peers activos."""
+    peers = len(get_registry().peers())
+    factor = max(1.0, peers / max(1, _ajustes["discovery_peers_per_interval"]))
+    return min(BROADCAST_INTERVAL * factor, max(BROADCAST_INTERVAL, _ajustes["discovery_max_interval"]))
+
+
+def _retardo_respuesta():
+    peers = len(get_registry().peers())
+    limite = min(_ajustes["discovery_reply_delay"], REPLY_DELAY_LIMIT, 0.05 + REPLY_DELAY_PER_PEER * peers)
+    return random.random() * max(0.0, limite)
+
+
+def _plan_respuesta(addr):
+    """Segundos de retraso con que responder a la solicitud de 'addr' (ip, puerto), o None para no responder."""
+    now = time.monotonic()
+    intervalo = intervalo_broadcast()
+    with _storm_lock:
+        if len(_ultima_solicitud) > MAX_TRACKED_SOURCES: # Sockets efímeros de búsquedas activas ya terminadas
+            for tabla in (_ultima_solicitud, _ultima_respuesta):
+                for key in [key for key, instante in tabla.items() if now - instante > 2 * intervalo]:
+                    del tabla[key]
+        anterior = _ultima_solicitud.get(addr)
+        _ultima_solicitud[addr] = now
+        if anterior is not None and now - anterior < SCAN_RETRY_WINDOW:
+            return 0.0 # Reintento de una búsqueda activa: responder ya
+        ultima = _ultima_respuesta.get(addr)
+        if ultima is not None and now - ultima < intervalo:
+            return None
+    return _retardo_respuesta()
+
+
+def _olvidar_origen(ip):
+    # Llamar con _storm_lock tomado
+    for tabla in (_ultima_solicitud, _ultima_respuesta):
+        for key in [key for key in tabla if key[0] == ip]:
+            del tabla[key]
+
+
+def anunciar(tipo="HELLO"):
+    """Envía un HELLO (o BYE) gratuito al broadcast de todas las interfaces."""
+    sockets = abrir_sockets_por_interfaz()
+    try:
+        enviar_por_interfaces(sockets, mensaje_hello(tipo))
+        logger.info(f"[DISCOVERY] Anuncio {tipo} enviado por {len(sockets)} interfaz(es).")
+    finally:
+        for s in sockets:
+            s.close()
+
+
+def _atender_anuncio(data, ip):
+    """Procesa un HELLO o BYE gratuito recibido en el puerto de descubrimiento."""
+    if data.startswith(b"BYE:"):
+        logger.info(f"[DISCOVERY] {ip} anuncia que se desconecta.")
+        with _storm_lock:
+            _olvidar_origen(ip)
+        get_registry().forget(ip)
+        return
+    identidad = interpretar_hello(data)
+    if identidad is None:
+        return
+    with _storm_lock:
+        _olvidar_origen(ip) # Acaba de arrancar: su próxima solicitud se responde
+    registrar_hello(ip, *identidad)
+
+
+def obtener_broadcast():
+    """Dirección de broadcast de la interfaz principal (cacheada en network_topology)."""
+    return get_topology().broadcast_address()
+
+
+def abrir_sockets_por_interfaz():
+    """Un socket UDP de broadcast por cada interfaz IPv4, ligado a su IP: {socket: Interface}.
+
+    Ligar cada socket a la IP de su interfaz hace que el broadcast salga por ella y que las
+    respuestas lleguen a ese mismo socket, así se sabe por qué interfaz se alcanzó cada peer.
+    Sin interfaces utilizables se usa un único socket hacia 255.255.255.255.
+    """
+    sockets = {}
+    for iface in get_topology().interfaces():
+        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+            s.bind((iface.address, 0))
+            s.setblocking(False)
+            sockets[s] = iface
+        except OSError as e:
+            logger.warning(f"[DISCOVERY] No se pudo preparar el broadcast por {iface.name} ({iface.address}): {e}")
+            s.close()
+    if not sockets:
+        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        s.bind(("0.0.0.0", 0))
+        s.setblocking(False)
+        sockets[s] = Interface("*", "0.0.0.0", None, "255.255.255.255", True)
+    return sockets
+
+
+def enviar_por_interfaces(sockets, message):
+    """Envía 'message' al broadcast de cada interfaz a la vez (sin esperas entre interfaces)."""
+    for s, iface in sockets.items():
+        try:
+            s.sendto(message, (iface.broadcast, PORT))
+        except OSError as e:
+            logger.warning(f"[DISCOVERY] Error enviando broadcast por {iface.name} a {iface.broadcast}: {e}")
 
 
 def listen_for_discovery():
@@ -70,26 +208,25 @@ def listen_for_discovery():
         _listener_socket = None
         return
 
+    pendientes = [] # Montículo [(instante, addr)] de respuestas HELLO retrasadas
     while _discovery_active:
         try:
+            _enviar_respuestas(s, pendientes)
+            s.settimeout(min(1.0, max(0.01, pendientes[0][0] - time.monotonic())) if pendientes else 1.0)
             data, addr = s.recvfrom(1024)
-            if data == b"MirrorClip-Discovery":
-                logger.info(f"[DISCOVERY] Solicitud de descubrimiento recibida de {addr[0]}:{addr[1]}")
-                try:
-                    my_hostname = socket.gethostname()
-                    announced_ip = "127.0.0.1"
-                    try:
-                        temp_sock_ip = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-                        temp_sock_ip.connect(("8.8.8.8", 80))
-                        announced_ip = temp_sock_ip.getsockname()[0]
-                        temp_sock_ip.close()
-                    except socket.error:
-                        logger.warning("[DISCOVERY] No se pudo obtener la IP preferida para el mensaje HELLO.")
-                    response_message = f"HELLO:{USERNAME}:{my_hostname}:{announced_ip}"
-                    s.sendto(response_message.encode('utf-8'), addr)
-                    logger.info(f"[DISCOVERY] Respuesta HELLO enviada a {addr[0]}:{addr[1]}")
-                except Exception as e_response:
-                    logger.error(f"[DISCOVERY] Error preparando/enviando respuesta HELLO: {e_response}", exc_info=True)
+            if addr[0] in get_topology().local_ips():
+                continue # Nuestros propios broadcasts también llegan aquí
+            if data == DISCOVERY_MESSAGE:
+                logger.debug(f"[DISCOVERY] Solicitud de descubrimiento recibida de {addr[0]}:{addr[1]}")
+                get_registry().seen(addr[0]) # Quien pregunta está activo
+                notificar_peer_visto(addr[0])
+                retardo = _plan_respuesta(addr)
+                if retardo is not None:
+                    heapq.heappush(pendientes, (time.monotonic() + retardo, addr))
+                else:
+                    logger.debug(f"[DISCOVERY] {addr[0]} ya recibió nuestro HELLO hace poco; no se responde.")
+            elif data.startswith(b"HELLO:") or data.startswith(b"BYE:"):
+                _atender_anuncio(data, addr[0])
         except socket.timeout:
             continue
         except socket.error as e_sock_recv:
@@ -123,36 +260,102 @@ def listen_for_discovery():
     _listener_socket = None
     logger.info("[DISCOVERY] Hilo listen_for_discovery terminado.")
 
-# El resto del archivo (broadcast_discovery, start_discovery, stop_discovery) permanece igual.
-# Solo he añadido la corrección en listen_for_discovery.
+def _enviar_respuestas(s, pendientes):
+    """Envía las respuestas HELLO cuyo retraso aleatorio ya ha vencido."""
+    now = time.monotonic()
+    while pendientes and pendientes[0][0] <= now:
+        _, addr = heapq.heappop(pendientes)
+        try:
+            s.sendto(mensaje_hello(), addr)
+            with _storm_lock:
+                _ultima_respuesta[addr] = now
+            logger.debug(f"[DISCOVERY] Respuesta HELLO enviada a {addr[0]}:{addr[1]}")
+        except Exception as e_response:
+            logger.error(f"[DISCOVERY] Error preparando/enviando respuesta HELLO: {e_response}", exc_info=True)
+
+
+def _recoger_respuestas(sockets, duracion):
+    """Atiende durante 'duracion' segundos las respuestas HELLO a nuestro broadcast y las registra."""
+    fin = time.monotonic() + duracion
+    while _discovery_active:
+        restante = fin - time.monotonic()
+        if restante <= 0:
+            break
+        try:
+            listos, _, _ = select.select(list(sockets), [], [], min(restante, 1.0)) # Revisar _discovery_active cada segundo
+        except (OSError, ValueError): # Sockets cerrados durante la parada
+            break
+        for s in listos:
+            iface = sockets[s]
+            try:
+                data, addr = s.recvfrom(1024)
+            except OSError as e: # WSAECONNRESET en Windows si un host no tiene el puerto abierto
+                logger.debug(f"[DISCOVERY] Error recibiendo respuesta por {iface.name}: {e}")
+                continue
+            if addr[0] in get_topology().local_ips():
+                continue
+            identidad = interpretar_hello(data)
+            if identidad is None:
+                logger.debug(f"[DISCOVERY] Respuesta no válida de {addr[0]} ignorada: {data[:60]}")
+                continue
+            registrar_hello(addr[0], *identidad, interface=iface.name)
+
+
+def _cerrar_sockets(sockets):
+    for s_broadcast in sockets:
+        try:
+            s_broadcast.close()
+        except OSError:
+            pass
+
 
 def broadcast_discovery():
     global _discovery_active
     logger.info("[DISCOVERY] Iniciando hilo de transmisión de descubrimiento...")
-    time.sleep(time.time() % 2.0 + 0.5)
+    try:
+        anunciar() # Los demás nos registran sin esperar a su próxima solicitud
+    except Exception as e_anuncio:
+        logger.error(f"[DISCOVERY] Error enviando el anuncio de inicio: {e_anuncio}")
+    time.sleep(random.uniform(0.5, 2.5)) # Al azar: si arrancan varios equipos a la vez no se sincronizan
 
-    while _discovery_active:
-        try:
-            broadcast_ip_addr = obtener_broadcast()
-            logger.info(f"[DISCOVERY] Usando dirección de broadcast: {broadcast_ip_addr} en puerto {PORT}")
-            with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s_broadcast:
-                s_broadcast.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-                discovery_message = b"MirrorClip-Discovery"
-                s_broadcast.sendto(discovery_message, (broadcast_ip_addr, PORT))
-                logger.info(f"[DISCOVERY] Mensaje 'MirrorClip-Discovery' enviado a {broadcast_ip_addr}:{PORT}")
-            for _ in range(int(BROADCAST_INTERVAL)):
+    # Los sockets se conservan entre rondas (mismo puerto de origen, para que los demás puedan
+    # suprimir respuestas repetidas) y solo se reabren si cambian las interfaces.
+    sockets = {}
+    interfaces = None
+    try:
+        while _discovery_active:
+            try:
+                intervalo = intervalo_broadcast()
+                if _ttl_automatico:
+                    get_registry().ttl = 3 * intervalo # Sin señales en tres rondas, el peer se da por caído
+                actuales = get_topology().interfaces()
+                if actuales != interfaces or not sockets:
+                    _cerrar_sockets(sockets)
+                    sockets = abrir_sockets_por_interfaz()
+                    interfaces = actuales
+                enviar_por_interfaces(sockets, DISCOVERY_MESSAGE)
+                destinos = ", ".join(f"{iface.broadcast} ({iface.name})" for iface in sockets.values())
+                logger.debug(f"[DISCOVERY] Mensaje 'MirrorClip-Discovery' enviado a {destinos} en puerto {PORT} (siguiente en ~{intervalo:.0f}s)")
+                # Las respuestas alimentan el registro de peers mientras se espera al siguiente envío
+                _recoger_respuestas(sockets, intervalo * random.uniform(0.8, 1.2))
                 if not _discovery_active: break
-                time.sleep(1)
-            if not _discovery_active: break
-        except Exception as e_bcast_general:
-            logger.error(f"[DISCOVERY] Error inesperado en broadcast_discovery: {e_bcast_general}", exc_info=True)
-            if _discovery_active: time.sleep(10)
+            except Exception as e_bcast_general:
+                logger.error(f"[DISCOVERY] Error inesperado en broadcast_discovery: {e_bcast_general}", exc_info=True)
+                _cerrar_sockets(sockets)
+                sockets = {}
+                if _discovery_active: time.sleep(10)
+    finally:
+        _cerrar_sockets(sockets)
     
     logger.info("[DISCOVERY] Hilo broadcast_discovery terminado.")
 
 def start_discovery():
-    global _discovery_active
+    global _discovery_active, _ajustes, _ttl_automatico
     _discovery_active = True
+    _ajustes = cargar_ajustes_red()
+    ttl = _ajustes["peer_ttl"]
+    _ttl_automatico = ttl <= 0
+    get_registry().ttl = ttl if ttl > 0 else 3 * BROADCAST_INTERVAL # Sin señales en tres rondas, el peer se da por caído
     logger.info("[DISCOVERY] Solicitando inicio de servicios de descubrimiento (hilos de escucha y broadcast)...")
     listener_thread = threading.Thread(target=listen_for_discovery, daemon=True, name="DiscoveryListenerThread")
     listener_thread.start()
@@ -163,6 +366,11 @@ def start_discovery():
 def stop_discovery():
     global _discovery_active, _listener_socket
     logger.info("[DISCOVERY] Solicitando parada de servicios de descubrimiento...")
+    if _discovery_active:
+        try:
+            anunciar("BYE") # Que los demás nos quiten de su registro sin esperar a que caduquemos
+        except Exception as e_anuncio:
+            logger.warning(f"[DISCOVERY] Error enviando el anuncio de salida: {e_anuncio}")
     _discovery_active = False
     if _listener_socket:
         try:
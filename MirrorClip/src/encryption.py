@@ -1,8 +1,18 @@
 import os
-from cryptography.hazmat.primitives import serialization
-from cryptography.hazmat.primitives.asymmetric import rsa
+import hashlib
+import struct
+from cryptography.exceptions import InvalidSignature, InvalidTag
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import padding, rsa
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from cryptography.hazmat.backends import default_backend
 from config_paths import KEYS_DIR
+from protocol import ProtocolError
+
+
+class EncryptionError(ProtocolError):
+    """Fallo de autenticación del peer o mensaje cifrado que no se puede verificar."""
 
 def ensure_keys_exist():
     """Genera claves RSA si no existen"""
@@ -28,4 +38,91 @@ def ensure_keys_exist():
             f.write(public_key.public_bytes(
                 encoding=serialization.Encoding.PEM,
                 format=serialization.PublicFormat.SubjectPublicKeyInfo
-            ))
\ No newline at end of file
+            ))
+
+
+def load_private_key():
+    """Carga la clave privada RSA local, generándola si aún no existe."""
+    ensure_keys_exist()
+    with open(KEYS_DIR / "private.pem", "rb") as f:
+        return serialization.load_pem_private_key(f.read(), password=None, backend=default_backend())
+
+
+def public_key_bytes(private_key):
+    """Clave pública en DER (SubjectPublicKeyInfo), tal como viaja en el handshake."""
+    return private_key.public_key().public_bytes(
+        encoding=serialization.Encoding.DER,
+        format=serialization.PublicFormat.SubjectPublicKeyInfo
+    )
+
+
+def key_fingerprint(public_der):
+    """Huella SHA-256 (hex) de una clave pública en DER."""
+    return hashlib.sha256(public_der).hexdigest()
+
+
+def sign(private_key, data):
+    return private_key.sign(
+        data,
+        padding.PSS(mgf=padding.MGF1(hashes.SHA256()), salt_length=padding.PSS.MAX_LENGTH),
+        hashes.SHA256()
+    )
+
+
+def verify(public_der, signature, data):
+    """Comprueba una firma RSA-PSS. Lanza EncryptionError si no es válida."""
+    try:
+        public_key = serialization.load_der_public_key(public_der, backend=default_backend())
+        if not isinstance(public_key, rsa.RSAPublicKey):
+            raise EncryptionError("La clave pública del peer no es RSA")
+        public_key.verify(
+            signature,
+            data,
+            padding.PSS(mgf=padding.MGF1(hashes.SHA256()), salt_length=padding.PSS.MAX_LENGTH),
+            hashes.SHA256()
+        )
+    except InvalidSignature as e:
+        raise EncryptionError("Firma del peer inválida") from e
+    except ValueError as e:
+        raise EncryptionError(f"Clave pública del peer inválida: {e}") from e
+
+
+def derive_keys(secret, salt, info, count):
+    """Deriva 'count' claves de 32 bytes con HKDF-SHA256."""
+    material = HKDF(algorithm=hashes.SHA256(), length=32 * count, salt=salt, info=info).derive(secret)
+    return [material[i * 32:(i + 1) * 32] for i in range(count)]
+
+
+class SecureChannel:
+    """Cifrado AES-256-GCM de los payloads de una conexión ya autenticada.
+
+    Cada sentido usa su propia clave y un contador como nonce, que no viaja por la red: TCP
+    entrega los mensajes en orden, así que un mensaje repetido, reordenado o eliminado hace
+    fallar la verificación del siguiente. El tipo de mensaje y los flags se autentican como
+    datos asociados.
+
+    Cada mensaje se cifra entero, con un solo nonce: el texto cifrado es una copia completa del
+    payload (AES-GCM admite memoryview, así que al menos no se copia también la entrada).
+    """
+
+    _NONCE = struct.Struct("!4xQ")
+    _AAD = struct.Struct("!BH")
+
+    def __init__(self, send_key, recv_key):
+        self._send = AESGCM(send_key)
+        self._recv = AESGCM(recv_key)
+        self._send_counter = 0
+        self._recv_counter = 0
+
+    def seal(self, msg_type, flags, payload):
+        nonce = self._NONCE.pack(self._send_counter)
+        self._send_counter += 1
+        return self._send.encrypt(nonce, payload, self._AAD.pack(msg_type, flags))
+
+    def open(self, msg_type, flags, ciphertext):
+        nonce = self._NONCE.pack(self._recv_counter)
+        self._recv_counter += 1
+        try:
+            return self._recv.decrypt(nonce, ciphertext, self._AAD.pack(msg_type, flags))
+        except InvalidTag as e:
+            raise EncryptionError("Mensaje cifrado corrupto, manipulado o fuera de orden") from e
@@ -0,0 +1,136 @@
+# event_engine.py
+# Motor de red alternativo para ConnectionManager: el listener TCP y todas las conexiones
+# entrantes se atienden desde un único hilo con selectors, en lugar de un hilo por conexión.
+import selectors
+import socket
+import logging
+from protocol import ProtocolError
+
+logger = logging.getLogger(__name__)
+
+
+class _InboundConnection:
+    """Estado de una conexión entrante dentro del bucle de eventos."""
+
+    def __init__(self, sock, ip, session):
+        self.sock = sock
+        self.ip = ip
+        self.session = session # Estado negociado con el peer (códec, capacidades...)
+        self.reader = session["reader"] # Limitado a mensajes pequeños hasta completar el handshake
+        self.outbuf = bytearray() # Respuestas pendientes de escribir
+
+
+class SelectorEngine:
+    def __init__(self, manager):
+        self.manager = manager
+        self.selector = selectors.DefaultSelector()
+        self.connections = {} # {socket: _InboundConnection}
+        # Par de sockets para despertar al bucle desde stop()
+        self._wakeup_recv, self._wakeup_send = socket.socketpair()
+        self._wakeup_recv.setblocking(False)
+
+    def serve(self, listener):
+        """Bucle principal. Bloquea el hilo llamador hasta que el manager se detiene."""
+        listener.setblocking(False)
+        self.selector.register(listener, selectors.EVENT_READ, data="listener")
+        self.selector.register(self._wakeup_recv, selectors.EVENT_READ, data="wakeup")
+        logger.info("Motor 'selectors' iniciado: listener y conexiones entrantes en un único hilo.")
+
+        try:
+            while self.manager.running:
+                for key, events in self.selector.select(timeout=1.0):
+                    if key.data == "wakeup":
+                        try:
+                            self._wakeup_recv.recv(64)
+                        except (BlockingIOError, InterruptedError):
+                            pass
+                    elif key.data == "listener":
+                        self._accept(listener)
+                    else:
+                        if events & selectors.EVENT_READ:
+                            self._read(key.data)
+                        if events & selectors.EVENT_WRITE and key.data.sock in self.connections:
+                            self._write(key.data)
+        except Exception as e:
+            if self.manager.running:
+                logger.error(f"Error inesperado en el bucle de eventos: {e}", exc_info=True)
+        finally:
+            self._close_all()
+            logger.info("Motor 'selectors' detenido.")
+
+    def stop(self):
+        """Despierta al bucle para que detecte que el manager se ha detenido."""
+        try:
+            self._wakeup_send.send(b"\0")
+        except OSError:
+            pass
+
+    def _accept(self, listener):
+        try:
+            conn, addr = listener.accept()
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as e:
+            if self.manager.running:
+                logger.error(f"Error en listener.accept(): {e}", exc_info=True)
+            return
+        conn.setblocking(False)
+        state = _InboundConnection(conn, addr[0], self.manager.new_session(addr[0]))
+        self.connections[conn] = state
+        self.selector.register(conn, selectors.EVENT_READ, data=state)
+        logger.info(f"Conexión entrante aceptada de {state.ip}")
+
+    def _read(self, state):
+        try:
+            messages, closed = state.reader.read_available(state.sock)
+            for msg_type, flags, payload in messages:
+                for reply in self.manager.process_message(state.session, msg_type, flags, payload):
+                    self._queue_reply(state, reply)
+            if closed:
+                logger.info(f"Conexión cerrada por {state.ip}")
+                self._close(state)
+        except ProtocolError as e:
+            logger.warning(f"Mensaje inválido recibido de {state.ip}: {e}. Cerrando conexión.")
+            self._close(state)
+        except ConnectionResetError:
+            logger.warning(f"Conexión reseteada por {state.ip}")
+            self._close(state)
+        except Exception as e:
+            logger.error(f"Error en la conexión con {state.ip}: {e}", exc_info=True)
+            self._close(state)
+
+    def _queue_reply(self, state, reply):
+        if not state.outbuf:
+            self.selector.modify(state.sock, selectors.EVENT_READ | selectors.EVENT_WRITE, data=state)
+        state.outbuf += reply
+
+    def _write(self, state):
+        try:
+            sent = state.sock.send(state.outbuf)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as e:
+            logger.warning(f"Error enviando respuesta a {state.ip}: {e}")
+            self._close(state)
+            return
+        del state.outbuf[:sent]
+        if not state.outbuf:
+            self.selector.modify(state.sock, selectors.EVENT_READ, data=state)
+
+    def _close(self, state):
+        if self.connections.pop(state.sock, None) is None:
+            return
+        try:
+            self.selector.unregister(state.sock)
+        except (KeyError, ValueError):
+            pass
+        state.sock.close()
+        self.manager.forget_connection(state.ip)
+        logger.info(f"Conexión con {state.ip} cerrada y eliminada.")
+
+    def _close_all(self):
+        for state in list(self.connections.values()):
+            self._close(state)
+        self.selector.close()
+        self._wakeup_recv.close()
+        self._wakeup_send.close()
@@ -0,0 +1,32 @@
+# lamport.py
+import os
+import time
+import threading
+
+
+class LamportClock:
+    """Reloj lógico de Lamport para ordenar las copias hechas en distintas máquinas.
+
+    Los sellos son tuplas (tiempo, nodo): se comparan igual en todos los peers, así que dos
+    copias simultáneas quedan ordenadas de la misma forma en toda la red.
+
+    El tiempo nunca baja de los milisegundos de reloj de pared: así un equipo recién arrancado
+    (con el contador a cero) no produce sellos más antiguos que el estado que ya tienen los
+    demás. Cada sello recibido adelanta el reloj, como en el algoritmo original.
+    """
+
+    def __init__(self, node_id=None):
+        self.node_id = node_id if node_id is not None else int.from_bytes(os.urandom(8), "big")
+        self.time = 0
+        self._lock = threading.Lock()
+
+    def tick(self):
+        """Sello para un evento local (una copia o un envío)."""
+        with self._lock:
+            self.time = max(self.time + 1, int(time.time() * 1000))
+            return (self.time, self.node_id)
+
+    def observe(self, stamp):
+        """Incorpora el sello de un mensaje recibido."""
+        with self._lock:
+            self.time = max(self.time, stamp[0])
@@ -10,6 +10,9 @@ a = Analysis(
     'configparser',
     'cryptography.hazmat.primitives.serialization',
     'cryptography.hazmat.backends',
+    'cryptography.hazmat.primitives.ciphers.aead',
+    'cryptography.hazmat.primitives.asymmetric.x25519',
+    'cryptography.hazmat.primitives.kdf.hkdf',
     'pystray._win32'
 ],
     hookspath=[],
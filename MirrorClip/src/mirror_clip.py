@@ -18,15 +18,22 @@ from port_editor import PortEditor, cargar_puerto
 from status import EstadoVentana
 import discovery
 from connection import ConnectionManager
+from auto_share import AutoSharer
 import os # Para os.startfile (Windows) y os.remove/os.getpid, os.path.join, os.getenv
 import sys # Para sys.stderr y sys.exit (o os._exit)
 import threading
 import pyperclip # Para el portapapeles
+import clipboard # Portapapeles con tipos (texto, HTML, imágenes)
+import clip_format
+import clipboard_watch
+from content_cache import content_digest
+from net_settings import cargar_ajustes_red
 import time
 from pathlib import Path
 from user_manager import GestionUsuarios
 import logging # Módulo de logging
-from peer_utils import get_peer_display_name
+from peer_utils import get_peer_display_name, load_known_peer_details
+from peer_registry import get_registry
 import json
 
 # Módulos adicionales para abrir el archivo trusted_users.json
@@ -37,9 +44,10 @@ APP_NAME = "MirrorClip" # Definido globalmente para ser usado por el logger y ot
 run_app = True
 systray = None
 ventana = None
-last_clipboard_content = ""
+last_clipboard_digest = None # Huella del último contenido visto en el portapapeles (no se guarda el contenido)
 conn_manager = None
 share_menu = None
+auto_sharer = None # Reglas de compartición automática (se comparte sin mostrar el menú)
 lock_file = None
 
 _main_thread_id = None # Para identificar el hilo principal de Tkinter
@@ -113,11 +121,17 @@ class ShareMenu:
             trusted_peer_ips = self.conn_manager.get_trusted_peers() # Esta función lee TRUSTED_USERS_FILE
         
         if trusted_peer_ips:
+            registry = get_registry()
+            known_details = load_known_peer_details() # Una sola lectura para todo el menú
+            # Primero los peers activos según el registro de descubrimiento; los demás, marcados
+            trusted_peer_ips = sorted(trusted_peer_ips, key=lambda ip: not registry.is_alive(ip))
             for peer_ip in trusted_peer_ips:
-                display_name = get_peer_display_name(peer_ip)
+                display_name = get_peer_display_name(peer_ip, details=known_details)
                 label_text = f"Enviar a {display_name}"
                 if display_name != peer_ip:
                     label_text += f" ({peer_ip})"
+                if not registry.is_alive(peer_ip):
+                    label_text += " - sin señal"
                 self.menu.add_command(label=label_text,
                                       command=lambda ip=peer_ip, content=content_to_share: self.share_with_peer(ip, content))
         else:
@@ -134,16 +148,16 @@ class ShareMenu:
             logger.error(f"Error genérico al mostrar el menú contextual: {e_generic}", exc_info=True)
 
     def share_with_all_trusted(self, content):
-        logger.info(f"Preparando para enviar contenido a todos los peers confiables: {content[:30]}...")
+        logger.info(f"Preparando para enviar contenido a todos los peers confiables: {clip_format.preview(content, 30)}...")
         if self.conn_manager:
-            self.conn_manager.send_to_trusted_peers(content)
+            self.conn_manager.queue_to_trusted_peers(content) # No bloquea el hilo de Tk
         else:
             logger.warning("ConnectionManager no disponible para share_with_all_trusted.")
 
     def share_with_peer(self, peer_ip, content):
-        logger.info(f"Preparando para enviar contenido a {peer_ip}: {content[:30]}...")
+        logger.info(f"Preparando para enviar contenido a {peer_ip}: {clip_format.preview(content, 30)}...")
         if self.conn_manager:
-            self.conn_manager.send_to_peer(peer_ip, content)
+            self.conn_manager.queue_to_peer(peer_ip, content) # No bloquea el hilo de Tk
         else:
             logger.warning(f"ConnectionManager no disponible para share_with_peer ({peer_ip}).")
 
@@ -169,6 +183,24 @@ def editar_puerto():
     else:
         logger.warning("La ventana principal no está inicializada o ya fue destruida para abrir PortEditor.")
 
+def traer_clip_anunciado(icon=None, item=None):
+    """Trae el último clip anunciado por un peer (modo lazy) sin bloquear el menú de la bandeja."""
+    if conn_manager:
+        threading.Thread(target=conn_manager.fetch_announced, daemon=True, name="FetchAnnounced").start()
+    else:
+        logger.warning("ConnectionManager no disponible para traer el clip anunciado.")
+
+def hay_clips_anunciados(item=None):
+    return bool(conn_manager and conn_manager.announcements)
+
+def on_clip_anunciado(ip, anuncio):
+    """Un peer ha anunciado un clip: refresca el menú de la bandeja para poder traerlo."""
+    if systray:
+        try:
+            systray.update_menu()
+        except Exception as e:
+            logger.debug(f"No se pudo actualizar el menú de la bandeja: {e}")
+
 def abrir_archivo_trusted_users():
     filepath = TRUSTED_USERS_FILE # TRUSTED_USERS_FILE ahora apunta a la carpeta de datos del usuario
     logger.info(f"Intentando abrir el archivo: {filepath}")
@@ -245,6 +277,8 @@ def salir(icon=None, item=None):
     print("DEBUG: SALIR - Iniciando. run_app será False.", file=sys.stderr)
     run_app = False
 
+    if auto_sharer:
+        auto_sharer.cancel() # Nada de envíos automáticos pendientes mientras se cierra
     if conn_manager:
         logger.info("Función salir() - Deteniendo ConnectionManager...")
         print("DEBUG: SALIR - Deteniendo ConnectionManager...", file=sys.stderr)
@@ -298,6 +332,7 @@ def iniciar_systray():
 
     menu_items = [
         MenuItem('Estado', abrir_ventana_estado, default=True),
+        MenuItem('Traer clip anunciado', traer_clip_anunciado, enabled=hay_clips_anunciados),
         MenuItem('Gestionar Usuarios', abrir_gestion_usuarios),
         MenuItem('Editar Puerto', editar_puerto),
         MenuItem('Usuarios de Confianza', abrir_archivo_trusted_users),
@@ -316,7 +351,7 @@ def iniciar_systray():
             print(f"ERROR CRITICO DE SYSTRAY (sin ventana Tk): No se pudo iniciar el icono de la bandeja del sistema: {e}")
 
 def monitor_clipboard():
-    global last_clipboard_content, ventana, share_menu, run_app
+    global last_clipboard_digest, ventana, share_menu, run_app
     
     while run_app and not (ventana and hasattr(ventana, 'winfo_exists') and ventana.winfo_exists() and share_menu):
         if not run_app: return
@@ -326,7 +361,12 @@ def monitor_clipboard():
         logger.info("Monitor de portapapeles: run_app es False antes de iniciar el bucle principal. Saliendo.")
         return
 
-    logger.info("Monitor de portapapeles iniciado.")
+    ajustes = conn_manager.settings if conn_manager else cargar_ajustes_red()
+    watcher = clipboard_watch.crear_watcher(
+        ajustes["clipboard_watcher"], ajustes["clipboard_poll_min"], ajustes["clipboard_poll_max"]
+    )
+    last_token = None
+    logger.info(f"Monitor de portapapeles iniciado (detección: {watcher.name}).")
     while run_app:
         try:
             if not (ventana and ventana.winfo_exists()):
@@ -334,10 +374,36 @@ def monitor_clipboard():
                 time.sleep(1)
                 continue
 
-            current_content = pyperclip.paste()
-            if isinstance(current_content, str) and current_content != last_clipboard_content:
-                logger.info(f"Contenido del portapapeles cambiado: {current_content[:50]}...")
-                last_clipboard_content = current_content
+            # Esperar a un cambio (o al siguiente sondeo); despertar cada segundo para comprobar run_app
+            if not watcher.wait_for_change(1.0):
+                continue
+
+            # Si se sabe que el portapapeles no ha cambiado, ni siquiera se lee. El testigo del watcher
+            # va primero: el backend X11 atiende los avisos en su propio hilo y puede ir por detrás
+            token = watcher.change_token()
+            if token is None:
+                token = clipboard.testigo_cambios()
+            if token is not None and token == last_token:
+                watcher.report(False)
+                continue
+            incluir_html = bool(ajustes["clipboard_html"])
+            current_content = clipboard.leer_portapapeles(incluir_html)
+            last_token = token
+            current_digest = content_digest(current_content) if current_content is not None else None
+            changed = current_digest is not None and current_digest != last_clipboard_digest
+            watcher.report(changed)
+            if changed:
+                last_clipboard_digest = current_digest
+                origin = conn_manager.remote_clip_origin(current_digest) if conn_manager else None
+                if origin is not None:
+                    # Lo acabamos de escribir nosotros con un clip recibido: no es una copia local
+                    logger.debug(f"Clip recibido de {origin[0]} (sello {origin[1][0]}) ya en el portapapeles; no se vuelve a compartir.")
+                    continue
+                logger.info(f"Contenido del portapapeles cambiado: {clip_format.preview(current_content)}...")
+                if conn_manager:
+                    conn_manager.remember_local_clip(current_content, current_digest) # Un peer que nos lo ofrezca no tendrá que reenviarlo
+                if auto_sharer and auto_sharer.offer(current_content):
+                    continue # Lo ha enviado una regla: no hace falta el menú
                 
                 if share_menu and ventana and ventana.winfo_exists():
                     try:
@@ -360,15 +426,12 @@ def monitor_clipboard():
         except Exception as e_general:
             if run_app: logger.error(f"Error inesperado en monitor_clipboard: {e_general}", exc_info=True)
             time.sleep(1)
-        
-        for _ in range(10):
-            if not run_app: break
-            time.sleep(0.1)
-            
+
+    watcher.close()
     logger.info("Monitor de portapapeles detenido.")
 
 def main():
-    global ventana, conn_manager, share_menu, run_app, lock_file, _main_thread_id
+    global ventana, conn_manager, share_menu, auto_sharer, run_app, lock_file, _main_thread_id
     _main_thread_id = threading.current_thread().ident # Asegurar que se establece aquí
     logger.info(f"Hilo principal de la aplicación iniciado. ID: {_main_thread_id}")
 
@@ -424,9 +487,14 @@ def main():
 
     try:
         conn_manager = ConnectionManager() # Usa el puerto de config.py, que ya se cargó
+        conn_manager.on_announce = on_clip_anunciado
+        clipboard.configurar_backend(conn_manager.settings["clipboard_backend"])
+        discovery.al_ver_peer(conn_manager.peer_available) # Entregar la bandeja de salida a los peers que vuelven
         logger.info("ConnectionManager inicializado globalmente.")
         share_menu = ShareMenu(ventana, conn_manager)
         logger.info("ShareMenu inicializado.")
+        auto_sharer = AutoSharer(conn_manager)
+        conn_manager.on_remote_clip = lambda ip: auto_sharer.cancel() # Un clip recibido sustituye al que esperaba su debounce
     except Exception as e_init_conn:
         logger.critical(f"Error crítico inicializando ConnectionManager o ShareMenu: {e_init_conn}", exc_info=True)
         print(f"ERROR CRITICO: No se pudo inicializar componentes de red: {e_init_conn}")
@@ -0,0 +1,159 @@
+# net_settings.py
+import configparser
+import logging
+from config_paths import CONFIG_FILE
+
+logger = logging.getLogger(__name__)
+
+# Valores por defecto de la sección [network] de mirror_clip.conf.
+# El tipo del valor por defecto determina cómo se interpreta el valor leído del archivo.
+NETWORK_DEFAULTS = {
+    "engine": "threads", # "threads" (un hilo por conexión) o "selectors" (un único bucle de eventos)
+    "fanout_workers": 16, # Hilos máximos para enviar en paralelo a los peers confiables
+    "peer_deadline": 8.0, # Segundos máximos por peer (conexión + envío) en un envío a todos
+    "peer_ttl": 0.0, # Segundos sin señales tras los que un peer deja de figurar como activo (0 = tres intervalos de broadcast)
+    "discovery_peers_per_interval": 10, # El intervalo de broadcast se multiplica por cada este número de peers activos
+    "discovery_max_interval": 600.0, # Segundos máximos entre broadcasts de descubrimiento periódicos
+    "discovery_reply_delay": 0.2, # Retraso aleatorio máximo (s) de las respuestas HELLO en redes grandes (como mucho 0.2)
+    "send_queue_idle": 30.0, # Segundos sin trabajo tras los que termina el hilo emisor de un peer
+    "compression": True, # Negociar compresión de payloads con los peers
+    "compression_threshold": 4096, # Bytes mínimos de un clip para intentar comprimirlo
+    "max_clip_size": 128 * 1024 * 1024, # Tamaño máximo aceptado de un clip ya descomprimido
+    "dedup_threshold": 8192, # Bytes a partir de los que se ofrece la huella antes de enviar el clip
+    "content_cache_bytes": 64 * 1024 * 1024, # Memoria máxima de la caché de clips enviados y recibidos
+    "delta": True, # Enviar solo los bloques cambiados respecto al último clip entregado al peer
+    "delta_threshold": 32768, # Bytes mínimos de un clip para intentar una delta
+    "send_chunk_size": 256 * 1024, # Tamaño de los trozos en que se envían los clips grandes
+    "pool_max_size": 32, # Conexiones salientes abiertas como máximo (se cierra la menos usada)
+    "pool_idle_timeout": 300.0, # Segundos sin uso tras los que se cierra una conexión saliente
+    "pool_ping_interval": 30.0, # Segundos sin uso tras los que se comprueba la conexión con un PING
+    "pool_prewarm_window": 600.0, # Se mantiene conexión lista con los confiables activos en estos segundos
+    "tcp_keepalive": True, # Activar keepalive TCP en las conexiones salientes
+    "encryption": True, # Exigir conexiones autenticadas y cifradas con los peers
+    "session_ticket_lifetime": 12 * 3600.0, # Segundos durante los que una reconexión puede reanudar la sesión
+    "share_mode": "push", # "push" (enviar el clip completo) o "lazy" (anunciarlo y transferirlo si se pide)
+    "lazy_threshold": 1024, # Bytes mínimos de un clip para anunciarlo en lugar de enviarlo en modo lazy
+    "lazy_preview_chars": 80, # Caracteres de vista previa incluidos en el anuncio
+    "clipboard_backend": "auto", # "auto" (conexión X11 persistente si es posible), "x11" o "tools" (pyperclip)
+    "clipboard_watcher": "auto", # "auto" (XFixes en X11 si está disponible), "xfixes" o "poll"
+    "clipboard_poll_min": 0.1, # Segundos entre lecturas del sondeo justo después de un cambio
+    "clipboard_poll_max": 5.0, # Segundos entre lecturas del sondeo con el portapapeles en reposo
+    "clipboard_apply_window": 0.1, # Segundos mínimos entre escrituras de clips recibidos (se aplica el último)
+    "clipboard_html": False, # Compartir la versión HTML del texto copiado cuando exista (solo Linux)
+    "image_max_dimension": 0, # Lado máximo en píxeles de las imágenes enviadas (0 = sin reducir)
+    "image_format": "keep", # "keep" (sin recodificar), "png" o "webp"
+    "image_quality": 85, # Calidad de la recompresión WebP
+    # Guardar en disco los clips para peers confiables caídos y entregarlos al volver. Los clips
+    # (que pueden contener contraseñas) se guardan sin cifrar, en archivos legibles solo por el usuario (0600).
+    "outbox": False,
+    "outbox_max_bytes": 16 * 1024 * 1024, # Tamaño máximo de la bandeja de salida de cada peer
+    "outbox_max_age": 24 * 3600.0, # Segundos tras los que un clip pendiente ya no se entrega
+    "outbox_keep": 3, # Clips más recientes que se entregan a un peer cuando vuelve
+    "outbox_retry_interval": 30.0, # Segundos mínimos entre intentos de vaciar la bandeja de un mismo peer
+}
+
+# Opciones que se pueden ajustar para un peer concreto en una sección [peer:<ip>]
+PEER_OVERRIDABLE = ("image_max_dimension", "image_format", "image_quality")
+
+
+def _leer_valor(config, section, key, default):
+    if isinstance(default, bool):
+        return config.getboolean(section, key, fallback=default)
+    if isinstance(default, int):
+        return config.getint(section, key, fallback=default)
+    if isinstance(default, float):
+        return config.getfloat(section, key, fallback=default)
+    return config.get(section, key, fallback=default).strip()
+
+
+def _leer_config(raw=False):
+    # Con 'raw' no se interpolan los '%' (las reglas llevan expresiones regulares)
+    config = configparser.ConfigParser(interpolation=None) if raw else configparser.ConfigParser()
+    try:
+        config.read(CONFIG_FILE)
+    except configparser.Error as e:
+        logger.error(f"Error leyendo {CONFIG_FILE}: {e}. Usando ajustes de red por defecto.")
+        return None
+    return config
+
+
+def cargar_ajustes_red():
+    """Carga la sección [network] del archivo de configuración, con valores por defecto."""
+    ajustes = dict(NETWORK_DEFAULTS)
+    config = _leer_config()
+    if config is None:
+        return ajustes
+
+    for key, default in NETWORK_DEFAULTS.items():
+        try:
+            ajustes[key] = _leer_valor(config, "network", key, default)
+        except ValueError as e:
+            logger.warning(f"Valor inválido para '{key}' en [network]: {e}. Usando {default!r}.")
+    return ajustes
+
+
+def cargar_ajustes_peers():
+    """Ajustes particulares por peer: {ip: {opción: valor}} de las secciones [peer:<ip>]."""
+    config = _leer_config()
+    if config is None:
+        return {}
+    por_peer = {}
+    for section in config.sections():
+        if not section.startswith("peer:"):
+            continue
+        ip = section[len("peer:"):].strip()
+        ajustes = {}
+        for key in PEER_OVERRIDABLE:
+            if not config.has_option(section, key):
+                continue
+            try:
+                ajustes[key] = _leer_valor(config, section, key, NETWORK_DEFAULTS[key])
+            except ValueError as e:
+                logger.warning(f"Valor inválido para '{key}' en [{section}]: {e}. Se ignora.")
+        por_peer[ip] = ajustes
+    return por_peer
+
+
+# Opciones de una regla de compartición automática [autoshare:<nombre>] y su valor por defecto
+AUTOSHARE_DEFAULTS = {
+    "peers": "trusted", # "trusted" (todos los confiables), IPs y/o grupos "@nombre" separados por comas
+    "types": "", # Tipos admitidos: text, html, image (vacío = todos)
+    "min_size": 0, # Bytes mínimos del clip
+    "max_size": 1024 * 1024, # Bytes máximos del clip (0 = sin límite)
+    "exclude": "", # Expresiones regulares, una por línea: el texto que coincida no se comparte
+    "debounce": 0.5, # Segundos que el clip debe seguir en el portapapeles antes de enviarlo
+}
+
+
+def cargar_reglas_autoshare():
+    """Reglas de compartición automática, en el orden del archivo, y grupos de peers.
+
+    Devuelve (reglas, grupos): una lista de dicts con las opciones de cada sección
+    [autoshare:<nombre>] más su 'name', y {nombre: [ips]} de las secciones [group:<nombre>].
+    """
+    config = _leer_config(raw=True)
+    if config is None:
+        return [], {}
+    grupos = {}
+    reglas = []
+    for section in config.sections():
+        if section.startswith("group:"):
+            nombre = section[len("group:"):].strip()
+            grupos[nombre] = _lista(config.get(section, "peers", fallback=""))
+        elif section.startswith("autoshare:"):
+            regla = {"name": section[len("autoshare:"):].strip()}
+            try:
+                for key, default in AUTOSHARE_DEFAULTS.items():
+                    regla[key] = _leer_valor(config, section, key, default)
+            except (ValueError, configparser.Error) as e:
+                logger.warning(f"Valor inválido en [{section}]: {e}. Se ignora la regla.")
+                continue
+            regla["peers"] = _lista(regla["peers"])
+            regla["types"] = _lista(regla["types"])
+            regla["exclude"] = [line.strip() for line in regla["exclude"].splitlines() if line.strip()]
+            reglas.append(regla)
+    return reglas, grupos
+
+
+def _lista(valor):
+    return [item.strip() for item in valor.split(",") if item.strip()]
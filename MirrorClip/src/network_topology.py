@@ -0,0 +1,183 @@
+# network_topology.py
+# Caché de la topología de red local: interfaces IPv4, IPs locales y direcciones de broadcast.
+# Se resuelve una vez y solo se vuelve a consultar netifaces cuando algo cambia. En Linux el
+# kernel avisa por rtnetlink de cada cambio de enlaces, direcciones o rutas; en el resto de
+# sistemas se compara cada 'refresh_interval' segundos una huella barata (nombres de interfaz
+# e IP de salida).
+import socket
+import time
+import threading
+import platform
+from collections import namedtuple
+import netifaces
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Interfaz IPv4 utilizable para el descubrimiento. 'default' indica la de la ruta por defecto.
+Interface = namedtuple("Interface", "name address netmask broadcast default")
+
+_RTMGRP_LINK = 0x1
+_RTMGRP_IPV4_IFADDR = 0x10
+_RTMGRP_IPV4_ROUTE = 0x40
+
+
+def _outbound_ip():
+    """IP con la que se sale hacia Internet (connect en UDP no envía ningún paquete)."""
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            s.connect(("8.8.8.8", 80))
+            return s.getsockname()[0]
+    except OSError:
+        return None
+
+
+class NetworkTopology:
+    """Interfaces y direcciones locales, resueltas bajo demanda y cacheadas hasta que cambian."""
+
+    def __init__(self, refresh_interval=30.0):
+        self.refresh_interval = refresh_interval
+        self._interfaces = None # [Interface], None hasta la primera resolución
+        self._local_ips = frozenset()
+        self._fingerprint = None
+        self._checked = 0.0 # Instante (monotonic) de la última comprobación de la huella
+        self._listeners = []
+        self._lock = threading.Lock()
+        self._netlink = self._open_netlink()
+
+    def _open_netlink(self):
+        if platform.system() != "Linux" or not hasattr(socket, "AF_NETLINK"):
+            return None
+        try:
+            sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE)
+            sock.bind((0, _RTMGRP_LINK | _RTMGRP_IPV4_IFADDR | _RTMGRP_IPV4_ROUTE))
+            sock.setblocking(False)
+            return sock
+        except OSError as e:
+            logger.debug(f"rtnetlink no disponible ({e}); se comprobarán cambios de red periódicamente.")
+            return None
+
+    # --- Consultas ---
+
+    def interfaces(self):
+        """Interfaces IPv4 con broadcast (sin loopback ni link-local), la de la ruta por defecto primero."""
+        self._ensure_fresh()
+        return list(self._interfaces)
+
+    def local_ips(self):
+        """Todas las IPv4 de este equipo, incluida 127.0.0.1 (para reconocer nuestros propios paquetes)."""
+        self._ensure_fresh()
+        return self._local_ips
+
+    def primary_ip(self):
+        """IP local principal: la de la interfaz de la ruta por defecto, o la primera disponible."""
+        interfaces = self.interfaces()
+        if interfaces:
+            return interfaces[0].address
+        return _outbound_ip() or "127.0.0.1"
+
+    def broadcast_address(self):
+        """Broadcast de la interfaz principal, o 255.255.255.255 si no hay ninguna."""
+        interfaces = self.interfaces()
+        return interfaces[0].broadcast if interfaces else "255.255.255.255"
+
+    def on_change(self, callback):
+        """Registra callback(topología), que se llama cuando cambian las interfaces o direcciones."""
+        self._listeners.append(callback)
+
+    # --- Resolución y detección de cambios ---
+
+    def refresh(self):
+        """Vuelve a resolver la topología ahora. True si ha cambiado."""
+        interfaces, local_ips = self._resolve()
+        with self._lock:
+            changed = self._interfaces is not None and interfaces != self._interfaces
+            first = self._interfaces is None
+            self._interfaces = interfaces
+            self._local_ips = local_ips
+            self._fingerprint = self._cheap_fingerprint()
+            self._checked = time.monotonic()
+        if first or changed:
+            resumen = ", ".join(f"{i.name}={i.address} (bcast {i.broadcast})" for i in interfaces) or "ninguna"
+            logger.info(f"Interfaces de red {'actualizadas' if changed else 'detectadas'}: {resumen}")
+        if changed:
+            for callback in list(self._listeners):
+                try:
+                    callback(self)
+                except Exception as e:
+                    logger.error(f"Error notificando un cambio de red: {e}", exc_info=True)
+        return changed
+
+    def _ensure_fresh(self):
+        if self._interfaces is None or self._netlink_changed():
+            self.refresh()
+            return
+        if self._netlink is None and time.monotonic() - self._checked >= self.refresh_interval:
+            fingerprint = self._cheap_fingerprint()
+            with self._lock:
+                self._checked = time.monotonic()
+                same = fingerprint == self._fingerprint
+            if not same:
+                self.refresh()
+
+    def _netlink_changed(self):
+        """Vacía los avisos pendientes del kernel. True si había alguno."""
+        # Con el lock: dos hilos no pueden leer del socket a la vez ni usarlo mientras otro lo cierra
+        with self._lock:
+            if self._netlink is None:
+                return False
+            changed = False
+            try:
+                while True:
+                    if not self._netlink.recv(65536):
+                        break
+                    changed = True
+            except BlockingIOError:
+                pass
+            except OSError as e:
+                logger.debug(f"Error leyendo rtnetlink ({e}); se pasa a comprobaciones periódicas.")
+                self._netlink.close()
+                self._netlink = None
+                changed = True
+            return changed
+
+    def _cheap_fingerprint(self):
+        try:
+            names = tuple(name for _, name in socket.if_nameindex())
+        except (OSError, AttributeError):
+            names = ()
+        return names, _outbound_ip()
+
+    def _resolve(self):
+        interfaces = []
+        local_ips = {"127.0.0.1"}
+        try:
+            default = netifaces.gateways().get('default', {}).get(netifaces.AF_INET)
+            default_name = default[1] if default else None
+            for name in netifaces.interfaces():
+                for addr_info in netifaces.ifaddresses(name).get(netifaces.AF_INET, []):
+                    address = addr_info.get('addr')
+                    if not address:
+                        continue
+                    local_ips.add(address)
+                    broadcast = addr_info.get('broadcast')
+                    if not broadcast or address.startswith('127.') or address.startswith('169.254.'):
+                        continue
+                    interfaces.append(Interface(name, address, addr_info.get('netmask'), broadcast, name == default_name))
+        except Exception as e:
+            logger.error(f"Error resolviendo las interfaces de red con netifaces: {e}", exc_info=True)
+        interfaces.sort(key=lambda i: not i.default) # La de la ruta por defecto primero (orden estable)
+        return interfaces, frozenset(local_ips)
+
+
+_topology = None
+_topology_lock = threading.Lock()
+
+
+def get_topology():
+    """Topología compartida por todo el proceso."""
+    global _topology
+    with _topology_lock:
+        if _topology is None:
+            _topology = NetworkTopology()
+        return _topology
@@ -0,0 +1,169 @@
+# outbox.py
+# Bandeja de salida en disco para peers confiables que no están disponibles.
+#
+# Cada peer tiene un archivo de segmentos de solo añadir: cada registro es una cabecera
+# (RECORD_HEADER) seguida del sobre del clip. El archivo se compacta (reescribiendo solo los
+# registros que siguen valiendo) cuando supera el tamaño máximo o acumula demasiados registros.
+#
+# El contenido se guarda sin cifrar (puede incluir contraseñas copiadas): los archivos se crean
+# con permisos 0600, legibles solo por el usuario.
+import os
+import time
+import struct
+import threading
+from collections import namedtuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Longitud del clip, instante de creación (epoch), tiempo de Lamport y nodo del sello (0, 0 = sin sello)
+RECORD_HEADER = struct.Struct("!IdQQ")
+SUFFIX = ".outbox"
+FILE_MODE = 0o600
+
+# Un clip pendiente. 'stamp' es el sello de Lamport o None.
+OutboxRecord = namedtuple("OutboxRecord", "created data stamp")
+
+
+def _open_private(path, flags):
+    """Abre 'path' en binario creándolo, si hace falta, con permisos solo para el usuario."""
+    fd = os.open(path, flags | getattr(os, "O_BINARY", 0), FILE_MODE)
+    try:
+        os.chmod(path, FILE_MODE) # Por si ya existía con otros permisos
+    except OSError:
+        pass
+    return os.fdopen(fd, "ab" if flags & os.O_APPEND else "wb")
+
+
+class Outbox:
+    """Clips pendientes por peer, acotados en bytes, en antigüedad y en número."""
+
+    def __init__(self, directory, max_bytes=16 * 1024 * 1024, max_age=24 * 3600.0, keep=3):
+        self.directory = directory
+        self.max_bytes = max_bytes # Por peer
+        self.max_age = max_age
+        self.keep = max(1, keep) # Solo se entregan los 'keep' clips más recientes
+        self._counts = {} # {ip: registros en el archivo}, calculado al primer uso
+        self._lock = threading.Lock()
+
+    def _path(self, ip):
+        return self.directory / (ip.replace(":", "_") + SUFFIX) # Los ':' de IPv6 no valen en Windows
+
+    def put(self, ip, data, stamp=None):
+        """Añade un clip a la bandeja de 'ip'."""
+        if len(data) > self.max_bytes:
+            logger.info(f"Clip de {len(data)} bytes demasiado grande para la bandeja de salida de {ip}.")
+            return
+        stamp = stamp or (0, 0)
+        record = RECORD_HEADER.pack(len(data), time.time(), *stamp)
+        path = self._path(ip)
+        with self._lock:
+            if ip not in self._counts:
+                self._repair(ip, path)
+            try:
+                self.directory.mkdir(parents=True, exist_ok=True)
+                with _open_private(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND) as f:
+                    f.write(record)
+                    f.write(data)
+                    size = f.tell()
+            except OSError as e:
+                logger.error(f"No se pudo guardar el clip para {ip} en la bandeja de salida: {e}")
+                return
+            count = self._counts.get(ip, 0) + 1
+            self._counts[ip] = count
+            if size > self.max_bytes or count > 2 * self.keep:
+                self._compact(ip, path)
+
+    def has(self, ip):
+        with self._lock:
+            return self._path(ip).exists()
+
+    def take(self, ip):
+        """Clips vigentes de 'ip' [OutboxRecord], del más antiguo al más reciente (como mucho 'keep').
+
+        Los clips siguen en la bandeja hasta confirmar su entrega con ack().
+        """
+        with self._lock:
+            return [OutboxRecord(*record) for record in self._valid(self._read(self._path(ip)))]
+
+    def ack(self, ip, delivered):
+        """Quita de la bandeja de 'ip' los registros entregados. Los añadidos después de take() se conservan."""
+        delivered = set(delivered)
+        with self._lock:
+            path = self._path(ip)
+            remaining = [record for record in self._valid(self._read(path)) if OutboxRecord(*record) not in delivered]
+            if remaining:
+                self._write(ip, path, remaining)
+            else:
+                self._remove(ip)
+
+    def clear(self, ip):
+        with self._lock:
+            self._remove(ip)
+
+    def _remove(self, ip):
+        self._counts.pop(ip, None)
+        try:
+            self._path(ip).unlink()
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.error(f"No se pudo vaciar la bandeja de salida de {ip}: {e}")
+
+    def _repair(self, ip, path):
+        """Primer uso del archivo: cuenta sus registros y, si termina en uno truncado (el proceso murió
+        escribiendo), lo reescribe sin él para que los siguientes put() no queden desalineados."""
+        records = self._read(path)
+        try:
+            size = path.stat().st_size
+        except FileNotFoundError:
+            size = 0
+        except OSError as e:
+            logger.error(f"No se pudo comprobar la bandeja de salida {path}: {e}")
+            size = 0
+        if size != sum(RECORD_HEADER.size + len(data) for _, data, _ in records):
+            self._write(ip, path, records)
+        self._counts[ip] = len(records)
+
+    def _valid(self, records):
+        limit = time.time() - self.max_age
+        return [record for record in records if record[0] >= limit][-self.keep:]
+
+    def _compact(self, ip, path):
+        self._write(ip, path, self._valid(self._read(path)))
+
+    def _write(self, ip, path, records):
+        tmp = path.with_suffix(".tmp")
+        try:
+            with _open_private(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC) as f:
+                for created, data, stamp in records:
+                    f.write(RECORD_HEADER.pack(len(data), created, *(stamp or (0, 0))))
+                    f.write(data)
+            os.replace(tmp, path)
+        except OSError as e:
+            logger.error(f"No se pudo compactar la bandeja de salida de {ip}: {e}")
+            return
+        self._counts[ip] = len(records)
+
+    def _read(self, path):
+        """[(creado, sobre, sello)] de un archivo. Un registro final truncado se ignora."""
+        records = []
+        try:
+            with open(path, "rb") as f:
+                blob = f.read()
+        except FileNotFoundError:
+            return records
+        except OSError as e:
+            logger.error(f"No se pudo leer la bandeja de salida {path}: {e}")
+            return records
+        offset = 0
+        while offset + RECORD_HEADER.size <= len(blob):
+            length, created, lamport_time, node = RECORD_HEADER.unpack_from(blob, offset)
+            start = offset + RECORD_HEADER.size
+            if start + length > len(blob):
+                logger.warning(f"Registro truncado al final de {path}; se descarta.")
+                break
+            stamp = (lamport_time, node) if lamport_time else None
+            records.append((created, blob[start:start + length], stamp))
+            offset = start + length
+        return records
@@ -0,0 +1,109 @@
+# peer_registry.py
+# Registro en memoria de los peers activos en la red, alimentado de forma pasiva por los hilos
+# de descubrimiento (solicitudes recibidas y respuestas HELLO a nuestros broadcasts).
+# Cada peer caduca si no da señales de vida en 'ttl' segundos. Las ventanas lo leen al instante;
+# una búsqueda activa (broadcast.descubrir_peers) solo sirve para refrescarlo.
+import time
+import threading
+from collections import namedtuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 'last_seen' es time.monotonic() del último paquete; username/hostname/interface pueden ser None
+# si el peer solo se ha visto preguntando (las solicitudes de descubrimiento no llevan nombre).
+PeerInfo = namedtuple("PeerInfo", "ip username hostname interface last_seen")
+
+
+class PeerRegistry:
+    """Peers vistos recientemente, con caducidad por TTL."""
+
+    def __init__(self, ttl=90.0):
+        self.ttl = ttl
+        self._peers = {} # {ip: PeerInfo}
+        self._listeners = []
+        self._lock = threading.Lock()
+
+    def seen(self, ip, username=None, hostname=None, interface=None):
+        """Anota actividad de 'ip'. True si es un peer nuevo (o había caducado) o ha cambiado su identidad."""
+        now = time.monotonic()
+        with self._lock:
+            previous = self._peers.get(ip)
+            alive = previous is not None and now - previous.last_seen <= self.ttl
+            if previous is not None:
+                username = username or previous.username
+                hostname = hostname or previous.hostname
+                interface = interface or previous.interface
+            info = PeerInfo(ip, username, hostname, interface, now)
+            self._peers[ip] = info
+        changed = not alive or previous[1:4] != info[1:4]
+        if changed:
+            logger.debug(f"Peer activo: {ip} (usuario {username}, equipo {hostname}, interfaz {interface})")
+            self._notify()
+        return changed
+
+    def forget(self, ip):
+        with self._lock:
+            removed = self._peers.pop(ip, None) is not None
+        if removed:
+            self._notify()
+
+    def peers(self):
+        """[PeerInfo] de los peers vivos, el visto más recientemente primero."""
+        self._expire()
+        with self._lock:
+            return sorted(self._peers.values(), key=lambda p: p.last_seen, reverse=True)
+
+    def ips(self):
+        return [peer.ip for peer in self.peers()]
+
+    def get(self, ip):
+        """PeerInfo de 'ip' si está vivo, o None."""
+        with self._lock:
+            info = self._peers.get(ip)
+        if info is None or time.monotonic() - info.last_seen > self.ttl:
+            return None
+        return info
+
+    def is_alive(self, ip):
+        return self.get(ip) is not None
+
+    def on_change(self, callback):
+        """Registra callback(registro), que se llama cuando aparece, cambia o desaparece un peer."""
+        self._listeners.append(callback)
+
+    def remove_listener(self, callback):
+        try:
+            self._listeners.remove(callback)
+        except ValueError:
+            pass
+
+    def _expire(self):
+        limit = time.monotonic() - self.ttl
+        with self._lock:
+            expired = [ip for ip, info in self._peers.items() if info.last_seen < limit]
+            for ip in expired:
+                del self._peers[ip]
+        if expired:
+            logger.debug(f"Peers caducados (sin señales en {self.ttl:.0f}s): {', '.join(expired)}")
+            self._notify()
+
+    def _notify(self):
+        for callback in list(self._listeners):
+            try:
+                callback(self)
+            except Exception as e:
+                logger.error(f"Error notificando un cambio en el registro de peers: {e}", exc_info=True)
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    """Registro de peers compartido por todo el proceso."""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = PeerRegistry()
+        return _registry
@@ -39,7 +39,7 @@ def save_known_peer_details(details):
     except Exception as e_save:
         logger.error(f"[PEER_UTILS] Error inesperado guardando {KNOWN_PEER_DETAILS_FILE}: {e_save}")
 
-def update_peer_details(ip_address, username, hostname):
+def update_peer_details(ip_address, username, hostname, interface=None):
     if not ip_address or not isinstance(ip_address, str):
         logger.warning(f"[PEER_UTILS] Intento de actualizar detalles con IP inválida: {ip_address}")
         return
@@ -72,12 +72,18 @@ def update_peer_details(ip_address, username, hostname):
                not (is_new_hostname_specific and current_info.get("hostname") != hostname):
                 should_update = False # No hay cambios significativos en nombre/host
 
+    if interface and current_info and current_info.get("interface") != interface:
+        should_update = True # El peer se alcanza ahora por otra interfaz
+
     if should_update or not current_info:
         details[ip_address] = {
             "username": username if username and username.lower() != "desconocido" else (current_info.get("username") if current_info else username),
             "hostname": hostname if hostname and hostname.lower() != "desconocido" else (current_info.get("hostname") if current_info else hostname),
             "last_seen": datetime.datetime.now(datetime.timezone.utc).isoformat()
         }
+        interface = interface or (current_info.get("interface") if current_info else None)
+        if interface:
+            details[ip_address]["interface"] = interface # Interfaz local por la que se alcanzó el peer
         # Asegurar que no guardamos "Desconocido" si ya teníamos un nombre mejor
         if details[ip_address]["username"].lower() == "desconocido" and current_info and current_info.get("username", "").lower() not in ["", "desconocido", "usuariox"]:
             details[ip_address]["username"] = current_info.get("username")
@@ -0,0 +1,209 @@
+# protocol.py
+# Protocolo de mensajes de MirrorClip sobre TCP.
+# Cada mensaje va precedido de una cabecera fija con la longitud del payload, de modo que
+# el receptor sabe exactamente cuántos bytes forman un mensaje aunque TCP los entregue troceados.
+import struct
+import select
+import socket
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+PROTOCOL_MAGIC = b"MC"
+PROTOCOL_VERSION = 2 # 2: el contenido de los clips es un sobre tipado (ver clip_format.py)
+
+# Cabecera: magic (2 bytes), versión (1), tipo de mensaje (1), flags (2), longitud del payload (4)
+HEADER = struct.Struct("!2sBBHI")
+HEADER_SIZE = HEADER.size
+
+MAX_PAYLOAD_SIZE = 256 * 1024 * 1024 # 256 MB, límite de seguridad para no reservar memoria sin control
+HANDSHAKE_MAX_PAYLOAD = 16 * 1024 # Límite mientras el peer no ha completado el handshake (HELLO/AUTH)
+RECV_BUFFER_SIZE = 256 * 1024 # Reserva inicial del payload; crece según llegan los datos
+
+# Tipos de mensaje
+MSG_CLIP = 1 # Contenido del portapapeles (sobre de clip_format: tipo MIME + contenido)
+MSG_HELLO = 2 # Negociación al abrir la conexión (JSON con capacidades del peer)
+MSG_OFFER = 3 # Oferta de un clip por su huella, antes de enviar el contenido (OFFER_FORMAT)
+MSG_HAVE = 4 # Respuesta a una oferta: el receptor ya tiene ese contenido (payload: huella)
+MSG_NEED = 5 # Respuesta a una oferta: el receptor necesita el contenido (payload: huella)
+MSG_DELTA = 6 # Clip expresado como diferencias sobre un contenido anterior (DELTA_HEADER + operaciones)
+MSG_PING = 7 # Comprobación de que la conexión sigue viva (sin payload)
+MSG_PONG = 8 # Respuesta a un PING
+MSG_AUTH = 9 # Firma del cliente que cierra el handshake cifrado (ver secure_session.py)
+MSG_ANNOUNCE = 10 # Descriptor de un clip disponible en el emisor (JSON: huella, tamaño, tipo, vista previa)
+MSG_FETCH = 11 # Petición del contenido de un clip anunciado (payload: huella)
+MSG_MISSING = 12 # Respuesta a FETCH: el clip ya no está disponible (payload: huella)
+MSG_STAMP = 13 # Sello de Lamport (STAMP_FORMAT) del clip que se envía a continuación por esta conexión
+
+OFFER_FORMAT = struct.Struct("!16sQ") # Huella BLAKE2b-128 y tamaño del contenido
+DELTA_HEADER = struct.Struct("!16s16sI") # Huella de la base, huella del resultado y tamaño de bloque
+STAMP_FORMAT = struct.Struct("!QQ") # Tiempo lógico de Lamport e identificador del nodo que creó el clip
+
+# Flags de la cabecera
+FLAG_CODEC_MASK = 0x0007 # Códec de compresión del payload (ver compression.py); 0 = sin comprimir
+FLAG_ENCRYPTED = 0x0008 # Payload cifrado con el canal de la sesión (ver encryption.SecureChannel)
+
+
+class ProtocolError(Exception):
+    """Mensaje mal formado o incompatible con esta versión del protocolo."""
+
+
+def build_header(msg_type, length, flags=0):
+    """Construye la cabecera de un mensaje para un payload de 'length' bytes."""
+    if length > MAX_PAYLOAD_SIZE:
+        raise ProtocolError(f"Payload demasiado grande: {length} bytes (máximo {MAX_PAYLOAD_SIZE})")
+    return HEADER.pack(PROTOCOL_MAGIC, PROTOCOL_VERSION, msg_type, flags, length)
+
+
+def build_frame(msg_type, payload=b"", flags=0):
+    """Devuelve el mensaje completo (cabecera + payload) listo para sendall()."""
+    return build_header(msg_type, len(payload), flags) + payload
+
+
+def send_frame(sock, msg_type, payload=b"", flags=0, chunk_size=256 * 1024, timeout=None, progress=None):
+    """Envía un mensaje por trozos sin copiar el payload.
+
+    El payload se recorre con slices de memoryview (sin copias) y antes de cada trozo se
+    espera a que el socket admita escritura, de modo que un peer lento frena al emisor
+    (backpressure) en lugar de acumular datos. 'timeout' es el plazo total en segundos; si es
+    None, el timeout del socket limita cuánto puede estar parado el envío sin avanzar.
+    'progress(enviados, total)' se llama tras cada trozo. En sesiones cifradas el payload
+    que llega aquí ya es la copia cifrada completa (ver ConnectionManager._stream).
+    """
+    deadline = None if timeout is None else time.monotonic() + timeout
+    stall_timeout = sock.gettimeout()
+    view = memoryview(payload).cast("B")
+    total = len(view)
+    _send_all_by_deadline(sock, memoryview(build_header(msg_type, total, flags)), deadline, stall_timeout)
+    sent = 0
+    while sent < total:
+        chunk = view[sent:sent + chunk_size]
+        _send_all_by_deadline(sock, chunk, deadline, stall_timeout)
+        sent += len(chunk)
+        if progress:
+            progress(sent, total)
+
+
+def _send_all_by_deadline(sock, view, deadline, stall_timeout):
+    while len(view):
+        wait = stall_timeout
+        if deadline is not None:
+            wait = deadline - time.monotonic()
+            if wait <= 0:
+                raise socket.timeout("Plazo agotado enviando el mensaje")
+        _, writable, _ = select.select([], [sock], [], wait)
+        if not writable:
+            raise socket.timeout("El peer no acepta más datos (plazo agotado)")
+        try:
+            n = sock.send(view)
+        except (BlockingIOError, InterruptedError):
+            continue
+        view = view[n:]
+
+
+def parse_header(data, max_payload=MAX_PAYLOAD_SIZE):
+    """Valida una cabecera y devuelve (tipo, flags, longitud)."""
+    magic, version, msg_type, flags, length = HEADER.unpack(data)
+    if magic != PROTOCOL_MAGIC:
+        raise ProtocolError(f"Magic inválido en la cabecera: {bytes(magic)!r}")
+    if version != PROTOCOL_VERSION:
+        raise ProtocolError(f"Versión de protocolo no soportada: {version}")
+    if length > max_payload:
+        raise ProtocolError(f"Payload anunciado demasiado grande: {length} bytes (máximo {max_payload})")
+    return msg_type, flags, length
+
+
+def _recv_exactly(sock, view):
+    """Llena 'view' por completo con recv_into. Devuelve los bytes leídos (menos si el peer cierra)."""
+    received = 0
+    total = len(view)
+    while received < total:
+        n = sock.recv_into(view[received:], total - received)
+        if n == 0:
+            break
+        received += n
+    return received
+
+
+def _grow(payload, length):
+    """Duplica el buffer de un payload a medio recibir, sin pasar de 'length'."""
+    payload.extend(bytes(min(len(payload), length - len(payload))))
+
+
+class FrameReader:
+    """Lee mensajes completos de un socket.
+
+    La cabecera se lee en un buffer fijo reutilizable y el payload directamente en un bytearray
+    que crece por duplicación según van llegando los datos (empezando por 'initial_buffer'), así
+    una cabecera que anuncia un tamaño enorme no reserva memoria hasta que los bytes llegan.
+    'max_payload' se puede cambiar sobre la marcha (p. ej. al terminar el handshake).
+    """
+
+    def __init__(self, max_payload=MAX_PAYLOAD_SIZE, initial_buffer=RECV_BUFFER_SIZE):
+        self.max_payload = max_payload
+        self.initial_buffer = initial_buffer
+        self._header_buf = bytearray(HEADER_SIZE)
+        self._header_view = memoryview(self._header_buf)
+        # Estado del reensamblado incremental (read_available)
+        self._received = 0
+        self._current = None # (tipo, flags, payload) del mensaje a medio recibir
+        self._length = 0 # Tamaño anunciado del mensaje a medio recibir
+
+    def read_message(self, sock):
+        """Devuelve (tipo, flags, payload) o None si el peer cerró la conexión entre mensajes."""
+        n = _recv_exactly(sock, self._header_view)
+        if n == 0:
+            return None
+        if n < HEADER_SIZE:
+            raise ProtocolError(f"Conexión cerrada a mitad de cabecera ({n}/{HEADER_SIZE} bytes)")
+
+        msg_type, flags, length = parse_header(self._header_buf, self.max_payload)
+        payload = bytearray(min(length, self.initial_buffer))
+        received = 0
+        while received < length:
+            if received == len(payload):
+                _grow(payload, length)
+            n = sock.recv_into(memoryview(payload)[received:])
+            if n == 0:
+                raise ProtocolError(f"Conexión cerrada a mitad de mensaje ({received}/{length} bytes)")
+            received += n
+        return msg_type, flags, payload
+
+    def read_available(self, sock):
+        """Lee sin bloquear todo lo disponible en un socket no bloqueante.
+
+        Devuelve (mensajes_completos, cerrado). Los mensajes a medias se conservan entre
+        llamadas, por lo que sirve para bucles de eventos (selectors).
+        """
+        messages = []
+        while True:
+            if self._current is None:
+                target, total = self._header_view, HEADER_SIZE
+            else:
+                payload, total = self._current[2], self._length
+                if self._received == len(payload) and len(payload) < total:
+                    _grow(payload, total)
+                target = memoryview(payload)
+            if self._received < total:
+                try:
+                    n = sock.recv_into(target[self._received:])
+                except (BlockingIOError, InterruptedError):
+                    return messages, False
+                finally:
+                    target = None # Suelta la vista para poder ampliar el buffer
+                if n == 0:
+                    if self._received or self._current is not None:
+                        raise ProtocolError("Conexión cerrada a mitad de mensaje")
+                    return messages, True
+                self._received += n
+                if self._received < total:
+                    continue
+
+            if self._current is None:
+                msg_type, flags, self._length = parse_header(self._header_buf, self.max_payload)
+                self._current = (msg_type, flags, bytearray(min(self._length, self.initial_buffer)))
+            else:
+                messages.append(self._current)
+                self._current = None
+            self._received = 0
@@ -0,0 +1,216 @@
+# secure_session.py
+# Handshake autenticado de las conexiones entre peers y caché de tickets de sesión.
+#
+# Handshake completo (primera conexión con un peer):
+#   cliente -> HELLO  {"secure": {nonce, eph, pub}}            X25519 efímera + clave RSA pública
+#   servidor -> HELLO {"secure": {nonce, eph, pub, sig, ticket}} firma RSA de la transcripción
+#   cliente -> AUTH   firma RSA de la transcripción
+# Ambos derivan con HKDF del secreto X25519 una clave por sentido y un secreto de reanudación.
+#
+# Reanudación (reconexiones mientras el ticket es válido): el cliente envía {nonce, ticket} y,
+# si el servidor lo reconoce, las claves se derivan del secreto de reanudación y de los nonces
+# sin ninguna operación asimétrica.
+import os
+import json
+import time
+import base64
+import hashlib
+import threading
+import logging
+from collections import OrderedDict
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import x25519
+import encryption
+from encryption import EncryptionError, SecureChannel
+from config_paths import PEER_KEYS_FILE
+
+logger = logging.getLogger(__name__)
+
+MAX_SERVER_TICKETS = 256
+
+
+def _b64(data):
+    return base64.b64encode(data).decode('ascii')
+
+
+def _unb64(secure, key):
+    try:
+        return base64.b64decode(secure[key], validate=True)
+    except (KeyError, TypeError, ValueError) as e:
+        raise EncryptionError(f"Campo '{key}' ausente o inválido en el handshake") from e
+
+
+def _raw_public(key):
+    return key.public_key().public_bytes(encoding=serialization.Encoding.Raw, format=serialization.PublicFormat.Raw)
+
+
+def _transcript(c_nonce, s_nonce, c_eph, s_eph, c_pub, s_pub):
+    return hashlib.sha256(b"MirrorClip v1" + c_nonce + s_nonce + c_eph + s_eph + c_pub + s_pub).digest()
+
+
+class SessionSecurity:
+    """Identidad local, claves conocidas de los peers y tickets de sesión de un ConnectionManager."""
+
+    def __init__(self, ticket_lifetime=12 * 3600.0):
+        self.ticket_lifetime = ticket_lifetime
+        self._private_key = None
+        self._public_der = None
+        self._peer_keys = None # {ip: huella de su clave pública}, cargado bajo demanda
+        self._client_tickets = {} # {ip: (id del ticket, secreto de reanudación, caducidad)}
+        self._server_tickets = OrderedDict() # {id del ticket: (ip, secreto, caducidad)}
+        self._lock = threading.Lock()
+
+    def _identity(self):
+        with self._lock:
+            if self._private_key is None:
+                self._private_key = encryption.load_private_key()
+                self._public_der = encryption.public_key_bytes(self._private_key)
+                logger.info(f"Identidad local cargada (huella {encryption.key_fingerprint(self._public_der)[:16]})")
+            return self._private_key, self._public_der
+
+    # --- Claves de los peers (confianza en el primer uso, como SSH) ---
+
+    def _load_peer_keys(self):
+        # Llamar con self._lock tomado
+        if self._peer_keys is None:
+            try:
+                with open(PEER_KEYS_FILE, 'r', encoding='utf-8') as f:
+                    self._peer_keys = json.load(f)
+            except FileNotFoundError:
+                self._peer_keys = {}
+            except (OSError, ValueError) as e:
+                logger.error(f"Error cargando {PEER_KEYS_FILE}: {e}. Se tratará como vacío.")
+                self._peer_keys = {}
+        return self._peer_keys
+
+    def _check_peer_key(self, ip, public_der):
+        """Compara la clave con la registrada para 'ip' sin modificar nada. Falla si no coincide."""
+        fingerprint = encryption.key_fingerprint(public_der)
+        with self._lock:
+            known = self._load_peer_keys().get(ip)
+        if known is not None and known != fingerprint:
+            raise EncryptionError(
+                f"La clave de {ip} no coincide con la registrada. Si el equipo ha cambiado de clave, "
+                f"elimina su entrada de {PEER_KEYS_FILE}."
+            )
+
+    def _pin_peer_key(self, ip, public_der):
+        """Registra la clave de 'ip' en el primer uso. Solo tras verificar la firma del peer."""
+        fingerprint = encryption.key_fingerprint(public_der)
+        with self._lock:
+            peer_keys = self._load_peer_keys()
+            known = peer_keys.get(ip)
+            if known == fingerprint:
+                return
+            if known is not None: # Otro handshake registró una clave distinta mientras tanto
+                raise EncryptionError(f"La clave de {ip} no coincide con la registrada.")
+            peer_keys[ip] = fingerprint
+            try:
+                PEER_KEYS_FILE.parent.mkdir(parents=True, exist_ok=True)
+                with open(PEER_KEYS_FILE, 'w', encoding='utf-8') as f:
+                    json.dump(self._peer_keys, f, indent=4)
+            except OSError as e:
+                logger.error(f"No se pudo guardar la clave de {ip} en {PEER_KEYS_FILE}: {e}")
+        logger.info(f"Clave de {ip} registrada por primera vez (huella {fingerprint[:16]})")
+
+    # --- Lado cliente (conexión saliente) ---
+
+    def client_hello(self, ip, allow_resume=True):
+        """Devuelve (campo 'secure' del HELLO, estado pendiente para client_finish)."""
+        nonce = os.urandom(16)
+        now = time.monotonic()
+        with self._lock:
+            ticket = self._client_tickets.get(ip)
+        if allow_resume and ticket is not None and ticket[2] > now:
+            return {"nonce": _b64(nonce), "ticket": _b64(ticket[0])}, {"nonce": nonce, "ticket": ticket}
+
+        private_key, public_der = self._identity()
+        eph = x25519.X25519PrivateKey.generate()
+        secure = {"nonce": _b64(nonce), "eph": _b64(_raw_public(eph)), "pub": _b64(public_der)}
+        return secure, {"nonce": nonce, "eph": eph}
+
+    def client_finish(self, ip, state, secure):
+        """Completa el handshake con la respuesta del servidor.
+
+        Devuelve (canal, firma para el mensaje AUTH o None). Si el servidor rechazó el ticket
+        devuelve (None, None) y hay que repetir el HELLO sin reanudación.
+        """
+        s_nonce = _unb64(secure, "nonce")
+        if "ticket" in state:
+            ticket_id, secret, _ = state["ticket"]
+            if not secure.get("resumed"):
+                logger.info(f"{ip} no aceptó el ticket de sesión; se repite el handshake completo.")
+                with self._lock:
+                    self._client_tickets.pop(ip, None)
+                return None, None
+            c2s, s2c = encryption.derive_keys(secret, state["nonce"] + s_nonce + ticket_id, b"MirrorClip resume", 2)
+            return SecureChannel(c2s, s2c), None
+
+        private_key, public_der = self._identity()
+        s_eph = _unb64(secure, "eph")
+        s_pub = _unb64(secure, "pub")
+        self._check_peer_key(ip, s_pub)
+        c_eph = _raw_public(state["eph"])
+        transcript = _transcript(state["nonce"], s_nonce, c_eph, s_eph, public_der, s_pub)
+        encryption.verify(s_pub, _unb64(secure, "sig"), b"server" + transcript)
+        self._pin_peer_key(ip, s_pub) # Solo ahora sabemos que el servidor tiene la clave privada
+        shared = self._exchange(state["eph"], s_eph)
+        c2s, s2c, resumption = encryption.derive_keys(shared, transcript, b"MirrorClip session", 3)
+        if "ticket" in secure:
+            with self._lock:
+                self._client_tickets[ip] = (_unb64(secure, "ticket"), resumption, time.monotonic() + self.ticket_lifetime)
+        return SecureChannel(c2s, s2c), encryption.sign(private_key, b"client" + transcript)
+
+    # --- Lado servidor (conexión entrante) ---
+
+    def server_respond(self, ip, secure):
+        """Responde al 'secure' del HELLO de un cliente.
+
+        Devuelve (campo 'secure' de la respuesta, canal listo o None, estado pendiente de AUTH o None).
+        """
+        c_nonce = _unb64(secure, "nonce")
+        s_nonce = os.urandom(16)
+        if "ticket" in secure:
+            ticket_id = _unb64(secure, "ticket")
+            with self._lock:
+                ticket = self._server_tickets.get(ticket_id)
+            if ticket is not None and ticket[0] == ip and ticket[2] > time.monotonic():
+                c2s, s2c = encryption.derive_keys(ticket[1], c_nonce + s_nonce + ticket_id, b"MirrorClip resume", 2)
+                logger.info(f"Sesión con {ip} reanudada con ticket.")
+                return {"nonce": _b64(s_nonce), "resumed": True}, SecureChannel(s2c, c2s), None
+            return {"nonce": _b64(s_nonce), "resumed": False}, None, None
+
+        private_key, public_der = self._identity()
+        c_eph = _unb64(secure, "eph")
+        c_pub = _unb64(secure, "pub")
+        self._check_peer_key(ip, c_pub)
+        eph = x25519.X25519PrivateKey.generate()
+        s_eph = _raw_public(eph)
+        transcript = _transcript(c_nonce, s_nonce, c_eph, s_eph, c_pub, public_der)
+        shared = self._exchange(eph, c_eph)
+        c2s, s2c, resumption = encryption.derive_keys(shared, transcript, b"MirrorClip session", 3)
+        ticket_id = os.urandom(16)
+        reply = {
+            "nonce": _b64(s_nonce), "eph": _b64(s_eph), "pub": _b64(public_der),
+            "sig": _b64(encryption.sign(private_key, b"server" + transcript)), "ticket": _b64(ticket_id),
+        }
+        pending = {"transcript": transcript, "pub": c_pub, "keys": (c2s, s2c), "ticket": (ticket_id, resumption)}
+        return reply, None, pending
+
+    def server_finish(self, ip, pending, signature):
+        """Verifica el AUTH del cliente. Devuelve el canal y da por válido su ticket de sesión."""
+        encryption.verify(pending["pub"], bytes(signature), b"client" + pending["transcript"])
+        self._pin_peer_key(ip, pending["pub"])
+        ticket_id, resumption = pending["ticket"]
+        with self._lock:
+            self._server_tickets[ticket_id] = (ip, resumption, time.monotonic() + self.ticket_lifetime)
+            while len(self._server_tickets) > MAX_SERVER_TICKETS:
+                self._server_tickets.popitem(last=False)
+        c2s, s2c = pending["keys"]
+        return SecureChannel(s2c, c2s)
+
+    def _exchange(self, private_key, peer_public):
+        try:
+            return private_key.exchange(x25519.X25519PublicKey.from_public_bytes(peer_public))
+        except ValueError as e:
+            raise EncryptionError(f"Clave efímera del peer inválida: {e}") from e
@@ -0,0 +1,61 @@
+# send_queue.py
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class PeerSendQueue:
+    """Cola de salida de un peer con su propio hilo emisor.
+
+    Solo importa el estado más reciente del portapapeles: si se acumulan varios clips para
+    el mismo peer antes de poder enviarlos, el nuevo reemplaza al pendiente (latest-wins).
+    Así la memoria por peer queda acotada a un clip pendiente más el que está en vuelo,
+    aunque el peer esté caído. El hilo termina solo tras 'idle_timeout' segundos sin trabajo.
+    """
+
+    def __init__(self, ip, send_func, idle_timeout=30.0):
+        self.ip = ip
+        self.send_func = send_func # send_func(ip, data) -> estado del envío
+        self.idle_timeout = idle_timeout
+        self.coalesced = 0 # Clips descartados por haber llegado uno más nuevo
+        self.last_status = None
+        self._pending = None
+        self._closed = False
+        self._thread = None
+        self._cond = threading.Condition()
+
+    def put(self, data):
+        """Encola 'data' sin bloquear. Reemplaza cualquier clip pendiente de enviar."""
+        with self._cond:
+            if self._closed:
+                return
+            if self._pending is not None:
+                self.coalesced += 1
+                logger.debug(f"Clip pendiente para {self.ip} reemplazado por uno más reciente.")
+            self._pending = data
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True, name=f"Sender-{self.ip}")
+                self._thread.start()
+            self._cond.notify()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._pending = None
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if self._pending is None and not self._closed:
+                    self._cond.wait(self.idle_timeout)
+                if self._pending is None or self._closed:
+                    self._thread = None
+                    return
+                data, self._pending = self._pending, None
+
+            try:
+                self.last_status = self.send_func(self.ip, data)
+            except Exception as e:
+                logger.error(f"Error inesperado en el emisor de {self.ip}: {e}", exc_info=True)
@@ -3,11 +3,13 @@ from tkinter import ttk, messagebox
 import json
 import os # Para os.path.exists
 import threading
-import socket # Para socket.gethostname y obtener_ip_local
+import socket # Para socket.gethostname
 import time
 from config_paths import TRUSTED_USERS_FILE, BANNED_USERS_FILE
 from peer_utils import get_peer_display_name, load_known_peer_details
 from broadcast import descubrir_peers, cargar_lista, guardar_lista # Importar funciones de broadcast.py
+from network_topology import get_topology
+from peer_registry import get_registry
 import logging
 
 logger = logging.getLogger(__name__)
@@ -23,6 +25,9 @@ class EstadoVentana:
         logger.debug(f"[EstadoVentana] IP local detectada: {self.local_ip}")
         
         self.listbox_text_to_ip_map = {} 
+        self.registry = get_registry()
+        self.ultima_busqueda = None # (hora, segundos) de la última búsqueda activa
+        self.buscando = False
 
         main_frame = ttk.Frame(self.root)
         main_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
@@ -61,61 +66,97 @@ class EstadoVentana:
         
         ttk.Button(btn_frame, text="Confiar", command=self.confiar_seleccionado).pack(side=tk.LEFT, padx=5)
         ttk.Button(btn_frame, text="Bloquear", command=self.bloquear_seleccionado).pack(side=tk.LEFT, padx=5)
-        ttk.Button(btn_frame, text="Actualizar Lista", command=self.actualizar_peers).pack(side=tk.RIGHT, padx=5)
+        ttk.Button(btn_frame, text="Buscar Ahora", command=self.actualizar_peers).pack(side=tk.RIGHT, padx=5)
 
-        self.status_label = ttk.Label(main_frame, text="Actualizando lista de peers...")
+        self.status_label = ttk.Label(main_frame, text="")
         self.status_label.pack(pady=(5,0), anchor="w", padx=5)
         
-        self.actualizar_peers()
+        # La lista sale del registro de peers que mantiene el descubrimiento en segundo plano: se
+        # muestra al instante y se actualiza sola. "Buscar Ahora" solo fuerza una búsqueda activa.
+        self.mostrar_registro()
+        self.registry.on_change(self._on_registro_cambiado)
+        self.root.after(self.REFRESCO_MS, self._refresco_periodico)
         self.root.protocol("WM_DELETE_WINDOW", self.on_close)
 
+    REFRESCO_MS = 5000 # Para que los peers caducados desaparezcan aunque no llegue nada nuevo
+
     def on_close(self):
-        # Aquí podrías añadir lógica si necesitas hacer algo específico al cerrar esta ventana
+        self.registry.remove_listener(self._on_registro_cambiado)
         self.root.destroy()
 
+    def _on_registro_cambiado(self, registry):
+        # Llamado desde los hilos de descubrimiento: la lista se redibuja en el hilo de Tk
+        try:
+            if self.root.winfo_exists():
+                self.root.after(0, self.mostrar_registro)
+        except (tk.TclError, RuntimeError):
+            self.registry.remove_listener(self._on_registro_cambiado) # Ventana ya destruida
+
+    def _refresco_periodico(self):
+        if not self.root.winfo_exists(): return
+        self.mostrar_registro()
+        self.root.after(self.REFRESCO_MS, self._refresco_periodico)
+
+    def mostrar_registro(self):
+        if not self.root.winfo_exists(): return
+        banned = cargar_lista(BANNED_USERS_FILE)
+        banned_ips = banned.get("users", []) if isinstance(banned, dict) else banned
+        self.mostrar_peers_en_listbox([ip for ip in self.registry.ips() if ip not in banned_ips])
+
     def obtener_ip_local(self):
         try:
-            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            s.settimeout(0.1)
-            s.connect(("8.8.8.8", 80))
-            ip = s.getsockname()[0]
-            s.close()
-            return ip
+            return get_topology().primary_ip()
         except Exception as e:
             logger.warning(f"No se pudo determinar la IP local principal: {e}")
             return "Desconocida"
 
     def actualizar_peers(self):
-        self.peers_listbox.delete(0, tk.END)
-        self.listbox_text_to_ip_map.clear()
-        self.peers_listbox.insert(tk.END, "Buscando dispositivos en la red...")
-        self.peers_listbox.config(state=tk.DISABLED) # Deshabilitar mientras busca
-        self.status_label.config(text="Actualizando...")
+        """Búsqueda activa opcional: refresca el registro sin esperar al siguiente broadcast periódico."""
+        if self.buscando: return
+        self.buscando = True
+        self.respuestas_busqueda = 0
+        self.status_label.config(text="Buscando dispositivos en la red...")
         threading.Thread(target=self._worker_descubrir_peers, daemon=True).start()
 
     def _worker_descubrir_peers(self):
         try:
             start_time = time.time()
             # descubrir_peers() se importa desde broadcast.py y ya está disponible
-            discovered_ips = descubrir_peers() 
+            # Las respuestas quedan anotadas en el registro de peers; cada una se muestra según llega
+            descubrir_peers(on_peer=lambda ip: self.root.after(0, self._respuesta_busqueda, ip))
             elapsed_time = time.time() - start_time
             
             if self.root.winfo_exists(): # Comprobar si la ventana aún existe
-                self.root.after(0, self.mostrar_peers_en_listbox, discovered_ips, elapsed_time)
+                self.root.after(0, self._fin_busqueda, elapsed_time)
         except Exception as e:
             logger.error(f"Error durante el descubrimiento de peers en el worker: {e}", exc_info=True)
             if self.root.winfo_exists():
                 self.root.after(0, self.mostrar_error_en_listbox, f"Error en descubrimiento: {e}")
 
-    def mostrar_peers_en_listbox(self, peer_ips, elapsed_time):
+    def _respuesta_busqueda(self, peer_ip):
+        if not self.root.winfo_exists() or not self.buscando: return
+        self.respuestas_busqueda += 1
+        self.mostrar_registro()
+
+    def _fin_busqueda(self, elapsed_time):
+        self.buscando = False
+        self.ultima_busqueda = (time.strftime("%H:%M:%S"), elapsed_time)
+        self.mostrar_registro()
+
+    def mostrar_peers_en_listbox(self, peer_ips):
         if not self.root.winfo_exists(): return # No hacer nada si la ventana ya no existe
 
+        selected_ip = None
+        selection_indices = self.peers_listbox.curselection()
+        if selection_indices: # Conservar la selección al redibujar
+            selected_ip = self.listbox_text_to_ip_map.get(self.peers_listbox.get(selection_indices[0]))
+
         self.peers_listbox.config(state=tk.NORMAL) # Habilitar antes de modificar
         self.peers_listbox.delete(0, tk.END)
         self.listbox_text_to_ip_map.clear()
 
         if not peer_ips:
-            self.peers_listbox.insert(tk.END, "No se encontraron otros dispositivos.")
+            self.peers_listbox.insert(tk.END, "No hay otros dispositivos activos en la red.")
             self.peers_listbox.config(state=tk.DISABLED)
         else:
             known_details = load_known_peer_details()
@@ -132,14 +173,20 @@ class EstadoVentana:
                 
                 self.peers_listbox.insert(tk.END, list_entry_text)
                 self.listbox_text_to_ip_map[list_entry_text] = peer_ip
+                if peer_ip == selected_ip:
+                    self.peers_listbox.selection_set(tk.END)
             
             if not found_other_peers:
-                self.peers_listbox.insert(tk.END, "No se encontraron *otros* dispositivos.")
+                self.peers_listbox.insert(tk.END, "No hay *otros* dispositivos activos en la red.")
                 self.peers_listbox.config(state=tk.DISABLED)
 
 
-        timestamp = time.strftime("%H:%M:%S")
-        self.status_label.config(text=f"Actualizado: {timestamp} | Búsqueda: {elapsed_time:.2f}s | Encontrados (otros): {len(self.listbox_text_to_ip_map)}")
+        texto = f"Activos (otros): {len(self.listbox_text_to_ip_map)} | Actualizado: {time.strftime('%H:%M:%S')}"
+        if self.buscando:
+            texto = f"Buscando dispositivos en la red... {self.respuestas_busqueda} respuesta(s)"
+        elif self.ultima_busqueda:
+            texto += f" | Última búsqueda: {self.ultima_busqueda[0]} ({self.ultima_busqueda[1]:.2f}s)"
+        self.status_label.config(text=texto)
 
     def mostrar_error_en_listbox(self, mensaje_error):
         if not self.root.winfo_exists(): return
@@ -147,6 +194,7 @@ class EstadoVentana:
         self.peers_listbox.config(state=tk.NORMAL)
         self.peers_listbox.delete(0, tk.END)
         self.peers_listbox.insert(tk.END, mensaje_error)
+        self.buscando = False
         self.status_label.config(text="Error durante la búsqueda.")
         self.peers_listbox.config(state=tk.DISABLED)
 
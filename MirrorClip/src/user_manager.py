@@ -3,6 +3,7 @@ from tkinter import ttk, messagebox
 import json
 from config_paths import TRUSTED_USERS_FILE, BANNED_USERS_FILE
 from peer_utils import get_peer_display_name, load_known_peer_details # Para mostrar nombres amigables
+from peer_registry import get_registry # Para marcar los contactos activos en la red
 
 class GestionUsuarios:
     def __init__(self, master):
@@ -10,6 +11,7 @@ class GestionUsuarios:
         self.root.title("Gestión de Contactos")
         self.root.geometry("600x450") # Un poco más de alto para los botones
         self.root.minsize(500, 350)
+        self.registry = get_registry()
 
         self.notebook = ttk.Notebook(self.root)
 
@@ -39,11 +41,21 @@ class GestionUsuarios:
 
         # Botón para refrescar ambas listas manualmente
         # ttk.Button(self.root, text="Actualizar Listas", command=self._refresh_all_lists).pack(pady=10) # Eliminado, refresh es implicito
+        self.registry.on_change(self._on_registro_cambiado) # Marcar al momento quién se conecta o desaparece
         self.root.protocol("WM_DELETE_WINDOW", self.on_close)
 
     def on_close(self):
+        self.registry.remove_listener(self._on_registro_cambiado)
         self.root.destroy()
 
+    def _on_registro_cambiado(self, registry):
+        # Llamado desde los hilos de descubrimiento: las listas se redibujan en el hilo de Tk
+        try:
+            if self.root.winfo_exists():
+                self.root.after(0, self._refresh_all_lists)
+        except (tk.TclError, RuntimeError):
+            self.registry.remove_listener(self._on_registro_cambiado) # Ventana ya destruida
+
     def _build_list_frame(self, parent_frame, list_type_name, secondary_action_command, secondary_action_text):
         """Construye un frame con lista y controles, y devuelve la instancia de la listbox."""
         top_frame = ttk.Frame(parent_frame)
@@ -95,6 +107,8 @@ class GestionUsuarios:
                 list_entry_text = f"{display_name}"
                 if display_name != ip_address: # Si el nombre es diferente a la IP, añadir IP para claridad
                     list_entry_text += f" ({ip_address})"
+                if self.registry.is_alive(ip_address):
+                    list_entry_text += " - activo"
                 
                 listbox_widget.insert(tk.END, list_entry_text)
                 listbox_widget.ip_map[list_entry_text] = ip_address
@@ -250,5 +264,6 @@ class GestionUsuarios:
 
     def _refresh_all_lists(self):
         """Actualiza el contenido de ambas listboxes."""
+        if not self.root.winfo_exists(): return
         self._load_users_into_listbox(TRUSTED_USERS_FILE, self.trusted_listbox)
         self._load_users_into_listbox(BANNED_USERS_FILE, self.banned_listbox)
\ No newline at end of file
@@ -0,0 +1,318 @@
+# x11_clipboard.py
+# Portapapeles de X11 mediante una conexión persistente al servidor X (python-xlib), sin lanzar
+# xclip/xsel en cada lectura o escritura.
+#
+# Un único hilo es dueño de la conexión: atiende los eventos de selección (peticiones de otras
+# aplicaciones cuando somos propietarios del portapapeles, respuestas a nuestras lecturas,
+# transferencias INCR de contenidos grandes y avisos XFixes de cambio de propietario) y ejecuta
+# las operaciones que le encargan los demás hilos.
+import os
+import queue
+import select
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+try:
+    from Xlib import X, Xatom, display as xdisplay
+    from Xlib.protocol import event as xevent
+    from Xlib.ext import xfixes
+except ImportError:
+    X = None
+
+_READ_TIMEOUT = 2.0 # Segundos máximos esperando a que el propietario entregue el contenido
+_MAX_PROPERTY_UNITS = 0x1FFFFFFF # Longitud máxima pedida a GetProperty (en unidades de 4 bytes)
+
+
+def _id(resource):
+    """Identificador numérico de una ventana (python-xlib entrega objetos en los eventos)."""
+    return getattr(resource, "id", resource)
+
+
+class X11Unavailable(Exception):
+    """No hay servidor X o python-xlib no está instalado."""
+
+
+class _Job:
+    def __init__(self, func, args):
+        self.func = func
+        self.args = args
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class X11Clipboard:
+    """Lectura y escritura de la selección CLIPBOARD por una conexión X que se mantiene abierta."""
+
+    name = "x11"
+
+    def __init__(self, display_name=None):
+        if X is None:
+            raise X11Unavailable("python-xlib no está instalado")
+        if not (display_name or os.environ.get("DISPLAY")):
+            raise X11Unavailable("No hay servidor X (DISPLAY no definido)")
+        try:
+            self.display = xdisplay.Display(display_name)
+        except Exception as e:
+            raise X11Unavailable(f"No se pudo abrir el display X: {e}") from e
+
+        screen = self.display.screen()
+        self.window = screen.root.create_window(
+            -10, -10, 1, 1, 0, screen.root_depth, event_mask=X.PropertyChangeMask
+        )
+        self.clipboard = self.display.get_atom("CLIPBOARD")
+        self.targets_atom = self.display.get_atom("TARGETS")
+        self.incr_atom = self.display.get_atom("INCR")
+        self.utf8_atom = self.display.get_atom("UTF8_STRING")
+        self.property = self.display.get_atom("MIRRORCLIP_SELECTION")
+        # Trozo máximo por ChangeProperty; los contenidos mayores se sirven con INCR
+        self.chunk_size = max(4096, min(256 * 1024, self.display.info.max_request_length * 4 - 1024))
+
+        self._atom_names = {}
+        self._owned = None # {átomo de destino: bytes} mientras somos propietarios del portapapeles
+        self._owned_text = None
+        self._pending_read = None # Lectura en curso (solo una a la vez, ver _read_lock)
+        self._read_lock = threading.Lock()
+        self._incr_out = {} # {(ventana, propiedad): [datos, posición, tipo]} envíos INCR en curso
+        self._jobs = queue.Queue()
+        self._wake_r, self._wake_w = os.pipe()
+        self._running = True
+
+        # Con XFixes, cada cambio de propietario actualiza el testigo de cambios sin leer el contenido
+        self._token = None
+        self.has_xfixes = self.display.has_extension("XFIXES")
+        if self.has_xfixes:
+            self.display.xfixes_query_version()
+            self.display.xfixes_select_selection_input(
+                self.window, self.clipboard,
+                xfixes.XFixesSetSelectionOwnerNotifyMask
+                | xfixes.XFixesSelectionWindowDestroyNotifyMask
+                | xfixes.XFixesSelectionClientCloseNotifyMask
+            )
+            self._token = (_id(self.display.get_selection_owner(self.clipboard)), 0)
+        self.display.flush()
+
+        self._thread = threading.Thread(target=self._loop, daemon=True, name="X11Clipboard")
+        self._thread.start()
+
+    # --- API usada desde otros hilos ---
+
+    def change_token(self):
+        """Testigo (propietario, instante) de la selección; cambia solo si alguien copia algo.
+
+        None si el servidor no tiene XFixes (en ese caso hay que leer el contenido para saberlo).
+        """
+        return self._token
+
+    def paste_text(self):
+        if self._owned is not None:
+            return self._owned_text or "" # Somos el propietario: no hace falta preguntar al servidor
+        data = self._read(self.utf8_atom)
+        if data is None:
+            data = self._read(Xatom.STRING)
+            return bytes(data).decode('latin-1') if data else ""
+        return bytes(data).decode('utf-8', errors='replace')
+
+    def copy_text(self, text):
+        self._own(self._text_targets(text), text)
+
+    def targets(self):
+        """Tipos que ofrece el propietario actual del portapapeles (nombres de átomos)."""
+        owned = self._owned
+        if owned is not None:
+            return [self._atom_name(atom) for atom in owned]
+        value = self._read(self.targets_atom)
+        if not value:
+            return []
+        return [self._atom_name(atom) for atom in value]
+
+    def read(self, mime):
+        owned = self._owned
+        atom = self._atom(mime)
+        if owned is not None:
+            return owned.get(atom)
+        data = self._read(atom)
+        return bytes(data) if data else None
+
+    def write(self, mime, data, text=None):
+        """Ofrece 'data' como 'mime'; con 'text' se ofrece también como texto plano (UTF8_STRING...)."""
+        targets = {self._atom(mime): bytes(data)}
+        if text is not None:
+            targets.update(self._text_targets(text))
+        self._own(targets, text)
+
+    def _text_targets(self, text):
+        data = text.encode('utf-8')
+        return {self.utf8_atom: data, Xatom.STRING: text.encode('latin-1', errors='replace'),
+                self._atom("text/plain;charset=utf-8"): data}
+
+    def close(self):
+        self._running = False
+        os.write(self._wake_w, b"\0")
+        self._thread.join(2)
+        try:
+            self.display.close()
+        except Exception:
+            pass
+
+    # --- Comunicación con el hilo de X ---
+
+    def _call(self, func, *args):
+        if threading.current_thread() is self._thread:
+            return func(*args)
+        job = _Job(func, args)
+        self._jobs.put(job)
+        os.write(self._wake_w, b"\0")
+        if not job.done.wait(_READ_TIMEOUT):
+            raise TimeoutError("El hilo del portapapeles X11 no responde")
+        if job.error is not None:
+            raise job.error
+        return job.result
+
+    def _read(self, target):
+        with self._read_lock:
+            pending = {"target": target, "done": threading.Event(), "data": None, "incr": None}
+
+            def start():
+                self._pending_read = pending
+                self.window.convert_selection(self.clipboard, target, self.property, X.CurrentTime)
+
+            self._call(start)
+            if not pending["done"].wait(_READ_TIMEOUT):
+                logger.debug(f"Sin respuesta del propietario del portapapeles para {self._atom_name(target)}")
+            self._call(self._clear_pending, pending)
+            return pending["data"]
+
+    def _clear_pending(self, pending):
+        if self._pending_read is pending:
+            self._pending_read = None
+
+    def _own(self, data_by_target, text):
+        def take():
+            self._owned = data_by_target
+            self._owned_text = text
+            self.window.set_selection_owner(self.clipboard, X.CurrentTime)
+            if _id(self.display.get_selection_owner(self.clipboard)) != self.window.id:
+                self._owned = self._owned_text = None
+                raise OSError("No se pudo tomar la propiedad del portapapeles X11")
+        self._call(take)
+
+    def _atom(self, name):
+        return self._call(self.display.get_atom, name)
+
+    def _atom_name(self, atom):
+        name = self._atom_names.get(atom)
+        if name is None:
+            name = self._atom_names[atom] = self._call(self.display.get_atom_name, atom)
+        return name
+
+    # --- Hilo de X ---
+
+    def _loop(self):
+        fd = self.display.fileno()
+        while self._running:
+            try:
+                while True:
+                    try:
+                        job = self._jobs.get_nowait()
+                    except queue.Empty:
+                        break
+                    try:
+                        job.result = job.func(*job.args)
+                    except Exception as e:
+                        job.error = e
+                    job.done.set()
+                while self.display.pending_events():
+                    self._handle(self.display.next_event())
+                self.display.flush()
+                readable, _, _ = select.select([fd, self._wake_r], [], [], 1.0)
+                if self._wake_r in readable:
+                    os.read(self._wake_r, 4096)
+            except Exception as e:
+                if self._running:
+                    logger.error(f"Error en el hilo del portapapeles X11: {e}", exc_info=True)
+
+    def _handle(self, ev):
+        if ev.type == X.SelectionRequest:
+            self._serve(ev)
+        elif ev.type == X.SelectionNotify:
+            self._on_selection_notify(ev)
+        elif ev.type == X.PropertyNotify:
+            self._on_property_notify(ev)
+        elif ev.type == X.SelectionClear:
+            if ev.atom == self.clipboard:
+                self._owned = self._owned_text = None # Otra aplicación ha copiado algo
+        elif self.has_xfixes and isinstance(ev, xfixes.SelectionNotify) and ev.selection == self.clipboard:
+            self._token = (_id(ev.owner), ev.selection_timestamp)
+
+    def _on_selection_notify(self, ev):
+        pending = self._pending_read
+        if pending is None or _id(ev.requestor) != self.window.id or ev.target != pending["target"]:
+            return
+        if ev.property == X.NONE:
+            pending["done"].set() # El propietario no ofrece ese tipo
+            return
+        prop = self.window.get_property(self.property, X.AnyPropertyType, 0, _MAX_PROPERTY_UNITS, delete=True)
+        if prop is None:
+            pending["done"].set()
+        elif prop.property_type == self.incr_atom:
+            pending["incr"] = bytearray() # Al borrar la propiedad el propietario empieza a enviar trozos
+        else:
+            pending["data"] = prop.value
+            pending["done"].set()
+
+    def _on_property_notify(self, ev):
+        pending = self._pending_read
+        if (pending is not None and pending["incr"] is not None and _id(ev.window) == self.window.id
+                and ev.atom == self.property and ev.state == X.PropertyNewValue):
+            prop = self.window.get_property(self.property, X.AnyPropertyType, 0, _MAX_PROPERTY_UNITS, delete=True)
+            if prop is None or not len(prop.value):
+                pending["data"] = bytes(pending["incr"]) # Trozo vacío: fin de la transferencia
+                pending["done"].set()
+            else:
+                pending["incr"] += prop.value
+            return
+        if ev.state == X.PropertyDelete:
+            transfer = self._incr_out.get((_id(ev.window), ev.atom))
+            if transfer is not None:
+                self._send_next_chunk(_id(ev.window), ev.atom, transfer)
+
+    def _serve(self, ev):
+        """Entrega nuestro contenido a la aplicación que lo pide (somos propietarios del portapapeles)."""
+        requestor = self.display.create_resource_object('window', _id(ev.requestor))
+        prop = ev.property if ev.property != X.NONE else ev.target # Clientes antiguos sin propiedad
+        owned = self._owned
+        served = False
+        if owned is not None and ev.selection == self.clipboard:
+            if ev.target == self.targets_atom:
+                # Sin TIMESTAMP: la selección se toma con CurrentTime y no tenemos una hora real que dar
+                atoms = [self.targets_atom] + list(owned)
+                requestor.change_property(prop, Xatom.ATOM, 32, atoms)
+                served = True
+            elif ev.target in owned:
+                data = owned[ev.target]
+                if len(data) > self.chunk_size:
+                    # Transferencia incremental: anunciamos el tamaño y enviamos un trozo cada vez
+                    # que el receptor borra la propiedad
+                    requestor.change_attributes(event_mask=X.PropertyChangeMask)
+                    requestor.change_property(prop, self.incr_atom, 32, [len(data)])
+                    self._incr_out[(requestor.id, prop)] = [data, 0, ev.target]
+                else:
+                    requestor.change_property(prop, ev.target, 8, data)
+                served = True
+        notify = xevent.SelectionNotify(
+            time=ev.time, requestor=requestor, selection=ev.selection,
+            target=ev.target, property=prop if served else X.NONE
+        )
+        requestor.send_event(notify)
+
+    def _send_next_chunk(self, window_id, prop, transfer):
+        data, offset, target = transfer
+        requestor = self.display.create_resource_object('window', window_id)
+        chunk = data[offset:offset + self.chunk_size]
+        requestor.change_property(prop, target, 8, chunk) # Un trozo vacío marca el final
+        if not chunk:
+            del self._incr_out[(window_id, prop)]
+        transfer[1] = offset + len(chunk)
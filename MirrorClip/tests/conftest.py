@@ -0,0 +1,6 @@
+# conftest.py
+# Los módulos de MirrorClip están en src/ y se importan por su nombre, como en la aplicación.
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
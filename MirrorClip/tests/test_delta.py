@@ -0,0 +1,72 @@
+# test_delta.py
+import os
+import pytest
+import delta
+from delta import DeltaError, apply_delta, compute_delta
+
+BLOCK = 64
+
+
+@pytest.mark.parametrize("base, new", [
+    (b"", b""),
+    (b"", b"contenido nuevo"),
+    (b"contenido viejo" * 100, b""),
+    (b"igual" * 500, b"igual" * 500),
+    (os.urandom(BLOCK * 20), os.urandom(BLOCK * 7 + 13)),
+])
+def test_ida_y_vuelta(base, new):
+    assert apply_delta(base, compute_delta(base, new, BLOCK), BLOCK) == new
+
+
+def test_cambios_locales_reutilizan_la_base():
+    base = os.urandom(BLOCK * 100)
+    new = base[:BLOCK * 10] + b"insertado" + base[BLOCK * 10:BLOCK * 60] + base[BLOCK * 61:] + b"final"
+    ops = compute_delta(base, new, BLOCK)
+    assert apply_delta(base, ops, BLOCK) == new
+    assert len(ops) < len(new) // 10
+
+
+def test_bloque_desplazado_un_byte():
+    base = os.urandom(BLOCK * 10)
+    new = b"x" + base
+    ops = compute_delta(base, new, BLOCK)
+    assert apply_delta(base, ops, BLOCK) == new
+    assert len(ops) < BLOCK
+
+
+def test_operacion_desconocida():
+    with pytest.raises(DeltaError):
+        apply_delta(b"base", b"Z" + bytes(8), BLOCK)
+
+
+def test_copia_fuera_de_la_base():
+    ops = delta._OP_COPY + delta._COPY.pack(5, 1)
+    with pytest.raises(DeltaError):
+        apply_delta(b"a" * BLOCK * 2, ops, BLOCK)
+
+
+def test_literal_truncado():
+    ops = delta._OP_DATA + delta._DATA.pack(100) + b"corto"
+    with pytest.raises(DeltaError):
+        apply_delta(b"", ops, BLOCK)
+
+
+def test_cabecera_truncada():
+    ops = compute_delta(os.urandom(BLOCK * 4), os.urandom(BLOCK * 4), BLOCK)
+    with pytest.raises(DeltaError):
+        apply_delta(b"", ops[:3], BLOCK)
+
+
+def test_tamano_maximo():
+    base = os.urandom(BLOCK * 10)
+    ops = compute_delta(base, base * 3, BLOCK)
+    with pytest.raises(DeltaError):
+        apply_delta(base, ops, BLOCK, max_size=len(base) * 2)
+    assert apply_delta(base, ops, BLOCK, max_size=len(base) * 3) == base * 3
+
+
+def test_base_distinta_no_reproduce_el_contenido():
+    base = os.urandom(BLOCK * 10)
+    new = base + b"fin"
+    ops = compute_delta(base, new, BLOCK)
+    assert apply_delta(os.urandom(len(base)), ops, BLOCK) != new
@@ -0,0 +1,99 @@
+# test_outbox.py
+import os
+import stat
+import sys
+import time
+import pytest
+from outbox import Outbox, RECORD_HEADER
+
+IP = "192.168.1.20"
+
+
+@pytest.fixture
+def outbox(tmp_path):
+    return Outbox(tmp_path / "outbox", keep=3)
+
+
+def _datos(records):
+    return [record.data for record in records]
+
+
+def test_put_take_ack(outbox):
+    outbox.put(IP, b"uno", (1, 7))
+    outbox.put(IP, b"dos")
+    records = outbox.take(IP)
+    assert _datos(records) == [b"uno", b"dos"]
+    assert records[0].stamp == (1, 7) and records[1].stamp is None
+    assert outbox.take(IP) == records # take() no consume nada
+    outbox.ack(IP, records)
+    assert outbox.take(IP) == [] and not outbox.has(IP)
+
+
+def test_ack_conserva_lo_guardado_despues_de_take(outbox):
+    outbox.put(IP, b"uno")
+    records = outbox.take(IP)
+    outbox.put(IP, b"durante el vaciado")
+    outbox.ack(IP, records)
+    assert _datos(outbox.take(IP)) == [b"durante el vaciado"]
+
+
+def test_ack_parcial(outbox):
+    for data in (b"uno", b"dos", b"tres"):
+        outbox.put(IP, data)
+    records = outbox.take(IP)
+    outbox.ack(IP, records[:1])
+    assert _datos(outbox.take(IP)) == [b"dos", b"tres"]
+
+
+def test_solo_los_mas_recientes(outbox):
+    for i in range(10):
+        outbox.put(IP, b"clip %d" % i)
+    assert _datos(outbox.take(IP)) == [b"clip 7", b"clip 8", b"clip 9"]
+
+
+def test_caducados(tmp_path):
+    outbox = Outbox(tmp_path, max_age=0.05)
+    outbox.put(IP, b"viejo")
+    time.sleep(0.1)
+    outbox.put(IP, b"nuevo")
+    assert _datos(outbox.take(IP)) == [b"nuevo"]
+
+
+def test_demasiado_grande(tmp_path):
+    outbox = Outbox(tmp_path, max_bytes=10)
+    outbox.put(IP, b"x" * 11)
+    assert not outbox.has(IP)
+
+
+def test_registro_truncado(outbox):
+    outbox.put(IP, b"completo")
+    outbox.put(IP, b"a medias")
+    path = outbox._path(IP)
+    with open(path, "r+b") as f:
+        f.truncate(os.path.getsize(path) - 3) # Como si el proceso muriera escribiendo
+    assert _datos(outbox.take(IP)) == [b"completo"]
+    reiniciada = Outbox(outbox.directory, keep=3) # Al arrancar de nuevo, sin recuentos en memoria
+    reiniciada.put(IP, b"siguiente") # No debe quedar pegado a los bytes truncados
+    assert _datos(reiniciada.take(IP)) == [b"completo", b"siguiente"]
+
+
+def test_cabecera_truncada(outbox):
+    outbox.put(IP, b"completo")
+    with open(outbox._path(IP), "ab") as f:
+        f.write(RECORD_HEADER.pack(100, time.time(), 0, 0)[:5])
+    assert _datos(outbox.take(IP)) == [b"completo"]
+
+
+def test_ipv6(outbox):
+    outbox.put("fe80::1", b"clip")
+    assert ":" not in outbox._path("fe80::1").name
+    assert _datos(outbox.take("fe80::1")) == [b"clip"]
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="Permisos POSIX")
+def test_permisos_privados(outbox):
+    outbox.put(IP, b"secreto")
+    assert stat.S_IMODE(outbox._path(IP).stat().st_mode) == 0o600
+    outbox.put(IP, b"otro")
+    outbox.ack(IP, outbox.take(IP)[:1]) # Reescritura por un archivo temporal
+    assert stat.S_IMODE(outbox._path(IP).stat().st_mode) == 0o600
@@ -0,0 +1,99 @@
+# test_protocol.py
+import os
+import socket
+import threading
+import pytest
+from protocol import (
+    FrameReader, ProtocolError, HEADER, HEADER_SIZE, PROTOCOL_MAGIC, PROTOCOL_VERSION, MSG_CLIP, MSG_HELLO,
+    MSG_PING, build_frame,
+)
+
+
+@pytest.fixture
+def par():
+    a, b = socket.socketpair()
+    yield a, b
+    a.close()
+    b.close()
+
+
+def _mensajes(frames):
+    return [(msg_type, bytes(payload)) for msg_type, _, payload in frames]
+
+
+def test_mensajes_troceados_bloqueante(par):
+    emisor, receptor = par
+    grande = os.urandom(1_000_000)
+    datos = build_frame(MSG_CLIP, grande) + build_frame(MSG_PING) + build_frame(MSG_HELLO, b"{}")
+
+    def enviar():
+        for i in range(0, len(datos), 4999):
+            emisor.sendall(datos[i:i + 4999])
+    hilo = threading.Thread(target=enviar)
+    hilo.start()
+    reader = FrameReader(initial_buffer=1024)
+    recibidos = [reader.read_message(receptor) for _ in range(3)]
+    hilo.join()
+    assert _mensajes(recibidos) == [(MSG_CLIP, grande), (MSG_PING, b""), (MSG_HELLO, b"{}")]
+
+
+def test_mensajes_troceados_no_bloqueante(par):
+    emisor, receptor = par
+    receptor.setblocking(False)
+    datos = build_frame(MSG_CLIP, b"a" * 5000) + build_frame(MSG_PING)
+    reader = FrameReader(initial_buffer=100)
+    recibidos = []
+    for i in range(0, len(datos), 7): # Cabeceras y payloads partidos en cualquier punto
+        emisor.sendall(datos[i:i + 7])
+        mensajes, cerrado = reader.read_available(receptor)
+        recibidos += mensajes
+        assert not cerrado
+    emisor.close()
+    mensajes, cerrado = reader.read_available(receptor)
+    assert cerrado and not mensajes
+    assert _mensajes(recibidos) == [(MSG_CLIP, b"a" * 5000), (MSG_PING, b"")]
+
+
+def test_cierre_entre_mensajes(par):
+    emisor, receptor = par
+    emisor.close()
+    assert FrameReader().read_message(receptor) is None
+
+
+def test_cierre_a_mitad_de_mensaje(par):
+    emisor, receptor = par
+    emisor.sendall(build_frame(MSG_CLIP, b"x" * 100)[:HEADER_SIZE + 10])
+    emisor.close()
+    with pytest.raises(ProtocolError):
+        FrameReader().read_message(receptor)
+
+
+def test_limite_de_tamano(par):
+    emisor, receptor = par
+    emisor.sendall(HEADER.pack(PROTOCOL_MAGIC, PROTOCOL_VERSION, MSG_CLIP, 0, 16 * 1024 + 1))
+    with pytest.raises(ProtocolError):
+        FrameReader(max_payload=16 * 1024).read_message(receptor)
+
+
+def test_limite_de_tamano_no_bloqueante(par):
+    emisor, receptor = par
+    receptor.setblocking(False)
+    emisor.sendall(HEADER.pack(PROTOCOL_MAGIC, PROTOCOL_VERSION, MSG_CLIP, 0, 1 << 28))
+    with pytest.raises(ProtocolError):
+        FrameReader(max_payload=1024).read_available(receptor)
+
+
+def test_tamano_anunciado_no_reserva_memoria(par):
+    emisor, receptor = par
+    receptor.setblocking(False)
+    emisor.sendall(HEADER.pack(PROTOCOL_MAGIC, PROTOCOL_VERSION, MSG_CLIP, 0, 200 * 1024 * 1024) + b"abc")
+    reader = FrameReader(initial_buffer=4096)
+    assert reader.read_available(receptor) == ([], False)
+    assert len(reader._current[2]) == 4096
+
+
+def test_cabecera_invalida(par):
+    emisor, receptor = par
+    emisor.sendall(HEADER.pack(b"XX", PROTOCOL_VERSION, MSG_CLIP, 0, 0))
+    with pytest.raises(ProtocolError):
+        FrameReader().read_message(receptor)
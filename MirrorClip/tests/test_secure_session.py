@@ -0,0 +1,108 @@
+# test_secure_session.py
+import base64
+import json
+import os
+import pytest
+import encryption
+import secure_session
+from encryption import EncryptionError
+from secure_session import SessionSecurity
+
+SERVER_IP = "10.0.0.1" # Como lo ve el cliente
+CLIENT_IP = "10.0.0.2" # Como lo ve el servidor
+
+
+@pytest.fixture(scope="module")
+def keys_dir(tmp_path_factory):
+    return tmp_path_factory.mktemp("keys")
+
+
+@pytest.fixture
+def peer_keys(keys_dir, tmp_path, monkeypatch):
+    monkeypatch.setattr(encryption, "KEYS_DIR", keys_dir)
+    path = tmp_path / "known_peer_keys.json"
+    monkeypatch.setattr(secure_session, "PEER_KEYS_FILE", path)
+    return path
+
+
+def _pinned(security):
+    """Claves registradas por una instancia (cada equipo tiene su propio archivo; aquí lo comparten)."""
+    with security._lock:
+        return dict(security._load_peer_keys())
+
+
+def _handshake(client, server):
+    secure, state = client.client_hello(SERVER_IP)
+    reply, channel, pending = server.server_respond(CLIENT_IP, secure)
+    client_channel, auth = client.client_finish(SERVER_IP, state, reply)
+    if channel is None:
+        channel = server.server_finish(CLIENT_IP, pending, auth)
+    return client_channel, channel, auth
+
+
+def _assert_connected(client_channel, server_channel):
+    assert server_channel.open(1, 8, client_channel.seal(1, 8, b"del cliente")) == b"del cliente"
+    assert client_channel.open(4, 8, server_channel.seal(4, 8, b"del servidor")) == b"del servidor"
+
+
+def test_handshake_completo(peer_keys):
+    client, server = SessionSecurity(), SessionSecurity()
+    client_channel, server_channel, auth = _handshake(client, server)
+    assert auth is not None
+    _assert_connected(client_channel, server_channel)
+    assert set(_pinned(client)) == {SERVER_IP}
+    assert set(_pinned(server)) == {CLIENT_IP}
+
+
+def test_reanudacion_con_ticket(peer_keys):
+    client, server = SessionSecurity(), SessionSecurity()
+    _handshake(client, server)
+    secure, state = client.client_hello(SERVER_IP)
+    assert "ticket" in secure and "pub" not in secure
+    reply, server_channel, pending = server.server_respond(CLIENT_IP, secure)
+    assert reply["resumed"] and pending is None
+    client_channel, auth = client.client_finish(SERVER_IP, state, reply)
+    assert auth is None
+    _assert_connected(client_channel, server_channel)
+
+
+def test_ticket_de_otra_ip_o_desconocido(peer_keys):
+    client, server = SessionSecurity(), SessionSecurity()
+    _handshake(client, server)
+    secure, state = client.client_hello(SERVER_IP)
+    reply, channel, _ = server.server_respond("10.0.0.99", secure)
+    assert channel is None and reply["resumed"] is False
+    assert client.client_finish(SERVER_IP, state, reply) == (None, None)
+    secure, _ = client.client_hello(SERVER_IP) # Ticket descartado: handshake completo
+    assert "ticket" not in secure and "pub" in secure
+
+
+def test_firma_del_servidor_invalida_no_registra_la_clave(peer_keys):
+    client, server = SessionSecurity(), SessionSecurity()
+    secure, state = client.client_hello(SERVER_IP)
+    reply, _, _ = server.server_respond(CLIENT_IP, secure)
+    reply["sig"] = base64.b64encode(os.urandom(256)).decode("ascii")
+    with pytest.raises(EncryptionError):
+        client.client_finish(SERVER_IP, state, reply)
+    assert SERVER_IP not in _pinned(client)
+    assert not peer_keys.exists()
+
+
+def test_firma_del_cliente_invalida_no_registra_la_clave(peer_keys):
+    client, server = SessionSecurity(), SessionSecurity()
+    secure, state = client.client_hello(SERVER_IP)
+    reply, _, pending = server.server_respond(CLIENT_IP, secure)
+    client.client_finish(SERVER_IP, state, reply)
+    with pytest.raises(EncryptionError):
+        server.server_finish(CLIENT_IP, pending, os.urandom(256))
+    assert CLIENT_IP not in _pinned(server)
+
+
+def test_clave_distinta_de_la_registrada(peer_keys):
+    peer_keys.write_text(json.dumps({SERVER_IP: "0" * 64}), encoding="utf-8")
+    client, server = SessionSecurity(), SessionSecurity()
+    secure, state = client.client_hello(SERVER_IP)
+    reply, _, _ = server.server_respond(CLIENT_IP, secure)
+    with pytest.raises(EncryptionError):
+        client.client_finish(SERVER_IP, state, reply)
+    assert _pinned(client)[SERVER_IP] == "0" * 64